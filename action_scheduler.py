@@ -0,0 +1,129 @@
+import heapq
+import itertools
+import traceback
+from collections import deque
+from contextvars import copy_context
+from threading import Condition, Thread
+
+from logging_config import logger
+
+# Action priorities, most urgent first
+REPLACE = 0  # Replacing filled grid orders
+PROTECT = 1  # Breakout entries and their protective stops
+CANCEL = 2  # Resets, cancels and re-centering
+BUILD = 3  # New grids
+POLL = 4  # Routine checks with nothing known to do
+PRIORITY_NAMES = {REPLACE: "replace", PROTECT: "protect", CANCEL: "cancel", BUILD: "build", POLL: "poll"}
+# Actions from this priority on are bulk work and never take the reserved workers
+BULK = BUILD
+
+DEFAULT_WORKERS = 4
+RESERVED_WORKERS = 1
+
+
+class ActionScheduler:
+    """
+    Worker pool that runs queued actions by priority.
+
+    Actions of one symbol run one at a time, in submission order; actions of different
+    symbols run concurrently, most urgent first. Bulk actions (grid builds and polls)
+    occupy at most workers - reserved threads, so a fill replacement always finds a free
+    worker. Request pacing comes from the shared rate budget that every request draws
+    from, not from the scheduler. Actions run in the context (paper backend, state
+    directory) they were submitted from.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, reserved=RESERVED_WORKERS):
+        self.workers = max(workers, 1)
+        self.bulk_slots = max(self.workers - reserved, 1)
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = Condition()
+        self._waiting = {}  # symbol -> deque of actions queued behind its running or queued action
+        self._claimed = set()  # symbols with an action in the heap or running
+        self._running_bulk = 0
+        self._unfinished = 0
+        self._stopping = False
+        self._fatal = None  # SystemExit or KeyboardInterrupt raised by an action, re-raised by drain()
+        self._threads = [Thread(target=self._work, name=f"action-worker-{i}", daemon=True) for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, symbol, priority, fn, *args, **kwargs):
+        """Queues fn(*args, **kwargs) for symbol with the given priority."""
+        action = (priority, next(self._sequence), symbol, copy_context(), fn, args, kwargs)
+        with self._condition:
+            self._unfinished += 1
+            if symbol in self._claimed:
+                self._waiting.setdefault(symbol, deque()).append(action)
+            else:
+                self._claimed.add(symbol)
+                heapq.heappush(self._heap, action)
+                self._condition.notify_all()
+
+    def drain(self):
+        """
+        Blocks until every submitted action has finished.
+
+        If an action raised SystemExit or KeyboardInterrupt (e.g. the -2019 emergency exit),
+        no further actions are started and the exception is re-raised here, on the
+        calling thread, so the process stops instead of trading on.
+        """
+        with self._condition:
+            while self._unfinished and self._fatal is None:
+                self._condition.wait()
+            if self._fatal is not None:
+                raise self._fatal
+
+    def shutdown(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def _next_action(self):
+        with self._condition:
+            while True:
+                if self._stopping or self._fatal is not None:
+                    return None
+                if self._heap and (self._heap[0][0] < BULK or self._running_bulk < self.bulk_slots):
+                    action = heapq.heappop(self._heap)
+                    if action[0] >= BULK:
+                        self._running_bulk += 1
+                    return action
+                self._condition.wait()
+
+    def _finish(self, action):
+        priority, _, symbol = action[:3]
+        with self._condition:
+            if priority >= BULK:
+                self._running_bulk -= 1
+            waiting = self._waiting.get(symbol)
+            if waiting:
+                heapq.heappush(self._heap, waiting.popleft())
+                if not waiting:
+                    del self._waiting[symbol]
+            else:
+                self._claimed.discard(symbol)
+            self._unfinished -= 1
+            self._condition.notify_all()
+
+    def _work(self):
+        while True:
+            action = self._next_action()
+            if action is None:
+                return
+            priority, _, symbol, context, fn, args, kwargs = action
+            try:
+                context.run(fn, *args, **kwargs)
+            except Exception as e:
+                print(f"{symbol} {PRIORITY_NAMES.get(priority, priority)} action failed: {e}")
+                logger.error(f"{symbol} {PRIORITY_NAMES.get(priority, priority)} action failed: {traceback.format_exc()}")
+            except BaseException as e:
+                logger.error(f"{symbol} {PRIORITY_NAMES.get(priority, priority)} action stopped the bot: {e!r}")
+                with self._condition:
+                    if self._fatal is None:
+                        self._fatal = e
+            finally:
+                self._finish(action)
@@ -1,26 +1,43 @@
 import requests
 import hashlib
 import hmac
+import json
 import time
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from logging_config import logger
-from file_utils import load_json
-import pandas as pd
+from file_utils import load_json, load_secrets
+from order_journal import record_intent, record_ack, record_failed, ORDER_NOT_FOUND, DUPLICATE_CLIENT_ORDER_ID
+from indicator_cache import memoize_on_candle, invalidate_symbol
+from candle_store import candle_store
+from paper_trading import active_backend, submit_with_context
+from strategy_sim import evaluate_triggers
+from latency_tracer import mark_current
+from shared_state import klines_weight, update_positions_snapshot, get_positions_snapshot
+from resilience import (request, classify_response, server_timestamp, record_failure, recent_failures, TRANSIENT,
+                        TRANSIENT_CODES, RATE_LIMIT_CODES)
 import numpy as np
 from datetime import datetime
 
 
-# Fetch settings
-secrets = load_json("secrets.json")
-api_key = secrets.get("api_key")
-api_secret = secrets.get("api_secret")
-base_url = secrets.get("base_url")
+def get_base_url():
+    """REST base URL from secrets.json (read on first use)."""
+    return load_secrets().get("base_url")
+
+# Unhandled error codes reset a symbol's grid only when they repeat within the window
+UNHANDLED_ERROR_LIMIT = 3
+UNHANDLED_ERROR_WINDOW = 300  # Seconds
+# Pause before every new order; set to 0 when the action scheduler paces requests by the rate budget instead
+order_pacing = 0.5
 
 def get_market_price(symbol, api_key, api_secret):
+    backend = active_backend()
+    if backend is not None:
+        return backend.get_market_price(symbol)
     try:
         endpoint = '/fapi/v1/ticker/price'
         params = {'symbol': symbol}
-        response = requests.get(base_url + endpoint, params=params)
+        response = request('GET', get_base_url() + endpoint, params, symbol=symbol)
         if response.status_code == 200:
             return float(response.json()['price'])
         else:
@@ -30,6 +47,24 @@ def get_market_price(symbol, api_key, api_secret):
         print(f"Error: {e}")
         return None
 
+def get_market_prices(api_key, api_secret):
+    """
+    Fetches the last price of every symbol in one request.
+
+    Returns:
+        dict: {symbol: price}, empty if the request failed.
+    """
+    backend = active_backend()
+    if backend is not None:
+        return dict(backend.prices)
+    try:
+        response = request('GET', get_base_url() + '/fapi/v1/ticker/price', weight=2)
+        response.raise_for_status()
+        return {ticker['symbol']: float(ticker['price']) for ticker in response.json()}
+    except Exception as e:
+        print(f"Error fetching market prices: {e}")
+        return {}
+
 def get_server_time(api_key, api_secret):
     """
     Fetches the current time from the Binance server.
@@ -39,23 +74,17 @@ def get_server_time(api_key, api_secret):
         api_secret (str): API secret.
 
     Returns:
-        int: Server's timestamp.
+        int: Server's timestamp, from the local clock and the periodically measured offset.
     """
-    endpoint = '/fapi/v1/time'
-    headers = {'X-MBX-APIKEY': api_key}
-
-    try:
-        response = requests.get(base_url + endpoint, headers=headers)
-        response.raise_for_status()  # Check if the response is successful
-        return response.json()['serverTime']
-    except Exception as e:
-        print(f"Error fetching server time: {e}")
-        return None
+    backend = active_backend()
+    if backend is not None:
+        return backend.get_server_time()
+    return server_timestamp(get_base_url())
 
 def create_signature(query_string, secret):
     return hmac.new(secret.encode('utf-8'), query_string.encode('utf-8'), hashlib.sha256).hexdigest()
 
-def get_open_positions(symbol, api_key, api_secret):
+def get_open_positions(symbol, api_key, api_secret, max_age=None):
     """
     Fetches open positions for a given symbol.
 
@@ -63,24 +92,28 @@ def get_open_positions(symbol, api_key, api_secret):
         symbol (str): Trading symbol, e.g., "BTCUSDT".
         api_key (str): API key.
         api_secret (str): API secret.
+        max_age (float, optional): Accept the shared account snapshot if it is at most
+            this many seconds old. None always queries the exchange.
 
     Returns:
         list: List of open positions where positionAmt != 0.
         dict: {"error": "message"} if an error occurs.
     """
-    endpoint = '/fapi/v2/positionRisk'
-    timestamp = int(time.time() * 1000)  # Generate local timestamp
+    backend = active_backend()
+    if backend is not None:
+        return backend.get_open_positions(symbol)
+    if max_age is not None:
+        positions = get_positions_snapshot(max_age)
+        if positions is not None:
+            return [pos for pos in positions if pos['symbol'] == symbol and float(pos['positionAmt']) != 0]
 
-    params = {'timestamp': timestamp}
-    query_string = '&'.join([f"{key}={value}" for key, value in params.items()])
-    signature = create_signature(query_string, api_secret)
-    params['signature'] = signature
-    headers = {'X-MBX-APIKEY': api_key}
+    endpoint = '/fapi/v2/positionRisk'
 
     try:
-        response = requests.get(base_url + endpoint, headers=headers, params=params)
+        response = request('GET', get_base_url() + endpoint, {}, api_key, api_secret, symbol=symbol, weight=5)
         response.raise_for_status()
         positions = response.json()
+        update_positions_snapshot(positions)
 
         # Return only positions with an open amount (positionAmt != 0)
         return [pos for pos in positions if pos['symbol'] == symbol and float(pos['positionAmt']) != 0]
@@ -105,21 +138,18 @@ def get_open_orders(symbol, api_key, api_secret):
         list: List of open orders if successful.
         dict: {"error": "message"} if an error occurs.
     """
+    backend = active_backend()
+    if backend is not None:
+        return backend.get_open_orders(symbol)
     endpoint = '/fapi/v1/openOrders'
-    timestamp = int(time.time() * 1000)  # Paikallinen aikaleima
 
     params = {
         'symbol': symbol,
-        'timestamp': timestamp,
         'recvWindow': 10000  # 10 sekuntia
     }
-    query_string = '&'.join([f"{key}={value}" for key, value in params.items()])
-    signature = create_signature(query_string, api_secret)
-    params['signature'] = signature
-    headers = {'X-MBX-APIKEY': api_key}
 
     try:
-        response = requests.get(base_url + endpoint, headers=headers, params=params)
+        response = request('GET', get_base_url() + endpoint, params, api_key, api_secret, symbol=symbol)
         response.raise_for_status()
         orders = response.json()
         return orders if orders else []  # Return an empty list if no open orders found
@@ -130,7 +160,98 @@ def get_open_orders(symbol, api_key, api_secret):
         print(f"Error fetching open orders: {e}")
         return {"error": "API request failed"}
 
+def get_all_open_orders(api_key, api_secret):
+    """
+    Fetches open orders for every symbol on the account in one request.
+
+    Args:
+        api_key (str): API key.
+        api_secret (str): API secret.
+
+    Returns:
+        list: List of open orders if successful.
+        dict: {"error": "message"} if an error occurs.
+    """
+    backend = active_backend()
+    if backend is not None:
+        return backend.get_all_open_orders()
+    endpoint = '/fapi/v1/openOrders'
+    params = {'recvWindow': 10000}
+
+    try:
+        response = request('GET', get_base_url() + endpoint, params, api_key, api_secret, weight=40)
+        response.raise_for_status()
+        return response.json() or []
+    except requests.exceptions.HTTPError as e:
+        print(f"HTTP Error: {e.response.status_code} - {e.response.text}")
+        return {"error": f"HTTP Error {e.response.status_code}"}
+    except Exception as e:
+        print(f"Error fetching all open orders: {e}")
+        return {"error": "API request failed"}
+
+def get_all_open_positions(api_key, api_secret):
+    """
+    Fetches open positions (positionAmt != 0) for every symbol on the account in one request.
+
+    Args:
+        api_key (str): API key.
+        api_secret (str): API secret.
+
+    Returns:
+        list: List of open positions if successful.
+        dict: {"error": "message"} if an error occurs.
+    """
+    backend = active_backend()
+    if backend is not None:
+        return backend.get_all_open_positions()
+    endpoint = '/fapi/v2/positionRisk'
+
+    try:
+        response = request('GET', get_base_url() + endpoint, {}, api_key, api_secret, weight=5)
+        response.raise_for_status()
+        positions = response.json()
+        update_positions_snapshot(positions)
+        return [pos for pos in positions if float(pos['positionAmt']) != 0]
+    except requests.exceptions.HTTPError as e:
+        print(f"HTTP Error: {e.response.status_code} - {e.response.text}")
+        return {"error": f"HTTP Error {e.response.status_code}"}
+    except Exception as e:
+        print(f"Error fetching all open positions: {e}")
+        return {"error": "API request failed"}
+
+def get_account_info(api_key, api_secret):
+    """
+    Fetches the futures account (balances, margins and per-symbol leverage) in one request.
+
+    Returns:
+        dict: Account information if successful, {"error": "message"} otherwise.
+    """
+    backend = active_backend()
+    if backend is not None:
+        return backend.get_account()
+    endpoint = '/fapi/v2/account'
+
+    try:
+        response = request('GET', get_base_url() + endpoint, {}, api_key, api_secret, weight=5)
+        response.raise_for_status()
+        return response.json()
+    except requests.exceptions.HTTPError as e:
+        print(f"HTTP Error: {e.response.status_code} - {e.response.text}")
+        return {"error": f"HTTP Error {e.response.status_code}"}
+    except Exception as e:
+        print(f"Error fetching account information: {e}")
+        return {"error": "API request failed"}
+
+def get_exchange_info():
+    """Fetches the futures exchange information (symbols and their filters)."""
+    response = request('GET', get_base_url() + "/fapi/v1/exchangeInfo")
+    response.raise_for_status()
+    return response.json()
+
 def cancel_existing_orders(symbol, api_key, api_secret):
+    backend = active_backend()
+    if backend is not None:
+        return backend.cancel_existing_orders(symbol)
     open_orders = get_open_orders(symbol, api_key, api_secret)
 
     if open_orders:
@@ -141,14 +262,9 @@ def cancel_existing_orders(symbol, api_key, api_secret):
             print(f"Cancelling order ID: {order['orderId']} for {symbol} at price {order['price']}")
 
             endpoint = '/fapi/v1/order'
-            timestamp = int(time.time() * 1000)
-            params = {'symbol': symbol, 'orderId': order['orderId'], 'timestamp': timestamp}
-            query_string = '&'.join([f"{key}={value}" for key, value in params.items()])
-            signature = create_signature(query_string, api_secret)
-            params['signature'] = signature
-            headers = {'X-MBX-APIKEY': api_key}
-
-            response = requests.delete(base_url + endpoint, headers=headers, params=params)
+            params = {'symbol': symbol, 'orderId': order['orderId']}
+
+            response = request('DELETE', get_base_url() + endpoint, params, api_key, api_secret, symbol=symbol)
             if response.status_code == 200:
                 print(f"Order {order['orderId']} cancelled successfully.")
                 cancelled_orders += 1
@@ -159,9 +275,38 @@ def cancel_existing_orders(symbol, api_key, api_secret):
     else:
         print(f"No open orders found for {symbol}.")
 
+def cancel_all_open_orders(symbol, api_key, api_secret):
+    """
+    Cancels every open order of a symbol with one bulk request.
+
+    Args:
+        symbol (str): Trading symbol.
+        api_key (str): API key.
+        api_secret (str): API secret.
+
+    Returns:
+        bool: True if the exchange accepted the cancellation.
+    """
+    backend = active_backend()
+    if backend is not None:
+        backend.cancel_existing_orders(symbol)
+        return True
+    endpoint = '/fapi/v1/allOpenOrders'
+
+    try:
+        response = request('DELETE', get_base_url() + endpoint, {'symbol': symbol}, api_key, api_secret, symbol=symbol)
+        if response.status_code == 200:
+            print(f"All open orders cancelled for {symbol}.")
+            return True
+        print(f"Failed to cancel open orders for {symbol}. Status code: {response.status_code}. Response: {response.text}")
+        return False
+    except Exception as e:
+        print(f"Error cancelling open orders for {symbol}: {e}")
+        return False
+
 def get_symbol_info(symbol, api_key, api_secret):
-    url = f"https://fapi.binance.com/fapi/v1/exchangeInfo?symbol={symbol}"
-    response = requests.get(url)
+    url = "https://fapi.binance.com/fapi/v1/exchangeInfo"
+    response = request('GET', url, {'symbol': symbol}, symbol=symbol)
     data = response.json()
 
     if 'symbols' in data:
@@ -174,7 +319,7 @@ def get_tick_size(symbol, api_key, api_secret):
     endpoint = "/fapi/v1/exchangeInfo"
 
     try:
-        response = requests.get(base_url + endpoint)
+        response = request('GET', get_base_url() + endpoint, symbol=symbol)
         data = response.json()
 
         if "symbols" in data:
@@ -192,30 +337,22 @@ def get_tick_size(symbol, api_key, api_secret):
         return None
 
 def cancel_order(symbol, order_id, api_key, api_secret):
+    backend = active_backend()
+    if backend is not None:
+        return backend.cancel_order(symbol, order_id)
 
     #base_url = "https://fapi.binance.com"
     endpoint = "/fapi/v1/order"
-    url = base_url + endpoint
+    url = get_base_url() + endpoint
 
     # Create the request parameters
-    timestamp = int(time.time() * 1000)
     params = {
         'symbol': symbol,
-        'orderId': order_id,
-        'timestamp': timestamp
+        'orderId': order_id
     }
 
-    # Sign the request
-    query_string = '&'.join([f"{key}={params[key]}" for key in params])
-    signature = hmac.new(api_secret.encode('utf-8'), query_string.encode('utf-8'), hashlib.sha256).hexdigest()
-    params['signature'] = signature
-
-    headers = {
-        'X-MBX-APIKEY': api_key
-    }
-
-    # Send the request to cancel the order
-    response = requests.delete(url, headers=headers, params=params)
+    # Send the signed request to cancel the order
+    response = request('DELETE', url, params, api_key, api_secret, symbol=symbol)
 
     if response.status_code == 200:
         print(f"Order {order_id} canceled successfully.")
@@ -224,11 +361,48 @@ def cancel_order(symbol, order_id, api_key, api_secret):
 
     return response.json()
 
-def place_limit_order(symbol, side, quantity, price, api_key, api_secret, position_side, working_type):
-    time.sleep(0.5)
+def get_order(symbol, api_key, api_secret, order_id=None, client_order_id=None):
+    """
+    Queries a single order by orderId or client order ID.
+
+    Args:
+        symbol (str): Trading symbol.
+        api_key (str): API key.
+        api_secret (str): API secret.
+        order_id (int, optional): Exchange order ID.
+        client_order_id (str, optional): Client order ID (origClientOrderId).
+
+    Returns:
+        dict: Order data, the Binance error ({'code', 'msg'}) if the query was rejected,
+              or None if the request failed.
+    """
+    backend = active_backend()
+    if backend is not None:
+        return backend.get_order(symbol, order_id, client_order_id)
+    endpoint = '/fapi/v1/order'
+    params = {'symbol': symbol}
+    if order_id is not None:
+        params['orderId'] = order_id
+    else:
+        params['origClientOrderId'] = client_order_id
+
+    try:
+        response = request('GET', get_base_url() + endpoint, params, api_key, api_secret, symbol=symbol)
+        return response.json()
+    except Exception as e:
+        print(f"Error querying order for {symbol}: {e}")
+        return None
+
+def place_limit_order(symbol, side, quantity, price, api_key, api_secret, position_side, working_type, client_order_id=None):
+    backend = active_backend()
+    if backend is not None:
+        mark_current("send")
+        return backend.place_limit_order(symbol, side, quantity, price, client_order_id)
+    if order_pacing:
+        time.sleep(order_pacing)
+    mark_current("send")
     log_timestamp = datetime.now().astimezone().strftime("%Y-%m-%d %H:%M:%S")
     endpoint = '/fapi/v1/order'
-    timestamp = int(time.time() * 1000)
     params = {
         'symbol': symbol,
         'side': side,
@@ -236,23 +410,28 @@ def place_limit_order(symbol, side, quantity, price, api_key, api_secret, positi
         'quantity': round(quantity, 3),
         'price': round(price, 7),
         'timeInForce': 'GTC',
-        'timestamp': timestamp,
         'workingType': working_type
     }
-
-    query_string = '&'.join([f"{key}={value}" for key, value in params.items()])
-    signature = create_signature(query_string, api_secret)
-    params['signature'] = signature
-
-    headers = {'X-MBX-APIKEY': api_key}
+    if client_order_id:
+        params['newClientOrderId'] = client_order_id
+        # Write-ahead: the intent is journaled before the order is sent
+        record_intent(symbol, client_order_id, side, params['price'], params['quantity'])
 
     try:
-        response = requests.post(base_url + endpoint, headers=headers, data=params)
+        response = request('POST', get_base_url() + endpoint, params, api_key, api_secret, symbol=symbol, body=True)
         response_data = response.json()
         print(f"{log_timestamp} Limit order response: {response_data}")
         logger.info(f"Limit order response: {response_data}")
         # Check if the response is an error
         if 'code' in response_data:
+            if client_order_id and response_data['code'] == DUPLICATE_CLIENT_ORDER_ID:
+                # The order was already placed by an earlier attempt: resume it
+                return resume_client_order(symbol, client_order_id, api_key, api_secret)
+            if client_order_id and classify_response(response)[0] == TRANSIENT:
+                # Execution status unknown after the retries: look it up instead of guessing
+                return resume_client_order(symbol, client_order_id, api_key, api_secret)
+            if client_order_id:
+                record_failed(symbol, client_order_id, response_data.get('msg'))
             handle_binance_error(response_data, symbol, api_key, api_secret)
             return None
         elif 'orderId' not in response_data:
@@ -261,36 +440,94 @@ def place_limit_order(symbol, side, quantity, price, api_key, api_secret, positi
             reset_grid(symbol, api_key, api_secret)  # Reset grid as a precaution
             return None
 
+        if client_order_id:
+            record_ack(symbol, client_order_id, response_data['orderId'])
         return response_data
 
     except Exception as e:
         print(f"Error placing limit order: {e}")
         logger.error(f"Error placing limit order: {e}")
+        if client_order_id:
+            # The request may have reached the exchange (e.g. a timeout): look it up instead of guessing
+            return resume_client_order(symbol, client_order_id, api_key, api_secret)
+        return None
+
+def resume_client_order(symbol, client_order_id, api_key, api_secret):
+    """
+    Looks up an order by client order ID after a timeout or duplicate rejection.
+
+    Returns:
+        dict: The exchange order if it exists, otherwise None.
+    """
+    order = get_order(symbol, api_key, api_secret, client_order_id=client_order_id)
+    if order and 'orderId' in order:
+        log_and_print(f"{symbol} Resumed order {client_order_id} (orderId {order['orderId']}, status {order.get('status')}).")
+        record_ack(symbol, client_order_id, order['orderId'])
+        return order
+    if order and order.get('code') == ORDER_NOT_FOUND:
+        record_failed(symbol, client_order_id, order.get('msg'))
+    return None
+
+def modify_limit_order(symbol, order_id, side, quantity, price, api_key, api_secret):
+    """
+    Modifies the price and quantity of a resting limit order in place.
+
+    Args:
+        symbol (str): Trading symbol.
+        order_id (int): Exchange order ID.
+        side (str): "BUY" or "SELL" (must match the order).
+        quantity (float): New quantity.
+        price (float): New price.
+        api_key (str): API key.
+        api_secret (str): API secret.
+
+    Returns:
+        dict: Modified order if successful, None otherwise.
+    """
+    backend = active_backend()
+    if backend is not None:
+        return backend.modify_limit_order(symbol, order_id, side, quantity, price)
+    endpoint = '/fapi/v1/order'
+    params = {
+        'symbol': symbol,
+        'orderId': order_id,
+        'side': side,
+        'quantity': round(quantity, 3),
+        'price': round(price, 7)
+    }
+
+    try:
+        response = request('PUT', get_base_url() + endpoint, params, api_key, api_secret, symbol=symbol, body=True)
+        response_data = response.json()
+        logger.info(f"Modify order response: {response_data}")
+        if 'code' in response_data:
+            print(f"Failed to modify order {order_id} for {symbol}: {response_data}")
+            return None
+        return response_data
+    except Exception as e:
+        print(f"Error modifying order {order_id} for {symbol}: {e}")
+        logger.error(f"Error modifying order {order_id} for {symbol}: {e}")
         return None
 
 def place_stop_market_order(symbol, side, quantity, stop_price, api_key, api_secret, working_type):
-    time.sleep(0.5)
+    backend = active_backend()
+    if backend is not None:
+        return backend.place_stop_market_order(symbol, side, quantity, stop_price)
+    if order_pacing:
+        time.sleep(order_pacing)
     log_timestamp = datetime.now().astimezone().strftime("%Y-%m-%d %H:%M:%S")
     endpoint = '/fapi/v1/order'
-    timestamp = int(time.time() * 1000)
     params = {
         'symbol': symbol,
         'side': side,
         'type': 'STOP_MARKET',
         'quantity': round(quantity, 3),
         'stopPrice': round(stop_price, 7),
-        'timestamp': timestamp,
         'workingType': working_type
     }
 
-    query_string = '&'.join([f"{key}={value}" for key, value in params.items()])
-    signature = create_signature(query_string, api_secret)
-    params['signature'] = signature
-
-    headers = {'X-MBX-APIKEY': api_key}
-
     try:
-        response = requests.post(base_url + endpoint, headers=headers, data=params)
+        response = request('POST', get_base_url() + endpoint, params, api_key, api_secret, symbol=symbol, body=True)
         response_data = response.json()
         print(f"{log_timestamp} Stop Market order response: {response_data}")
         logger.info(f"Stop Market order response: {response_data}")
@@ -312,7 +549,7 @@ def place_stop_market_order(symbol, side, quantity, stop_price, api_key, api_sec
         logger.error(f"Error placing stop-market order: {e}")
         return None
 
-def place_market_order(symbol, side, quantity, api_key, api_secret):
+def place_market_order(symbol, side, quantity, api_key, api_secret, reduce_only=False):
     """
     Places a market order to close a position.
 
@@ -322,34 +559,30 @@ def place_market_order(symbol, side, quantity, api_key, api_secret):
         quantity (float): Amount to close.
         api_key (str): API key.
         api_secret (str): API secret.
+        reduce_only (bool): Only reduce the position. A repeated reduce-only close is
+            rejected by the exchange instead of opening a new position, so it is retried.
 
     Returns:
         dict: API response for the market order.
     """
+    backend = active_backend()
+    if backend is not None:
+        return backend.place_market_order(symbol, side, quantity, reduce_only=reduce_only)
     endpoint = '/fapi/v1/order'
-
-    # Call get_server_time and ensure it does not return None
-    timestamp = get_server_time(api_key, api_secret)
-
-    if not timestamp:
-        print("Failed to fetch server time. Aborting order placement.")
-        return None
-
     params = {
         'symbol': symbol,
         'side': side,
         'type': 'MARKET',
-        'quantity': quantity,
-        'timestamp': timestamp
+        'quantity': quantity
     }
-
-    query_string = '&'.join([f"{k}={v}" for k, v in params.items()])
-    signature = create_signature(query_string, api_secret)
-    headers = {'X-MBX-APIKEY': api_key}
+    if reduce_only:
+        params['reduceOnly'] = 'true'
     timestamp = datetime.now().astimezone().strftime("%Y-%m-%d %H:%M:%S")
 
     try:
-        response = requests.post(base_url + endpoint + '?' + query_string + '&signature=' + signature, headers=headers)
+        # Signed with the server time offset kept by resilience
+        response = request('POST', get_base_url() + endpoint, params, api_key, api_secret, symbol=symbol,
+                           idempotent=reduce_only or None)
         response.raise_for_status()  # Check if the response is successful
         print(f"{timestamp} Place market order response: {response}")
         return response.json()
@@ -358,31 +591,129 @@ def place_market_order(symbol, side, quantity, api_key, api_secret):
         return None
 
 def open_trailing_stop_order(symbol, side, quantity, callback_rate, api_key, api_secret, working_type):
+    backend = active_backend()
+    if backend is not None:
+        return backend.open_trailing_stop_order(symbol, side, quantity, callback_rate)
     endpoint = '/fapi/v1/order'
-    timestamp = int(time.time() * 1000)
     params = {
         'symbol': symbol,
         'side': side,
         'type': 'TRAILING_STOP_MARKET',
         'quantity': abs(round(quantity, 3)),  # Ensure quantity is positive and round to 3 decimal places
         'callbackRate': callback_rate,
-        'timestamp': timestamp,
         'workingType': working_type
     }
 
-    query_string = '&'.join([f"{key}={value}" for key, value in params.items()])
-    signature = create_signature(query_string, api_secret)  # Create a signature
-    params['signature'] = signature
-
-    headers = {
-        'X-MBX-APIKEY': api_key
-    }
-
-    response = requests.post(base_url + endpoint, headers=headers, data=params)
+    try:
+        response = request('POST', get_base_url() + endpoint, params, api_key, api_secret, symbol=symbol, body=True)
+    except Exception as e:
+        print(f"Error placing trailing stop order for {symbol}: {e}")
+        logger.error(f"Error placing trailing stop order for {symbol}: {e}")
+        return None
     print(f"Trailing stop order response: {response.json()}")
     logger.info(f"Trailing stop order response: {response.json()}")
     return response.json()
 
+def place_batch_orders(symbol, orders, api_key, api_secret):
+    """
+    Submits up to 5 orders in one request.
+
+    The exchange processes the orders concurrently and answers each one separately.
+    Orders should carry a newClientOrderId: the request is then retried safely and the
+    legs can be verified afterwards with get_recent_orders.
+
+    Args:
+        symbol (str): Trading symbol (for failure records).
+        orders (list): Order parameter dicts with string values.
+        api_key (str): API key.
+        api_secret (str): API secret.
+
+    Returns:
+        list: One order or {'code', 'msg'} per submitted order, or None if the request failed.
+    """
+    backend = active_backend()
+    if backend is not None:
+        return backend.place_batch_orders(orders)
+    endpoint = '/fapi/v1/batchOrders'
+    params = {'batchOrders': json.dumps(orders, separators=(',', ':'))}
+
+    try:
+        response = request('POST', get_base_url() + endpoint, params, api_key, api_secret, symbol=symbol, weight=5,
+                           idempotent=all('newClientOrderId' in order for order in orders), body=True)
+        response_data = response.json()
+        logger.info(f"Batch order response: {response_data}")
+        if isinstance(response_data, dict):
+            print(f"Batch order rejected for {symbol}: {response_data}")
+            return None
+        return response_data
+    except Exception as e:
+        print(f"Error placing batch orders for {symbol}: {e}")
+        logger.error(f"Error placing batch orders for {symbol}: {e}")
+        return None
+
+def get_recent_orders(symbol, start_time, api_key, api_secret):
+    """
+    Fetches all orders of a symbol (any status) created since start_time.
+
+    Args:
+        symbol (str): Trading symbol.
+        start_time (int): Milliseconds.
+        api_key (str): API key.
+        api_secret (str): API secret.
+
+    Returns:
+        list: Orders, or None if the request failed.
+    """
+    backend = active_backend()
+    if backend is not None:
+        return backend.get_recent_orders(symbol, start_time)
+    endpoint = '/fapi/v1/allOrders'
+    params = {'symbol': symbol, 'startTime': int(start_time)}
+
+    try:
+        response = request('GET', get_base_url() + endpoint, params, api_key, api_secret, symbol=symbol, weight=5)
+        response.raise_for_status()
+        return response.json()
+    except Exception as e:
+        print(f"Error fetching recent orders for {symbol}: {e}")
+        return None
+
+def get_user_trades(symbol, from_id, api_key, api_secret, limit=1000):
+    """
+    Fetches the account's trades of a symbol from trade ID from_id on, oldest first.
+
+    Returns:
+        list: Trades, or None if the request failed.
+    """
+    endpoint = '/fapi/v1/userTrades'
+    params = {'symbol': symbol, 'fromId': int(from_id), 'limit': limit}
+
+    try:
+        response = request('GET', get_base_url() + endpoint, params, api_key, api_secret, symbol=symbol, weight=5)
+        response.raise_for_status()
+        return response.json()
+    except Exception as e:
+        print(f"Error fetching trades for {symbol}: {e}")
+        return None
+
+def get_income_history(start_time, api_key, api_secret, limit=1000):
+    """
+    Fetches the account's income records (realized PnL, commissions, funding, ...) of all symbols since start_time.
+
+    Returns:
+        list: Income records, oldest first, or None if the request failed.
+    """
+    endpoint = '/fapi/v1/income'
+    params = {'startTime': int(start_time), 'limit': limit}
+
+    try:
+        response = request('GET', get_base_url() + endpoint, params, api_key, api_secret, weight=30)
+        response.raise_for_status()
+        return response.json()
+    except Exception as e:
+        print(f"Error fetching income history: {e}")
+        return None
+
 def close_open_positions(symbol, api_key, api_secret):
     """
     Closes all open positions for a given symbol.
@@ -460,32 +791,21 @@ def set_leverage_if_needed(symbol, leverage, api_key, api_secret):
     Args:
         symbol (str): Trading symbol, such as "BTCUSDT".
         leverage (int): 1-125 Depending on the symbol. Please check the maximum leverage at https://www.binance.com/en/futures/
-        timestamp (str): Timestamp in milliseconds
-        signature (str): Signature in sha256 encoded.
         api_key (str): API key.
         api_secret (str): API secret.
     """
+    backend = active_backend()
+    if backend is not None:
+        return backend.set_leverage(symbol, leverage)
 
-    headers = {"X-MBX-APIKEY": api_key}
-
-    # Get current timestamp in milliseconds
-    timestamp = get_server_time(api_key, api_secret)
-
-    query_string = f"symbol={symbol}&leverage={leverage}&timestamp={timestamp}"
-
-    # Create the signature
-    signature = create_signature(query_string, api_secret)
-
-    # Create params dictionary for the request
+    endpoint = '/fapi/v1/leverage'
     params = {
         "symbol": symbol,
-        "leverage": leverage,
-        "timestamp": timestamp,
-        "signature": signature
+        "leverage": leverage
     }
 
     try:
-        response = requests.post(base_url, headers=headers, params=params)
+        response = request('POST', get_base_url() + endpoint, params, api_key, api_secret, symbol=symbol)
         response.raise_for_status()
         result = response.json()
         print(f"Leverage for {symbol} set to {leverage}x successfully.")
@@ -518,7 +838,10 @@ def reset_grid(symbol, api_key, api_secret):
     cancel_existing_orders(symbol, api_key, api_secret)
 
     # Clear the JSON file
-    clear_orders_file(f"{symbol}_open_orders.json")  # Use a symbol-specific file
+    clear_orders_file(symbol)  # Use a symbol-specific file
+
+    # Drop memoized bands and spacing so the next grid is built from fresh data
+    invalidate_symbol(symbol)
 
     # Notify that the grid has been reset
     message = f"{symbol} Grid reset, bot will now place new orders in the next loop."
@@ -539,16 +862,10 @@ def handle_binance_error(error, symbol, api_key, api_secret):
 
     print(f"Binance API Error: {error_code} - {error_message}")
 
-    # Fetch all symbols from config.json
-    config = load_json("config.json")
-    crypto_settings = config.get("crypto_settings", {})
-    symbols = [settings["symbol"] for settings in crypto_settings.values()]
-
     # Handle different error codes
     if error_code == -1021:  # Timestamp error
-        print("Timestamp issue detected. Synchronizing time and resetting grid...")
-        time.sleep(2)  # Wait a moment before synchronizing time
-        reset_grid(symbol, api_key, api_secret)
+        # The request layer has already re-synchronized the clock; the next loop retries
+        log_and_print(f"{symbol} Timestamp outside recvWindow. Server time re-synchronized, retrying next loop.")
         return
 
     elif error_code == -1102:  #  Mandatory parameter 'price' was not sent, was empty/null, or malformed..
@@ -557,16 +874,12 @@ def handle_binance_error(error, symbol, api_key, api_secret):
         return
 
     elif error_code == -2019:  # Insufficient margin
-        message = "Insufficient margin detected. Closing positions and resetting grid for all symbols, then shutting down the bot..."
+        message = "Insufficient margin detected. Flattening all symbols, then shutting down the bot..."
         log_and_print(message)
 
-        # Reset all symbols before shutting down
-        for active_symbol in symbols:
-            try:
-                reset_grid(active_symbol, api_key, api_secret)
-            except Exception as e:
-                logger.error(f"Error while resetting grid for {active_symbol}: {e}")
-                print(f"Error while resetting grid for {active_symbol}: {e}")
+        from emergency import flatten_account
+        symbols = load_json("config.json").get("crypto_settings", {}).keys()
+        flatten_account(api_key, api_secret, symbols)
 
         sys.exit("Bot stopped due to insufficient margin.")
 
@@ -578,8 +891,7 @@ def handle_binance_error(error, symbol, api_key, api_secret):
 
     elif error_code == -1008: # Server is currently overloaded with other requests. Please try again in a few minutes.
         message = f"{symbol} Server is currently overloaded with other requests. Please try again in a few minutes.."
-        log_and_print(message)
-        time.sleep(2)
+        log_and_print(message)  # The endpoint's circuit is open; later calls fail fast until it recovers
         return
 
     elif error_code == -4164:  # Insufficient notional. Skip the symbol
@@ -587,9 +899,20 @@ def handle_binance_error(error, symbol, api_key, api_secret):
         log_and_print(message)
         return
 
+    elif error_code in TRANSIENT_CODES or error_code in RATE_LIMIT_CODES:
+        message = f"{symbol} Temporary exchange error ({error_code}): {error_message}. Retrying next loop."
+        log_and_print(message)
+        return
+
     # Additional common error codes can be added here
     else:
-        message = f"{symbol} Unhandled error ({error_code}): {error_message}. Closing positions and resetting grid as a precaution"
+        record_failure(symbol, "handle_binance_error", "unhandled", error_code, error_message)
+        unhandled = len(recent_failures(symbol, UNHANDLED_ERROR_WINDOW, category="unhandled"))
+        if unhandled < UNHANDLED_ERROR_LIMIT:
+            message = f"{symbol} Unhandled error ({error_code}): {error_message}. Retrying next loop ({unhandled}/{UNHANDLED_ERROR_LIMIT})."
+            log_and_print(message)
+            return
+        message = f"{symbol} Unhandled error ({error_code}): {error_message} repeated {unhandled} times. Closing positions and resetting grid as a precaution"
         log_and_print(message)
         reset_grid(symbol, api_key, api_secret)
         return
@@ -597,7 +920,7 @@ def handle_binance_error(error, symbol, api_key, api_secret):
 def get_step_size(symbol, api_key, api_secret):
     endpoint = "/fapi/v1/exchangeInfo"
     try:
-        response = requests.get(base_url + endpoint)
+        response = request('GET', get_base_url() + endpoint, symbol=symbol)
         response.raise_for_status()
         data = response.json()
         if "symbols" in data:
@@ -617,6 +940,46 @@ def log_and_print(message):
     print(message)
     logger.info(message)
 
+def get_klines(symbol, klines_interval, limit, start_time=None, end_time=None):
+    """
+    Fetches raw candlestick data from the production market data endpoint.
+
+    When the local candle store is enabled, requests for the latest candles are served
+    from its 1m base series instead; ranged requests and requests reaching further back
+    than the store retains always go to the exchange.
+
+    Args:
+        symbol (str): Trading pair, e.g., "BTCUSDT".
+        klines_interval (str): Candlestick interval (e.g., "1h", "4h").
+        limit (int): Number of candles to fetch (max 1500).
+        start_time (int, optional): Open time of the first candle in milliseconds.
+        end_time (int, optional): Open time of the last candle in milliseconds.
+
+    Returns:
+        list: Candles in Binance kline format.
+
+    Raises:
+        requests.exceptions.HTTPError: If the request fails.
+    """
+    if candle_store.enabled and start_time is None and end_time is None and candle_store.covers(klines_interval, limit):
+        return candle_store.get_klines(symbol, klines_interval, limit)
+
+    base_url = "https://fapi.binance.com"
+    endpoint = "/fapi/v1/klines"
+    params = {
+        "symbol": symbol.upper(),
+        "interval": klines_interval,
+        "limit": limit
+    }
+    if start_time is not None:
+        params["startTime"] = int(start_time)
+    if end_time is not None:
+        params["endTime"] = int(end_time)
+
+    response = request('GET', base_url + endpoint, params, symbol=symbol.upper(), weight=klines_weight(limit))
+    response.raise_for_status()
+    return response.json()
+
 def get_bollinger_bands(symbol, api_key, api_secret, klines_interval, bb_period, limit=None):
     """
     Fetches candlestick data and calculates Bollinger Bands.
@@ -633,19 +996,11 @@ def get_bollinger_bands(symbol, api_key, api_secret, klines_interval, bb_period,
         dict: Contains SMA, Upper Band, Lower Band, BBW, and raw candles.
               Returns None if data fetch fails.
     """
-    base_url = "https://fapi.binance.com"
-    endpoint = "/fapi/v1/klines"
+    import pandas as pd  # Only the per-symbol bands need pandas
     limit = limit if limit is not None else bb_period
-    params = {
-        "symbol": symbol.upper(),
-        "interval": klines_interval,
-        "limit": limit
-    }
 
     try:
-        response = requests.get(base_url + endpoint, params=params)
-        response.raise_for_status()
-        candles = response.json()
+        candles = get_klines(symbol, klines_interval, limit)
 
         if len(candles) < bb_period:
             logger.warning(f"Insufficient candles ({len(candles)}) for {symbol}. Required: {bb_period}.")
@@ -678,7 +1033,26 @@ def get_bollinger_bands(symbol, api_key, api_secret, klines_interval, bb_period,
         logger.error(f"Error fetching Bollinger Bands for {symbol}: {e}")
         return None
 
+def get_cached_bollinger_bands(symbol, api_key, api_secret, klines_interval, bb_period, limit=None):
+    """
+    Same as get_bollinger_bands, but reuses the result until a new candle closes.
+
+    Callers must treat the returned dict (including 'df') as read-only.
+    """
+    return memoize_on_candle(
+        symbol, 'bollinger_bands', klines_interval, bb_period,
+        lambda: get_bollinger_bands(symbol, api_key, api_secret, klines_interval, bb_period, limit),
+        limit
+    )
+
 def calculate_dynamic_base_spacing(symbol, api_key, api_secret, multiplier=0.3, min_spacing=0.0001, min_percentage=0.003):
+    return memoize_on_candle(
+        symbol, 'dynamic_base_spacing', "4h", 3,
+        lambda: _calculate_dynamic_base_spacing(symbol, api_key, api_secret, multiplier, min_spacing, min_percentage),
+        multiplier, min_spacing, min_percentage
+    )
+
+def _calculate_dynamic_base_spacing(symbol, api_key, api_secret, multiplier, min_spacing, min_percentage):
     default_spacing = 0.007
 
     # Fetch Bollinger Bands (only 3 candles for amplitude)
@@ -709,6 +1083,8 @@ def calculate_dynamic_base_spacing(symbol, api_key, api_secret, multiplier=0.3,
 
     return dynamic_base_spacing
 
+TRIGGER_FETCH_WORKERS = 8  # Concurrent kline requests of a batched trigger evaluation
+
 def calculate_bot_trigger(symbol, api_key, api_secret, bbw_threshold, klines_interval, bot_active, bb_period=15, candle_size_multiplier=1.3, min_candles=5):
     """
     Determines whether to start or stop the grid bot based on BBW value.
@@ -733,60 +1109,100 @@ def calculate_bot_trigger(symbol, api_key, api_secret, bbw_threshold, klines_int
         'message': str (explanation for decision)
     }
     """
-    # Fetch Bollinger Bands
-    bb_data = get_bollinger_bands(symbol, api_key, api_secret, klines_interval, bb_period, limit=bb_period + max(min_candles, 10))
-    if bb_data is None:
-        return {'start_bot': False, 'strategy': 'none', 'message': "Data fetch failed."}
+    triggers = calculate_bot_triggers({symbol: (bbw_threshold, klines_interval, bot_active)}, api_key, api_secret,
+                                      bb_period=bb_period, min_candles=min_candles)
+    return triggers[symbol]
+
+def calculate_bot_triggers(symbols, api_key, api_secret, bb_period=15, min_candles=5):
+    """
+    Evaluates calculate_bot_trigger for many symbols at once.
+
+    Candles are fetched concurrently, then every symbol with the same number of candles
+    is evaluated in one vectorized pass (see strategy_sim.evaluate_triggers).
 
-    df = bb_data['df']
-    latest_bbw = bb_data['bbw']
-    if pd.isna(latest_bbw):
+    Args:
+        symbols (dict): {symbol: (bbw_threshold, klines_interval, bot_active)}.
+        api_key (str): API key.
+        api_secret (str): API secret.
+        bb_period (int): Length of Bollinger Bands period.
+        min_candles (int): Minimum number of candles for size analysis.
+
+    Returns:
+        dict: {symbol: result dict of calculate_bot_trigger}.
+    """
+    limit = bb_period + max(min_candles, 10)
+
+    def fetch(symbol, klines_interval):
+        try:
+            candles = get_klines(symbol, klines_interval, limit)
+        except requests.exceptions.HTTPError as e:
+            logger.error(f"HTTP Error for {symbol}: {e.response.status_code} - {e.response.text}")
+            return None
+        except Exception as e:
+            logger.error(f"Error fetching Bollinger Bands for {symbol}: {e}")
+            return None
+        if len(candles) < bb_period:
+            logger.warning(f"Insufficient candles ({len(candles)}) for {symbol}. Required: {bb_period}.")
+            return None
+        return np.array([candle[2:5] for candle in candles], dtype=np.float64)  # high, low, close
+
+    with ThreadPoolExecutor(max_workers=min(TRIGGER_FETCH_WORKERS, max(len(symbols), 1))) as pool:
+        futures = {symbol: submit_with_context(pool, fetch, symbol, klines_interval)
+                   for symbol, (_, klines_interval, _) in symbols.items()}
+        candles = {symbol: future.result() for symbol, future in futures.items()}
+
+    results = {symbol: {'start_bot': False, 'strategy': 'none', 'message': "Data fetch failed."}
+               for symbol, data in candles.items() if data is None}
+    groups = {}
+    for symbol, data in candles.items():
+        if data is not None:
+            groups.setdefault(len(data), []).append(symbol)
+
+    for group in groups.values():
+        stacked = np.stack([candles[symbol] for symbol in group])
+        evaluated = evaluate_triggers(
+            stacked[:, :, 2], stacked[:, :, 0], stacked[:, :, 1],
+            np.array([float(symbols[symbol][0]) for symbol in group]),
+            np.array([bool(symbols[symbol][2]) for symbol in group]),
+            bb_period=bb_period, min_candles=min_candles
+        )
+        for row, symbol in enumerate(group):
+            results[symbol] = trigger_result(symbol, symbols[symbol][0], symbols[symbol][2],
+                                             {key: values[row] for key, values in evaluated.items()})
+    return results
+
+def trigger_result(symbol, bbw_threshold, bot_active, evaluated):
+    """Builds the calculate_bot_trigger result of one symbol from its evaluate_triggers row."""
+    latest_bbw = float(evaluated['bbw'])
+    if np.isnan(latest_bbw):
         logger.warning(f"BBW NaN for {symbol}.")
         return {'start_bot': False, 'strategy': 'none', 'message': "BBW calculation failed."}
 
-    latest_close = df['close'].iloc[-1]
-    latest_upper = bb_data['upper_band']
-    latest_lower = bb_data['lower_band']
-    bb_tolerance = 0.001
-    candle_outside_bb = (latest_close > latest_upper * (1 + bb_tolerance) or
-                         latest_close < latest_lower * (1 - bb_tolerance))
-
-    # Candle size analysis (retained but not affecting breakout)
-    df['CandleSize'] = df['high'] - df['low']
-    latest_candle_size = df['CandleSize'].iloc[-1]
-    avg_candle_size = df['CandleSize'].iloc[-min_candles-1:-1].mean()
-    candle_size_deviation = latest_candle_size / avg_candle_size if avg_candle_size > 0 else None
+    deviation = float(evaluated['candle_size_deviation'])
+    candle_size_deviation = None if np.isnan(deviation) else deviation
+    decision = bool(evaluated['start_bot'])
+    strategy = 'grid' if decision else 'none'
 
     # Hybrid criterion: Start when BBW < bbw_threshold / 2, stop when BBW > bbw_threshold
     bbw_start_threshold = bbw_threshold / 2  # E.g., if bbw_threshold=0.04, start when BBW < 0.02
 
     if not bot_active:
-        # Bot is not active: check if it should start
-        if latest_bbw < bbw_start_threshold:
-            decision = True
-            strategy = 'grid'
+        if decision:
             message = f"BBW narrow. Start grid bot. | BBW={latest_bbw:.4f}, Start Threshold={bbw_start_threshold:.4f}"
         else:
-            decision = False
-            strategy = 'none'
             message = f"BBW ({latest_bbw:.4f}) above start threshold ({bbw_start_threshold:.4f}). Do nothing."
     else:
-        # Bot is active: check if it should stop
-        if latest_bbw > bbw_threshold:
-            decision = False
-            strategy = 'none'
-            message = f"BBW ({latest_bbw:.4f}) exceeds stop threshold ({bbw_threshold:.4f}). Stop bot."
-        else:
-            decision = True
-            strategy = 'grid'
+        if decision:
             message = f"BBW still narrow. Keep grid bot running. | BBW={latest_bbw:.4f}, Stop Threshold={bbw_threshold:.4f}"
+        else:
+            message = f"BBW ({latest_bbw:.4f}) exceeds stop threshold ({bbw_threshold:.4f}). Stop bot."
 
-    print(f"{symbol}: {message} | Upper={latest_upper:.2f}, Lower={latest_lower:.2f}, SMA={bb_data['sma']:.2f}, Close={latest_close:.2f}")
+    print(f"{symbol}: {message} | Upper={evaluated['upper_band']:.2f}, Lower={evaluated['lower_band']:.2f}, SMA={evaluated['sma']:.2f}, Close={evaluated['close']:.2f}")
     return {
         'start_bot': decision,
         'strategy': strategy,
         'bbw': latest_bbw,
-        'candle_outside_bb': candle_outside_bb,
+        'candle_outside_bb': bool(evaluated['candle_outside_bb']),
         'candle_size_deviation': candle_size_deviation,
         'message': message
     }
@@ -1,15 +1,40 @@
 import json
+import random
 import websocket
-from threading import Thread
+from threading import Thread, Event, Lock
 import time
 import signal
-from file_utils import load_json  # Import function to load config.json
+from file_utils import load_json, load_secrets  # Import functions to load config.json and secrets.json
 
-latest_prices = {}  # Stores the latest prices for different symbols
+PRODUCTION_STREAM_URL = "wss://fstream.binance.com/stream"
+TESTNET_STREAM_URL = "wss://stream.binancefuture.com/stream"
+MAX_PRICE_AGE = 5  # Seconds after which a streamed price is considered stale
+RECONNECT_BACKOFF = (1, 60)  # Initial and maximum reconnect delay in seconds
+
+# Stream suffix per price mode. markPrice@1s matches working_type=MARK_PRICE.
+STREAM_MODES = {
+    "trade": "@trade",
+    "bookTicker": "@bookTicker",
+    "markPrice": "@markPrice@1s",
+}
+DEFAULT_STREAM_MODE = "bookTicker"
+STREAM_PREFIX = '{"stream":"'
+
+# symbol -> (raw message, received_at). Only the newest message per symbol is kept
+# (conflation) and it is parsed lazily when a price is read.
+latest_prices = {}
 price_received = {}  # Tracks if price data has been received for each symbol
 ws = None
 SYMBOLS = []  # List of trading symbols from config.json
 
+_subscribed = set()  # Stream names confirmed on the current connection
+_wanted = {}  # symbol -> stream mode that should be subscribed
+_listeners = {}  # extra stream suffix (e.g. "@kline_1m") -> [callback(symbol, raw message), ...]
+_lock = Lock()
+_stop = Event()
+_thread = None
+_request_id = 0
+
 def load_symbols():
     """ Loads trading symbols from config.json. """
     global SYMBOLS
@@ -17,62 +42,201 @@ def load_symbols():
     crypto_settings = config.get("crypto_settings", {})
     SYMBOLS = list(crypto_settings.keys())  # Extract symbols
 
-def on_message(ws, message):
-    """ Handles incoming WebSocket messages. """
-    global latest_prices
-    data = json.loads(message)
+def get_stream_url():
+    """ Returns the combined stream URL matching base_url in secrets.json (testnet or production). """
+    base_url = load_secrets().get("base_url") or ""
+    return TESTNET_STREAM_URL if "testnet" in base_url else PRODUCTION_STREAM_URL
 
-    if "data" in data and "p" in data["data"] and "s" in data["data"]:
-        symbol = data["data"]["s"].lower()
-        latest_prices[symbol] = float(data["data"]["p"])
-        # print(f"Price update: {symbol.upper()} - {latest_prices[symbol]}")  # Debugging print
+def stream_name(symbol, mode=DEFAULT_STREAM_MODE):
+    return f"{symbol.lower()}{STREAM_MODES[mode]}"
 
-def on_open(ws):
-    """ Subscribes to all configured symbols when the WebSocket connection opens. """
+def _send(method, streams):
+    """ Sends a SUBSCRIBE/UNSUBSCRIBE request for the given streams on the open connection. """
+    global _request_id
+    if not streams or ws is None or not ws.sock or not ws.sock.connected:
+        return False
+    _request_id += 1
     payload = {
-        "method": "SUBSCRIBE",
-        "params": [f"{symbol}@trade" for symbol in latest_prices.keys()],
-        "id": 1
+        "method": method,
+        "params": sorted(streams),
+        "id": _request_id
     }
-    ws.send(json.dumps(payload))
-    print(f"WebSocket Subscription Sent for: {', '.join(latest_prices.keys())}")
+    try:
+        ws.send(json.dumps(payload))
+    except Exception as e:
+        print(f"WebSocket {method} failed: {e}")
+        return False
+    print(f"WebSocket {method} sent for: {', '.join(sorted(streams))}")
+    return True
+
+def _field(message, key, start=0):
+    """ Extracts a quoted string field ("key":"value") from a raw message without full JSON parsing. """
+    marker = f'"{key}":"'
+    i = message.find(marker, start)
+    if i < 0:
+        return None
+    i += len(marker)
+    return message[i:message.index('"', i)]
+
+def parse_price(message):
+    """
+    Parses the price from a raw combined-stream message.
+
+    trade and markPrice messages carry the price in "p"; bookTicker messages are
+    converted to the mid price of "b" (best bid) and "a" (best ask).
+
+    Returns:
+        float: Price, or None if the message carries no price.
+    """
+    data_start = message.find('"data":')
+    price = _field(message, "p", data_start)
+    if price is not None:
+        return float(price)
+    bid = _field(message, "b", data_start)
+    ask = _field(message, "a", data_start)
+    if bid is None or ask is None:
+        return None
+    return (float(bid) + float(ask)) / 2
+
+def on_message(ws, message):
+    """
+    Handles incoming WebSocket messages.
+
+    Only the stream name is sliced out of the message. Listeners of the stream get the
+    raw message; for the symbol's price stream the raw message also replaces the
+    previous one and is parsed when a price is actually read.
+    """
+    if not message.startswith(STREAM_PREFIX):
+        return  # Subscription responses and other control messages
+    end = message.find("@", len(STREAM_PREFIX))
+    if end < 0:
+        return
+    symbol = message[len(STREAM_PREFIX):end]
+    suffix = message[end:message.find('"', end)]
+    for callback in _listeners.get(suffix, ()):
+        try:
+            callback(symbol, message)
+        except Exception as e:
+            print(f"WebSocket listener for {suffix} failed: {e}")
+    if suffix != STREAM_MODES.get(_wanted.get(symbol)):
+        return  # Not the price stream of this symbol
+    latest_prices[symbol] = (message, time.time())
+    price_received[symbol] = True
+
+def _wanted_streams():
+    streams = {stream_name(symbol, mode) for symbol, mode in _wanted.items()}
+    streams.update(f"{symbol}{suffix}" for symbol in _wanted for suffix in _listeners)
+    return streams
+
+def add_stream_listener(suffix, callback):
+    """
+    Subscribes every streamed symbol to an additional stream and passes its messages
+    to callback(symbol, raw_message). Price streams can be listened to as well.
+
+    Args:
+        suffix (str): Stream suffix, e.g. "@kline_1m".
+        callback (callable): Called from the stream thread for each message.
+    """
+    with _lock:
+        _listeners.setdefault(suffix, []).append(callback)
+        streams = _wanted_streams()
+        added = streams - _subscribed
+        if _send("SUBSCRIBE", added):
+            _subscribed.update(added)
+
+def on_open(ws):
+    """ Subscribes to all wanted streams when the WebSocket connection opens. """
+    with _lock:
+        _subscribed.clear()
+        streams = _wanted_streams()
+        if _send("SUBSCRIBE", streams):
+            _subscribed.update(streams)
 
 def on_close(ws, close_status_code, close_msg):
-    """ Handles WebSocket disconnection and attempts to reconnect. """
-    print("WebSocket closed. Reconnecting in 5 seconds...")
-    time.sleep(5)
-    start_websocket(SYMBOLS)  # Restart WebSocket
+    """ Handles WebSocket disconnection. Reconnecting is done by the stream thread. """
+    print(f"WebSocket closed ({close_status_code}: {close_msg}).")
 
 def on_error(ws, error):
     """ Handles WebSocket errors. """
     print(f"WebSocket Error: {error}")
 
-def get_latest_price(symbol):
-    """ Returns the latest price for a given symbol. """
-    return latest_prices.get(symbol.lower())
+def get_latest_price(symbol, max_age=MAX_PRICE_AGE):
+    """
+    Returns the latest streamed price for a given symbol.
 
-def start_websocket(symbols):
-    """Starts a WebSocket connection to Binance for the given symbols."""
-    global ws
-    global price_received
-    global latest_prices
+    Args:
+        symbol (str): Trading symbol.
+        max_age (float, optional): Maximum age in seconds. None accepts any age.
 
-    if isinstance(symbols, str):  # Convert single symbol to a list
-        symbols = [symbols]
+    Returns:
+        float: Latest price, or None if no price has been received or it is stale.
+    """
+    entry = latest_prices.get(symbol.lower())
+    if entry is None:
+        return None
+    message, received_at = entry
+    if max_age is not None and time.time() - received_at > max_age:
+        return None
+    return parse_price(message)
 
-    # Update SYMBOLS-list
-    global SYMBOLS
-    SYMBOLS = symbols
+def get_event_time(symbol):
+    """ Returns the exchange event time (ms) of the latest message for a symbol, or None. """
+    entry = latest_prices.get(symbol.lower())
+    if entry is None:
+        return None
+    marker = entry[0].find('"E":')
+    if marker < 0:
+        return None
+    start = marker + 4
+    end = start
+    while end < len(entry[0]) and entry[0][end].isdigit():
+        end += 1
+    return int(entry[0][start:end]) if end > start else None
+
+def get_price_age(symbol):
+    """ Returns the age in seconds of the latest price for a symbol, or None. """
+    entry = latest_prices.get(symbol.lower())
+    return None if entry is None else time.time() - entry[1]
 
-    # Define latest_prices and price_received
-    latest_prices.update({symbol.lower(): None for symbol in symbols})
-    price_received.update({symbol.lower(): False for symbol in symbols})
+def update_symbols(symbols, mode=DEFAULT_STREAM_MODE):
+    """
+    Sets the subscribed symbols, sending SUBSCRIBE/UNSUBSCRIBE only for the difference.
 
-    stream_name = "/".join([f"{symbol.lower()}@trade" for symbol in symbols])
-    url = f"wss://fstream.binance.com/stream?streams={stream_name}"
+    Args:
+        symbols (iterable or dict): Symbols that should be streamed, or {symbol: mode}
+            to choose the stream mode per symbol.
+        mode (str): Stream mode for symbols given without one ("trade", "bookTicker" or "markPrice").
+    """
+    global SYMBOLS
+    if isinstance(symbols, dict):
+        wanted = {symbol.lower(): symbol_mode or mode for symbol, symbol_mode in symbols.items()}
+    else:
+        wanted = {symbol.lower(): mode for symbol in symbols}
+    SYMBOLS = sorted(wanted)
+    with _lock:
+        # Symbols that are dropped or switch stream mode lose their cached price
+        dropped = {symbol for symbol, old_mode in _wanted.items() if wanted.get(symbol) != old_mode}
+        _wanted.clear()
+        _wanted.update(wanted)
+        streams = _wanted_streams()
+        added = streams - _subscribed
+        removed = _subscribed - streams
+        if _send("UNSUBSCRIBE", removed):
+            _subscribed.difference_update(removed)
+        if _send("SUBSCRIBE", added):
+            _subscribed.update(added)
+    for symbol in dropped:
+        latest_prices.pop(symbol, None)
+        price_received.pop(symbol, None)
+    for symbol in wanted:
+        price_received.setdefault(symbol, False)
 
-    def run():
-        global ws
+def _run_stream(url):
+    """ Keeps a single connection alive, reconnecting with exponential backoff and jitter. """
+    global ws
+    delay = RECONNECT_BACKOFF[0]
+    while not _stop.is_set():
+        started = time.time()
         ws = websocket.WebSocketApp(
             url,
             on_message=on_message,
@@ -80,10 +244,35 @@ def start_websocket(symbols):
             on_close=on_close,
             on_error=on_error
         )
-        ws.run_forever()
+        try:
+            ws.run_forever(ping_interval=180, ping_timeout=10)
+        except Exception as e:
+            print(f"WebSocket run error: {e}")
+        with _lock:
+            _subscribed.clear()
+        if _stop.is_set():
+            break
+        if time.time() - started > RECONNECT_BACKOFF[1]:
+            delay = RECONNECT_BACKOFF[0]  # Connection was healthy, start backoff over
+        wait = delay * random.uniform(0.5, 1.5)
+        print(f"WebSocket reconnecting in {wait:.1f} seconds...")
+        _stop.wait(wait)
+        delay = min(delay * 2, RECONNECT_BACKOFF[1])
 
-    thread = Thread(target=run, daemon=True)
-    thread.start()
+def start_websocket(symbols, mode=DEFAULT_STREAM_MODE):
+    """Starts the managed WebSocket connection, or updates its subscriptions if it is running."""
+    global _thread
+
+    if isinstance(symbols, str):  # Convert single symbol to a list
+        symbols = [symbols]
+
+    update_symbols(symbols, mode)
+    if _thread is not None and _thread.is_alive():
+        return
+
+    _stop.clear()
+    _thread = Thread(target=_run_stream, args=(get_stream_url(),), name="price-stream", daemon=True)
+    _thread.start()
 
 # Handle Ctrl+C to close WebSocket safely
 def signal_handler(sig, frame):
@@ -93,14 +282,17 @@ def signal_handler(sig, frame):
     exit(0)
 
 def stop_ws():
-    """ Closes the WebSocket connection. """
-    global ws
+    """ Closes the WebSocket connection and stops reconnecting. """
+    _stop.set()
     if ws:
         ws.close()
         print("WebSocket Closed Manually")
 
-signal.signal(signal.SIGINT, signal_handler)
-
 # Start WebSocket automatically on script execution
 if __name__ == "__main__":
-    start_websocket()
+    signal.signal(signal.SIGINT, signal_handler)
+    load_symbols()
+    start_websocket(SYMBOLS)
+    while True:
+        time.sleep(5)
+        print({symbol: get_latest_price(symbol) for symbol in SYMBOLS})
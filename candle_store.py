@@ -0,0 +1,239 @@
+import json
+import time
+from datetime import datetime, timezone
+from threading import Lock
+
+import numpy as np
+
+from indicator_cache import INTERVAL_MS, WEEK_OFFSET_MS
+
+BASE_INTERVAL = "1m"
+MINUTE_MS = 60_000
+PAGE_LIMIT = 1500
+MAX_MINUTES = 30 * 24 * 60  # Upper bound of retained 1m history per symbol; deeper requests go to REST
+TOP_UP_INTERVAL = 5  # Seconds between REST top-ups when the kline stream is not feeding the store
+
+# Column layout of the 1m base series
+OPEN_TIME, OPEN, HIGH, LOW, CLOSE, VOLUME, QUOTE_VOLUME, TRADES, TAKER_BASE, TAKER_QUOTE = range(10)
+COLUMNS = 10
+
+
+def bucket_open_times(open_times, klines_interval):
+    """
+    Maps 1m open times to the open time of their candle in klines_interval.
+
+    Boundaries match Binance: fixed intervals align to the epoch, weekly candles to
+    Monday 00:00 UTC and monthly candles to the first day of the month (UTC).
+    """
+    open_times = open_times.astype(np.int64)
+    if klines_interval == "1M":
+        months = {}
+        for t in np.unique(open_times // 86_400_000):
+            day = datetime.fromtimestamp(int(t) * 86400, tz=timezone.utc)
+            months[t] = int(datetime(day.year, day.month, 1, tzinfo=timezone.utc).timestamp() * 1000)
+        return np.array([months[t] for t in open_times // 86_400_000], dtype=np.int64)
+    interval_ms = INTERVAL_MS[klines_interval]
+    offset = WEEK_OFFSET_MS if klines_interval == "1w" else 0
+    return (open_times - offset) // interval_ms * interval_ms + offset
+
+
+def aggregate(series, klines_interval):
+    """
+    Aggregates a 1m base series into klines_interval candles.
+
+    The first bucket is dropped if the base series does not cover its start, so every
+    returned candle is built from complete history (the last one may still be forming).
+
+    Args:
+        series (np.ndarray): 1m base series, shape (n, COLUMNS).
+        klines_interval (str): Target interval.
+
+    Returns:
+        np.ndarray: Aggregated candles in the same column layout.
+    """
+    if not len(series):
+        return series
+    if klines_interval == BASE_INTERVAL:
+        return series
+    buckets = bucket_open_times(series[:, OPEN_TIME], klines_interval)
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(series)] - 1
+    result = np.empty((len(starts), COLUMNS))
+    result[:, OPEN_TIME] = buckets[starts]
+    result[:, OPEN] = series[starts, OPEN]
+    result[:, HIGH] = np.maximum.reduceat(series[:, HIGH], starts)
+    result[:, LOW] = np.minimum.reduceat(series[:, LOW], starts)
+    result[:, CLOSE] = series[ends, CLOSE]
+    for column in (VOLUME, QUOTE_VOLUME, TRADES, TAKER_BASE, TAKER_QUOTE):
+        result[:, column] = np.add.reduceat(series[:, column], starts)
+    if series[0, OPEN_TIME] != buckets[0]:
+        result = result[1:]
+    return result
+
+
+def to_klines(candles, klines_interval):
+    """Converts aggregated rows to the Binance klines list format used by get_bollinger_bands."""
+    klines = []
+    for row in candles:
+        open_time = int(row[OPEN_TIME])
+        if klines_interval == "1M":
+            start = datetime.fromtimestamp(open_time / 1000, tz=timezone.utc)
+            following = datetime(start.year + start.month // 12, start.month % 12 + 1, 1, tzinfo=timezone.utc)
+            close_time = int(following.timestamp() * 1000) - 1
+        else:
+            close_time = open_time + INTERVAL_MS[klines_interval] - 1
+        klines.append([open_time, row[OPEN], row[HIGH], row[LOW], row[CLOSE], row[VOLUME], close_time,
+                       row[QUOTE_VOLUME], int(row[TRADES]), row[TAKER_BASE], row[TAKER_QUOTE], "0"])
+    return klines
+
+
+def interval_minutes(klines_interval):
+    if klines_interval == "1M":
+        return 31 * 24 * 60
+    return INTERVAL_MS[klines_interval] // MINUTE_MS
+
+
+class CandleStore:
+    """
+    Keeps one 1m base series per symbol and derives every higher interval locally.
+
+    The series is backfilled from REST once, then kept current by the kline_1m stream
+    (ingest_kline) or, without a stream, by a small incremental REST top-up.
+    """
+
+    def __init__(self, max_minutes=MAX_MINUTES):
+        self.enabled = False  # Set by main_loop when config.json has "local_candles": "True"
+        self.max_minutes = max_minutes
+        self._series = {}
+        self._retention = {}
+        self._last_top_up = {}
+        self._last_stream_update = {}
+        self._lock = Lock()
+
+    def _fetch(self, symbol, start_time, limit=PAGE_LIMIT):
+        from binance_futures import get_klines
+        return get_klines(symbol, BASE_INTERVAL, limit, start_time=start_time)
+
+    @staticmethod
+    def _rows(klines):
+        return np.array([[float(k[0]), float(k[1]), float(k[2]), float(k[3]), float(k[4]), float(k[5]),
+                          float(k[7]), float(k[8]), float(k[9]), float(k[10])] for k in klines]).reshape(-1, COLUMNS)
+
+    def _merge(self, symbol, rows):
+        """Merges rows into the series (newer rows replace older versions of the same minute)."""
+        if not len(rows):
+            return
+        current = self._series.get(symbol)
+        combined = rows if current is None else np.concatenate([current, rows])
+        # Keep the last occurrence of every open time
+        _, index = np.unique(combined[::-1, OPEN_TIME], return_index=True)
+        combined = combined[::-1][index]
+        retention = self._retention.get(symbol, 0)
+        if retention:
+            cutoff = combined[-1, OPEN_TIME] - retention * MINUTE_MS
+            combined = combined[combined[:, OPEN_TIME] > cutoff]
+        self._series[symbol] = combined
+
+    def backfill(self, symbol, minutes):
+        """Downloads the 1m history needed to cover `minutes`, fetching only what is missing."""
+        now = int(time.time() * 1000)
+        start = now // MINUTE_MS * MINUTE_MS - minutes * MINUTE_MS
+        with self._lock:
+            series = self._series.get(symbol)
+            have_from = series[0, OPEN_TIME] if series is not None and len(series) else None
+            have_to = series[-1, OPEN_TIME] if series is not None and len(series) else None
+        fetch_until = have_from if have_from is not None and have_from <= now else None
+        cursor = start
+        pages = []
+        # Older history missing before the stored series
+        while fetch_until is None or cursor < fetch_until:
+            klines = self._fetch(symbol, cursor)
+            if not klines:
+                break
+            pages.append(self._rows(klines))
+            cursor = int(klines[-1][0]) + MINUTE_MS
+            if len(klines) < PAGE_LIMIT or (fetch_until is not None and cursor >= fetch_until):
+                break
+        if have_to is not None:
+            self._top_up(symbol, have_to)
+        with self._lock:
+            for rows in pages:
+                self._merge(symbol, rows)
+        if pages:
+            print(f"Backfilled {sum(len(p) for p in pages)} 1m candles for {symbol}.")
+
+    def _top_up(self, symbol, since):
+        """Fetches 1m candles from `since` (the last stored minute, which may have been forming) onwards."""
+        while True:
+            klines = self._fetch(symbol, int(since))
+            with self._lock:
+                self._merge(symbol, self._rows(klines))
+                self._last_top_up[symbol] = time.time()
+            if len(klines) < PAGE_LIMIT:
+                break
+            since = int(klines[-1][0])
+
+    def ingest_kline(self, symbol, kline):
+        """
+        Updates the base series from a kline_1m stream payload ("k" object).
+
+        Args:
+            symbol (str): Trading symbol.
+            kline (dict): Binance kline payload.
+        """
+        row = np.array([[float(kline['t']), float(kline['o']), float(kline['h']), float(kline['l']),
+                         float(kline['c']), float(kline['v']), float(kline['q']), float(kline['n']),
+                         float(kline['V']), float(kline['Q'])]])
+        with self._lock:
+            if symbol in self._series:
+                self._merge(symbol, row)
+                self._last_stream_update[symbol] = time.time()
+
+    def on_stream_message(self, symbol, message):
+        """Stream listener for kline_1m messages."""
+        data = json.loads(message).get('data', {})
+        if 'k' in data:
+            self.ingest_kline(data['s'], data['k'])
+
+    def covers(self, klines_interval, limit):
+        """Returns True if `limit` candles of klines_interval fit in the retained 1m history."""
+        return (limit + 1) * interval_minutes(klines_interval) <= self.max_minutes
+
+    def get_klines(self, symbol, klines_interval, limit):
+        """
+        Returns the latest `limit` candles of any interval, derived from the 1m series.
+
+        Callers check covers() first; requests deeper than max_minutes are served by REST.
+
+        Args:
+            symbol (str): Trading symbol.
+            klines_interval (str): Candlestick interval.
+            limit (int): Number of candles (the last one may still be forming).
+
+        Returns:
+            list: Candles in Binance klines format.
+        """
+        symbol = symbol.upper()
+        needed = (limit + 1) * interval_minutes(klines_interval)
+        with self._lock:
+            self._retention[symbol] = max(self._retention.get(symbol, 0), needed)
+            series = self._series.get(symbol)
+            covered = series is not None and len(series) and \
+                series[-1, OPEN_TIME] - series[0, OPEN_TIME] >= (needed - 1) * MINUTE_MS
+            stream_fresh = time.time() - self._last_stream_update.get(symbol, 0) < TOP_UP_INTERVAL
+            top_up_due = time.time() - self._last_top_up.get(symbol, 0) >= TOP_UP_INTERVAL
+        if not covered:
+            self.backfill(symbol, needed)
+        elif not stream_fresh and top_up_due:
+            self._top_up(symbol, series[-1, OPEN_TIME])
+        with self._lock:
+            series = self._series.get(symbol)
+            candles = aggregate(series, klines_interval) if series is not None else np.empty((0, COLUMNS))
+        return to_klines(candles[-limit:], klines_interval)
+
+    def symbols(self):
+        with self._lock:
+            return list(self._series)
+
+
+candle_store = CandleStore()
@@ -0,0 +1,234 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+
+def load_config(path):
+    from file_utils import load_json
+    return load_json(path)
+
+
+def configured_symbols(args):
+    return list(load_config(args.config).get("crypto_settings", {}))
+
+
+def confirm(prompt, assume_yes):
+    if assume_yes:
+        return True
+    return input(f"{prompt} [y/N] ").strip().lower() == "y"
+
+
+# Subcommands
+
+def cmd_run(args):
+    from main import main_loop
+    symbols = set(args.symbols.split(",")) if args.symbols else None
+    main_loop(symbols=symbols, config_path=args.config)
+    return 0
+
+
+def symbol_status(symbol):
+    from file_utils import get_orders_file
+    from grid_state import load_grid_state
+    from order_journal import pending_intents
+    filename = get_orders_file(symbol)
+    state = load_grid_state(symbol) if os.path.exists(filename) else None
+    orders = list(state) if state is not None else []
+    return {
+        'symbol': symbol,
+        'grid_orders': len(orders),
+        'buy': sum(order.side == 'BUY' for order in orders),
+        'sell': sum(order.side == 'SELL' for order in orders),
+        'generation': state.generation if state is not None else None,
+        'state_age': round(time.time() - os.path.getmtime(filename)) if state is not None else None,
+        'pending_intents': len(pending_intents(symbol)),
+    }
+
+
+def cmd_status(args):
+    statuses = [symbol_status(symbol) for symbol in configured_symbols(args)]
+    if args.json:
+        print(json.dumps(statuses))
+        return 0
+    for status in statuses:
+        age = f"{status['state_age']} s ago" if status['state_age'] is not None else "no state file"
+        print(f"{status['symbol']}: {status['grid_orders']} grid orders (BUY {status['buy']}, SELL {status['sell']}), "
+              f"generation {status['generation']}, saved {age}, {status['pending_intents']} pending intents")
+    return 0
+
+
+def cmd_orders(args):
+    from grid_state import load_grid_state
+    state = load_grid_state(args.symbol)
+    live_ids = None
+    if args.live:
+        from binance_futures import get_open_orders
+        from file_utils import get_credentials
+        open_orders = get_open_orders(args.symbol, *get_credentials())
+        if isinstance(open_orders, dict):
+            print(f"Failed to fetch open orders: {open_orders.get('error')}")
+            return 1
+        live_ids = {order['orderId'] for order in open_orders}
+        for order in open_orders:
+            if state.get(order['orderId']) is None:
+                print(f"{order['side']:4} {float(order['price']):>14} {float(order['origQty']):>12} "
+                      f"{order['orderId']} {order.get('clientOrderId')} [exchange only, {order['type']}]")
+    for order in sorted(state, key=lambda order: -order.price):
+        flag = "" if live_ids is None else (" [live]" if order.order_id in live_ids else " [not on exchange]")
+        print(f"{order.side:4} {order.price:>14} {order.quantity:>12} {order.order_id} {order.client_order_id}{flag}")
+    return 0
+
+
+def cmd_reset(args):
+    if not confirm(f"Close {args.symbol} positions and cancel its orders?", args.yes):
+        print("Aborted.")
+        return 1
+    from binance_futures import reset_grid
+    from file_utils import get_credentials
+    reset_grid(args.symbol, *get_credentials())
+    return 0
+
+
+def cmd_flatten(args):
+    if not confirm("Cancel all orders and close all positions on the account?", args.yes):
+        print("Aborted.")
+        return 1
+    from emergency import flatten_account
+    from file_utils import get_credentials
+    result = flatten_account(*get_credentials(), configured_symbols(args))
+    return 0 if result['remaining_positions'] == [] and result['remaining_orders'] == [] and not result['unverified'] else 1
+
+
+def cmd_ledger(args):
+    import ledger
+    if not args.no_sync:
+        from file_utils import get_credentials
+        result = ledger.sync_ledger(configured_symbols(args), *get_credentials())
+        print(f"Synced {result['trades']} trades and {result['income']} income records in {result['elapsed']:.1f} s"
+              + (f" (failed: {', '.join(result['failed'])})" if result['failed'] else "") + ".")
+    rows = ledger.generation_summary(args.generations) if args.generations else ledger.symbol_summary()
+    if args.json:
+        print(json.dumps(rows))
+        return 0
+    for row in rows:
+        name = f"{row['symbol']} {row['generation'] or '-'}" if args.generations else row['symbol']
+        print(f"{name}: {row['fills']} fills ({row['maker_fills']} maker), volume {row['volume']:.2f}, "
+              f"realized {row['realized_pnl']:.4f}, fees {row['fees']:.4f}, funding {row['funding']:.4f}, "
+              f"net {row['net_pnl']:.4f}")
+    return 0
+
+
+def cmd_latency(args):
+    from latency_tracer import read_traces, summarize
+    traces = [trace for trace in read_traces() if not args.symbol or trace['symbol'] == args.symbol]
+    summary = summarize(traces, args.slowest)
+    if args.json:
+        print(json.dumps(summary))
+        return 0
+    if not summary:
+        print("No latency traces recorded (enable trace_latency in the config).")
+    for symbol, data in summary.items():
+        print(f"{symbol}: {data['count']} fills replaced")
+        for name, stats in data['segments'].items():
+            print(f"  {name:10} p50 {stats['p50']:>7} ms  p90 {stats['p90']:>7} ms  p99 {stats['p99']:>7} ms  max {stats['max']:>7} ms")
+        for trace in data['slowest']:
+            segments = ", ".join(f"{name} {value}" for name, value in trace['segments'].items() if name != 'total')
+            print(f"  slow: {trace['order_id']} -> {trace['replacement_id']} total {trace['segments'].get('total', '?')} ms ({segments})")
+    return 0
+
+
+def cmd_bench(args):
+    """Measures cold start times, batched trigger evaluation and (optionally) REST latency."""
+    import subprocess
+    timings = {}
+    # Cold starts, each in a fresh interpreter
+    for name, command in (("python", "pass"), ("cli status", None), ("import binance_futures", "import binance_futures"),
+                          ("import main", "import main")):
+        argv = [sys.executable, "-c", command] if command else [sys.executable, __file__, "--config", args.config, "status"]
+        start = time.perf_counter()
+        subprocess.run(argv, capture_output=True)
+        timings[f"start {name}"] = time.perf_counter() - start
+
+    import numpy as np
+    from strategy_sim import evaluate_triggers
+    rng = np.random.default_rng(0)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, (args.symbols, 25)), axis=1))
+    high, low = close * 1.005, close * 0.995
+    start = time.perf_counter()
+    evaluate_triggers(close, high, low, 0.07, np.zeros(args.symbols, dtype=bool))
+    timings[f"evaluate {args.symbols} triggers"] = time.perf_counter() - start
+
+    if args.rest:
+        from binance_futures import get_base_url
+        from resilience import request
+        latencies = []
+        for _ in range(args.rest):
+            start = time.perf_counter()
+            request('GET', get_base_url() + "/fapi/v1/time")
+            latencies.append(time.perf_counter() - start)
+        timings["REST round trip (median)"] = sorted(latencies)[len(latencies) // 2]
+
+    for name, seconds in timings.items():
+        print(f"{name}: {seconds * 1000:.1f} ms")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="cli.py", description="Grid bot operator commands.")
+    parser.add_argument("--config", default="config.json", help="Configuration file")
+    parser.add_argument("--state-dir", default="", help="Directory of the state files (paper runs use their own)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Run the trading loop")
+    run.add_argument("--symbols", help="Comma-separated subset of the configured symbols")
+    run.set_defaults(handler=cmd_run)
+
+    status = commands.add_parser("status", help="Show the saved grid state of every configured symbol")
+    status.add_argument("--json", action="store_true", help="Print one JSON line")
+    status.set_defaults(handler=cmd_status)
+
+    orders = commands.add_parser("orders", help="List a symbol's saved grid orders")
+    orders.add_argument("symbol")
+    orders.add_argument("--live", action="store_true", help="Compare with the exchange's open orders")
+    orders.set_defaults(handler=cmd_orders)
+
+    reset = commands.add_parser("reset", help="Reset a symbol's grid (close position, cancel orders)")
+    reset.add_argument("symbol")
+    reset.add_argument("--yes", action="store_true", help="Do not ask for confirmation")
+    reset.set_defaults(handler=cmd_reset)
+
+    flatten = commands.add_parser("flatten", help="Cancel all orders and close all positions")
+    flatten.add_argument("--yes", action="store_true", help="Do not ask for confirmation")
+    flatten.set_defaults(handler=cmd_flatten)
+
+    ledger = commands.add_parser("ledger", help="Sync the trade ledger and show PnL, fills and fees")
+    ledger.add_argument("--no-sync", action="store_true", help="Only query the local ledger")
+    ledger.add_argument("--generations", metavar="SYMBOL", help="Break one symbol down by grid generation")
+    ledger.add_argument("--json", action="store_true", help="Print one JSON line")
+    ledger.set_defaults(handler=cmd_ledger)
+
+    latency = commands.add_parser("latency", help="Show fill-to-replacement latency per symbol")
+    latency.add_argument("--symbol", help="Only this symbol")
+    latency.add_argument("--slowest", type=int, default=5, help="Slowest traces listed per symbol")
+    latency.add_argument("--json", action="store_true", help="Print one JSON line")
+    latency.set_defaults(handler=cmd_latency)
+
+    bench = commands.add_parser("bench", help="Measure startup and evaluation costs")
+    bench.add_argument("--symbols", type=int, default=200, help="Symbols in the trigger benchmark")
+    bench.add_argument("--rest", type=int, default=0, help="REST round trips to time (0 = none)")
+    bench.set_defaults(handler=cmd_bench)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.state_dir:
+        from file_utils import state_dir
+        state_dir.set(args.state_dir)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from binance_futures import (get_all_open_orders, get_all_open_positions, get_open_positions, cancel_all_open_orders,
+                             place_market_order, log_and_print)
+from indicator_cache import invalidate_symbol
+from paper_trading import submit_with_context
+
+FLATTEN_WORKERS = 32  # Upper bound of concurrent requests during a flatten
+
+
+def close_side(position):
+    return "SELL" if float(position['positionAmt']) > 0 else "BUY"
+
+
+def close_reduce_only(position, api_key, api_secret):
+    """Closes a position with a reduce-only market order. Returns True if the order was accepted."""
+    symbol = position['symbol']
+    quantity = abs(float(position['positionAmt']))
+    order = place_market_order(symbol, close_side(position), quantity, api_key, api_secret, reduce_only=True)
+    if order and 'orderId' in order:
+        return True
+    print(f"Failed to close {quantity} {symbol}: {order}")
+    return False
+
+
+def fetch_positions(pool, symbols, api_key, api_secret):
+    """
+    Account positions in one request, falling back to per-symbol requests if it fails.
+
+    Returns:
+        tuple: (positions, unverified symbols whose positions could not be read).
+    """
+    positions = get_all_open_positions(api_key, api_secret)
+    if not isinstance(positions, dict):
+        return positions, set()
+    futures = {symbol: submit_with_context(pool, get_open_positions, symbol, api_key, api_secret) for symbol in symbols}
+    positions, unverified = [], set()
+    for symbol, future in futures.items():
+        result = future.result()
+        if isinstance(result, list):
+            positions.extend(position for position in result if float(position['positionAmt']) != 0)
+        else:
+            unverified.add(symbol)
+    return positions, unverified
+
+
+def flatten_account(api_key, api_secret, symbols=()):
+    """
+    Cancels all open orders and closes all positions as fast as possible.
+
+    The account's positions and open orders are fetched while the configured symbols'
+    orders are already being cancelled; every remaining cancel (one bulk request per
+    symbol) and every reduce-only market close is then sent at once. A single
+    verification pass re-reads the account and retries the cancel or close of anything
+    that is still open, e.g. a grid order that filled before its cancel arrived.
+
+    Local grid state of the flattened symbols is cleared.
+
+    Args:
+        api_key (str): API key.
+        api_secret (str): API secret.
+        symbols (iterable): Configured symbols (cancelled without waiting for the account state).
+
+    Returns:
+        dict: {'symbols', 'closed', 'failed', 'unverified', 'remaining_positions', 'remaining_orders', 'elapsed'}.
+              'failed' lists the symbols whose first cancel or close failed, 'unverified' the
+              symbols whose positions could not be read; the remaining_* lists hold the
+              symbols still open after the retries (None if the re-read failed).
+    """
+    from order_management import clear_orders_file
+    start = time.monotonic()
+    symbols = set(symbols)
+
+    with ThreadPoolExecutor(max_workers=FLATTEN_WORKERS) as pool:
+        cancels = {symbol: submit_with_context(pool, cancel_all_open_orders, symbol, api_key, api_secret)
+                   for symbol in symbols}
+        orders_future = submit_with_context(pool, get_all_open_orders, api_key, api_secret)
+        positions, unverified = fetch_positions(pool, symbols, api_key, api_secret)
+        open_orders = orders_future.result()
+        if isinstance(open_orders, dict):
+            open_orders = []
+
+        # Symbols outside the configuration are flattened too: margin is account-wide
+        for symbol in {o['symbol'] for o in open_orders} - symbols:
+            cancels[symbol] = submit_with_context(pool, cancel_all_open_orders, symbol, api_key, api_secret)
+        closes = {p['symbol']: submit_with_context(pool, close_reduce_only, p, api_key, api_secret) for p in positions}
+        failed_cancels = {symbol for symbol, future in cancels.items() if not future.result()}
+        failed_closes = {symbol for symbol, future in closes.items() if not future.result()}
+
+        # Verification pass
+        orders_future = submit_with_context(pool, get_all_open_orders, api_key, api_secret)
+        remaining_positions = get_all_open_positions(api_key, api_secret)
+        remaining_orders = orders_future.result()
+        retry_cancels = {} if isinstance(remaining_orders, dict) else {
+            symbol: submit_with_context(pool, cancel_all_open_orders, symbol, api_key, api_secret)
+            for symbol in {o['symbol'] for o in remaining_orders}}
+        if not isinstance(remaining_positions, dict):
+            unverified = set()  # The account re-read covers the symbols the first pass could not read
+        retry_closes = {} if isinstance(remaining_positions, dict) else {
+            p['symbol']: submit_with_context(pool, close_reduce_only, p, api_key, api_secret) for p in remaining_positions}
+        remaining_orders = None if isinstance(remaining_orders, dict) else sorted(
+            symbol for symbol, future in retry_cancels.items() if not future.result())
+        remaining_positions = None if isinstance(remaining_positions, dict) else sorted(
+            symbol for symbol, future in retry_closes.items() if not future.result())
+
+    flattened = symbols | set(cancels) | set(closes) | set(retry_cancels) | set(retry_closes)
+    for symbol in flattened:
+        clear_orders_file(symbol)
+        invalidate_symbol(symbol)
+
+    elapsed = time.monotonic() - start
+    result = {
+        'symbols': sorted(flattened),
+        'closed': sorted(closes),
+        'failed': sorted(failed_cancels | failed_closes),
+        'unverified': sorted(unverified),
+        'remaining_positions': remaining_positions,
+        'remaining_orders': remaining_orders,
+        'elapsed': elapsed,
+    }
+    log_and_print(f"Emergency flatten finished in {elapsed:.2f} s: {len(result['closed'])} positions closed, "
+                  f"{len(cancels)} symbols cancelled, failed: {result['failed'] or 'none'}, "
+                  f"unverified: {result['unverified'] or 'none'}, "
+                  f"{len(retry_cancels) + len(retry_closes)} retried, still open after verification: "
+                  f"positions {result['remaining_positions']}, orders {result['remaining_orders']}")
+    return result
@@ -1,11 +1,20 @@
 import json
 import os
+from contextvars import ContextVar
 
 ORDERS_FILE_TEMPLATE = "{}_open_orders.json"
 
+# Directory for per-symbol state files (orders files, intent journals). Paper runs set
+# their own directory; the default is the working directory.
+state_dir = ContextVar("state_dir", default="")
+
+def state_path(filename):
+    """Returns the path of a state file in the current state directory."""
+    return os.path.join(state_dir.get(), filename)
+
 def get_orders_file(symbol):
     """Returns the filename for the specific symbol."""
-    return ORDERS_FILE_TEMPLATE.format(symbol)
+    return state_path(ORDERS_FILE_TEMPLATE.format(symbol))
 
 def load_previous_orders(symbol):
     """Loads previous orders from a file for the specific symbol."""
@@ -54,6 +63,19 @@ def load_open_orders_from_file(symbol):
         print(f"Error reading {filename}: {e}")
         return []
 
+_secrets = {}
+
+def load_secrets():
+    """Returns secrets.json, read once on first use (commands that never trade do not need it)."""
+    if not _secrets:
+        _secrets.update(load_json("secrets.json"))
+    return _secrets
+
+def get_credentials():
+    """Returns (api_key, api_secret) from secrets.json."""
+    secrets = load_secrets()
+    return secrets.get("api_key"), secrets.get("api_secret")
+
 def load_json(file_path):
     """
     Load configuration from a JSON file.
@@ -0,0 +1,173 @@
+import json
+import os
+from threading import Lock
+
+from file_utils import get_orders_file
+
+FORMAT_VERSION = 2
+# Column order of the compact encoding; also the legacy dict keys of an order
+ORDER_FIELDS = ('orderId', 'clientOrderId', 'price', 'side', 'quantity')
+
+
+class GridOrder:
+    """One resting grid order."""
+
+    __slots__ = ('order_id', 'client_order_id', 'price', 'side', 'quantity')
+
+    def __init__(self, order_id, client_order_id, price, side, quantity):
+        self.order_id = order_id
+        self.client_order_id = client_order_id
+        self.price = price
+        self.side = side
+        self.quantity = quantity
+
+    @classmethod
+    def from_dict(cls, order):
+        return cls(order['orderId'], order.get('clientOrderId'), order['price'], order['side'], order['quantity'])
+
+    def to_dict(self):
+        return {'orderId': self.order_id, 'clientOrderId': self.client_order_id, 'price': self.price,
+                'side': self.side, 'quantity': self.quantity}
+
+    def to_row(self):
+        return [self.order_id, self.client_order_id, self.price, self.side, self.quantity]
+
+
+class GridState:
+    """
+    The persisted grid of one symbol.
+
+    Mutators mark the state dirty; save() writes the file only when something changed,
+    as one compact JSON line with an array per order.
+    """
+
+    __slots__ = ('symbol', 'orders', 'limit_orders', 'generation', 'dirty', '_index')
+
+    def __init__(self, symbol, orders=(), limit_orders=None, generation=None):
+        self.symbol = symbol
+        self.orders = list(orders)
+        self.limit_orders = dict(limit_orders or {})
+        self.generation = generation
+        self.dirty = False
+        self._index = {order.order_id: i for i, order in enumerate(self.orders)}
+
+    @classmethod
+    def from_dict(cls, symbol, data):
+        """Builds a state from a legacy or compact orders-file payload ([] means no grid)."""
+        if not isinstance(data, dict):
+            return cls(symbol)
+        if data.get('v') == FORMAT_VERSION:
+            orders = [GridOrder(*row) for row in data.get('orders', [])]
+        else:
+            orders = [GridOrder.from_dict(order) for order in data.get('orders', [])]
+        return cls(symbol, orders, data.get('limit_orders'), data.get('generation'))
+
+    def to_dict(self):
+        """Returns the legacy {'orders': [dict, ...], 'limit_orders', 'generation'} view."""
+        return {'orders': [order.to_dict() for order in self.orders], 'limit_orders': dict(self.limit_orders),
+                'generation': self.generation}
+
+    def encode(self):
+        return json.dumps({'v': FORMAT_VERSION, 'generation': self.generation, 'limit_orders': self.limit_orders,
+                           'orders': [order.to_row() for order in self.orders]}, separators=(',', ':'))
+
+    # Queries
+
+    def __len__(self):
+        return len(self.orders)
+
+    def __iter__(self):
+        return iter(self.orders)
+
+    def get(self, order_id):
+        index = self._index.get(order_id)
+        return None if index is None else self.orders[index]
+
+    # Mutators
+
+    def add(self, order):
+        self._index[order.order_id] = len(self.orders)
+        self.orders.append(order)
+        self.dirty = True
+
+    def replace(self, order_id, order):
+        """Puts order in the slot of order_id (keeps the grid's order)."""
+        index = self._index.pop(order_id)
+        self.orders[index] = order
+        self._index[order.order_id] = index
+        self.dirty = True
+
+    def remove(self, order_id):
+        index = self._index.pop(order_id, None)
+        if index is None:
+            return
+        del self.orders[index]
+        for i in range(index, len(self.orders)):
+            self._index[self.orders[i].order_id] = i
+        self.dirty = True
+
+    def save(self, force=False):
+        """Writes the state if it changed. Returns True if the file was written."""
+        if not (self.dirty or force):
+            return False
+        filename = get_orders_file(self.symbol)
+        temporary = filename + ".tmp"
+        with open(temporary, 'w') as file:
+            file.write(self.encode())
+        os.replace(temporary, filename)
+        self.dirty = False
+        _remember(filename, self)
+        return True
+
+
+# Loaded states by file path (the path includes the run's state directory)
+_states = {}
+_states_lock = Lock()
+
+
+def _file_key(filename):
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _remember(filename, state):
+    with _states_lock:
+        _states[filename] = (_file_key(filename), state)
+
+
+def forget(symbol):
+    """Drops the loaded state of a symbol (after its file was cleared or rewritten elsewhere)."""
+    with _states_lock:
+        _states.pop(get_orders_file(symbol), None)
+
+
+def load_grid_state(symbol):
+    """
+    Returns the symbol's grid state, reading the file only when it changed on disk.
+
+    A missing or unreadable file yields an empty state.
+    """
+    filename = get_orders_file(symbol)
+    key = _file_key(filename)
+    with _states_lock:
+        cached = _states.get(filename)
+    if cached is not None and key is not None and cached[0] == key:
+        return cached[1]
+    data = []
+    if key is None:
+        print(f"{filename} not found. Assuming no previous orders.")
+    else:
+        try:
+            with open(filename, 'r') as file:
+                data = json.load(file)
+        except json.JSONDecodeError:
+            print(f"Error decoding JSON from {filename}. Assuming no valid orders.")
+        except Exception as e:
+            print(f"Error reading {filename}: {e}")
+    state = GridState.from_dict(symbol, data)
+    if key is not None:
+        _remember(filename, state)
+    return state
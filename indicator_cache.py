@@ -0,0 +1,151 @@
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from threading import Lock
+
+# Candle interval lengths in milliseconds (Binance kline intervals)
+INTERVAL_MS = {
+    "1m": 60_000,
+    "3m": 180_000,
+    "5m": 300_000,
+    "15m": 900_000,
+    "30m": 1_800_000,
+    "1h": 3_600_000,
+    "2h": 7_200_000,
+    "4h": 14_400_000,
+    "6h": 21_600_000,
+    "8h": 28_800_000,
+    "12h": 43_200_000,
+    "1d": 86_400_000,
+    "3d": 259_200_000,
+    "1w": 604_800_000,
+}
+
+# Binance weekly candles open on Monday 00:00 UTC; the epoch was a Thursday
+WEEK_OFFSET_MS = 4 * 86_400_000
+
+DEFAULT_MAX_ENTRIES = 512
+
+
+def current_candle_open(klines_interval, now_ms=None):
+    """
+    Returns the open time (ms) of the candle that is forming now, aligned like Binance.
+
+    Args:
+        klines_interval (str): Candlestick interval, e.g. "4h" or "1M".
+        now_ms (int, optional): Reference time in milliseconds (default: now).
+
+    Returns:
+        int: Open time of the current candle in milliseconds.
+    """
+    now_ms = int(time.time() * 1000) if now_ms is None else int(now_ms)
+    if klines_interval == "1M":
+        now = datetime.fromtimestamp(now_ms / 1000, tz=timezone.utc)
+        return int(datetime(now.year, now.month, 1, tzinfo=timezone.utc).timestamp() * 1000)
+    interval_ms = INTERVAL_MS[klines_interval]
+    offset = WEEK_OFFSET_MS if klines_interval == "1w" else 0
+    return (now_ms - offset) // interval_ms * interval_ms + offset
+
+
+def last_closed_candle_time(klines_interval, now_ms=None):
+    """Returns the open time (ms) of the most recently closed candle."""
+    current = current_candle_open(klines_interval, now_ms)
+    if klines_interval == "1M":
+        return current_candle_open(klines_interval, current - 1)
+    return current - INTERVAL_MS[klines_interval]
+
+
+class CandleMemo:
+    """
+    Bounded LRU cache for indicator results keyed on the last closed candle.
+
+    Keys start with the symbol so that all entries of a symbol can be invalidated
+    when its grid is reset.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns the cached value for key, computing and storing it on a miss.
+
+        None results are not cached, so failed fetches are retried on the next call.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        value = compute()
+        if value is not None:
+            with self._lock:
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def invalidate(self, symbol=None):
+        """Drops all entries of a symbol (or everything when symbol is None)."""
+        with self._lock:
+            if symbol is None:
+                removed = len(self._entries)
+                self._entries.clear()
+            else:
+                keys = [key for key in self._entries if key[0] == symbol]
+                for key in keys:
+                    del self._entries[key]
+                removed = len(keys)
+            self.invalidations += removed
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+indicator_memo = CandleMemo()
+
+
+def memoize_on_candle(symbol, name, klines_interval, period, compute, *extra):
+    """
+    Memoizes compute() until a new candle of klines_interval closes.
+
+    Args:
+        symbol (str): Trading symbol.
+        name (str): Indicator name.
+        klines_interval (str): Candlestick interval the result depends on.
+        period (int): Indicator period.
+        compute (callable): Function producing the value.
+        *extra: Additional key components (e.g. grid_levels).
+
+    Returns:
+        The cached or freshly computed value.
+    """
+    key = (symbol, name, klines_interval, period, last_closed_candle_time(klines_interval)) + extra
+    return indicator_memo.get_or_compute(key, compute)
+
+
+def invalidate_symbol(symbol):
+    """Invalidation hook for grid resets."""
+    indicator_memo.invalidate(symbol)
+
+
+def cache_stats():
+    return indicator_memo.stats()
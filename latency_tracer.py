@@ -0,0 +1,150 @@
+import json
+import os
+import threading
+from collections import deque
+from contextvars import ContextVar
+
+from file_utils import state_path
+from resilience import server_timestamp
+
+TRACE_FILE = "latency_traces.jsonl"
+MAX_TRACES = 5000  # Completed traces kept in memory
+# Spans of a fill-to-replacement trace in lifecycle order
+SPANS = ("fill", "detect", "positions_start", "positions_end", "place", "send", "ack")
+# Reported segments: (name, from span, to span)
+SEGMENTS = (
+    ("detection", "fill", "detect"),  # Polling: fill on the exchange until the loop notices it
+    ("positions", "positions_start", "positions_end"),  # Position lookup for the replacement price
+    ("prepare", "positions_end", "place"),  # Local work before the order call
+    ("pacing", "place", "send"),  # Pause before the request (order_pacing)
+    ("request", "send", "ack"),  # Request until the exchange acknowledged the replacement
+    ("total", "fill", "ack"),
+)
+
+# Trace of the replacement being placed by the current thread, for marks made inside binance_futures
+current_trace = ContextVar("current_trace", default=None)
+
+
+class Trace:
+    """Timeline of one filled grid order until its replacement rests on the book (server-clock ms)."""
+
+    __slots__ = ('symbol', 'order_id', 'side', 'replacement_id', 'marks')
+
+    def __init__(self, symbol, order_id, side):
+        self.symbol = symbol
+        self.order_id = order_id
+        self.side = side
+        self.replacement_id = None
+        self.marks = {}
+
+    def mark(self, span, timestamp=None):
+        self.marks[span] = server_timestamp() if timestamp is None else int(timestamp)
+
+    def span_id(self, span):
+        return f"{self.order_id}:{span}"
+
+    def segments(self):
+        return {name: self.marks[end] - self.marks[start] for name, start, end in SEGMENTS
+                if start in self.marks and end in self.marks}
+
+    def to_dict(self):
+        return {'symbol': self.symbol, 'order_id': self.order_id, 'side': self.side,
+                'replacement_id': self.replacement_id,
+                'spans': {self.span_id(span): self.marks[span] for span in SPANS if span in self.marks},
+                'segments': self.segments()}
+
+
+class LatencyTracer:
+    """
+    Traces filled grid orders from the exchange fill until the replacement is acknowledged.
+
+    handle_grid_orders opens a trace when it notices a fill and marks the position lookup,
+    the order call and the acknowledgement; place_limit_order marks the moment the request
+    is sent, after any pacing. The fill time is the exchange's updateTime of the filled
+    order, queried after the replacement was placed. Completed traces are appended to
+    latency_traces.jsonl in the state directory. When disabled, start() returns None and
+    nothing is recorded.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.traces = deque(maxlen=MAX_TRACES)
+        self._lock = threading.Lock()
+
+    def start(self, symbol, order_id, side):
+        """Opens the trace of a filled order, marking its detection."""
+        if not self.enabled:
+            return None
+        trace = Trace(symbol, order_id, side)
+        trace.mark("detect")
+        return trace
+
+    def finish(self, trace, replacement_id, fill_time=None):
+        """Records a trace whose replacement was acknowledged."""
+        if trace is None:
+            return
+        trace.replacement_id = replacement_id
+        if fill_time:
+            trace.mark("fill", fill_time)
+        record = trace.to_dict()
+        with self._lock:
+            self.traces.append(record)
+            try:
+                with open(state_path(TRACE_FILE), "a") as file:
+                    file.write(json.dumps(record, separators=(',', ':')) + "\n")
+            except OSError as e:
+                print(f"Error writing latency trace: {e}")
+
+
+def mark_current(span):
+    """Marks a span on the trace of the replacement being placed by this thread, if any."""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.mark(span)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+def read_traces(path=None):
+    """Reads the completed traces of the state directory (ignores a torn last line)."""
+    path = path or state_path(TRACE_FILE)
+    traces = []
+    if not os.path.exists(path):
+        return traces
+    with open(path, "r") as file:
+        for line in file:
+            try:
+                traces.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return traces
+
+
+def summarize(traces, slowest=5):
+    """
+    Builds per-symbol latency distributions.
+
+    Returns:
+        dict: {symbol: {'count', 'segments': {segment: {'p50', 'p90', 'p99', 'max'}}, 'slowest': [trace, ...]}},
+              milliseconds throughout. 'slowest' is ordered by total latency.
+    """
+    by_symbol = {}
+    for trace in traces:
+        by_symbol.setdefault(trace['symbol'], []).append(trace)
+    summary = {}
+    for symbol, symbol_traces in sorted(by_symbol.items()):
+        segments = {}
+        for name, _, _ in SEGMENTS:
+            values = [trace['segments'][name] for trace in symbol_traces if name in trace['segments']]
+            if values:
+                segments[name] = {'p50': percentile(values, 0.5), 'p90': percentile(values, 0.9),
+                                  'p99': percentile(values, 0.99), 'max': max(values)}
+        ranked = sorted(symbol_traces, key=lambda trace: trace['segments'].get('total', -1), reverse=True)
+        summary[symbol] = {'count': len(symbol_traces), 'segments': segments, 'slowest': ranked[:slowest]}
+    return summary
+
+
+latency_tracer = LatencyTracer()
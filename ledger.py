@@ -0,0 +1,258 @@
+import sqlite3
+import time
+
+from binance_futures import get_user_trades, get_income_history
+from file_utils import state_path
+from order_journal import order_ids_by_client_id, parse_client_order_id
+
+LEDGER_FILE = "ledger.db"
+PAGE_LIMIT = 1000
+INCOME_BACKFILL_DAYS = 90  # The exchange keeps three months of income history
+FUNDING_FEE = "FUNDING_FEE"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trades (
+    symbol TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    order_id INTEGER NOT NULL,
+    generation TEXT NOT NULL,
+    side TEXT NOT NULL,
+    price REAL NOT NULL,
+    quantity REAL NOT NULL,
+    quote_quantity REAL NOT NULL,
+    realized_pnl REAL NOT NULL,
+    commission REAL NOT NULL,
+    commission_asset TEXT NOT NULL,
+    maker INTEGER NOT NULL,
+    time INTEGER NOT NULL,
+    PRIMARY KEY (symbol, id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS trades_time ON trades (symbol, time);
+
+CREATE TABLE IF NOT EXISTS income (
+    tran_id INTEGER NOT NULL,
+    income_type TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    generation TEXT NOT NULL,
+    income REAL NOT NULL,
+    asset TEXT NOT NULL,
+    time INTEGER NOT NULL,
+    PRIMARY KEY (tran_id, income_type)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS cursors (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS rollups (
+    symbol TEXT NOT NULL,
+    generation TEXT NOT NULL,
+    fills INTEGER NOT NULL DEFAULT 0,
+    maker_fills INTEGER NOT NULL DEFAULT 0,
+    volume REAL NOT NULL DEFAULT 0,
+    realized_pnl REAL NOT NULL DEFAULT 0,
+    fees REAL NOT NULL DEFAULT 0,
+    funding REAL NOT NULL DEFAULT 0,
+    first_time INTEGER,
+    last_time INTEGER,
+    PRIMARY KEY (symbol, generation)
+);
+
+-- Rollups are updated by the inserts themselves; duplicates are ignored before they reach the triggers
+CREATE TRIGGER IF NOT EXISTS trades_rollup AFTER INSERT ON trades BEGIN
+    INSERT INTO rollups (symbol, generation, fills, maker_fills, volume, realized_pnl, fees, first_time, last_time)
+    VALUES (NEW.symbol, NEW.generation, 1, NEW.maker, NEW.quote_quantity, NEW.realized_pnl, NEW.commission, NEW.time, NEW.time)
+    ON CONFLICT (symbol, generation) DO UPDATE SET
+        fills = fills + 1,
+        maker_fills = maker_fills + NEW.maker,
+        volume = volume + NEW.quote_quantity,
+        realized_pnl = realized_pnl + NEW.realized_pnl,
+        fees = fees + NEW.commission,
+        first_time = MIN(COALESCE(first_time, NEW.time), NEW.time),
+        last_time = MAX(COALESCE(last_time, NEW.time), NEW.time);
+END;
+
+CREATE TRIGGER IF NOT EXISTS funding_rollup AFTER INSERT ON income WHEN NEW.income_type = 'FUNDING_FEE' BEGIN
+    INSERT INTO rollups (symbol, generation, funding) VALUES (NEW.symbol, NEW.generation, NEW.income)
+    ON CONFLICT (symbol, generation) DO UPDATE SET funding = funding + NEW.income;
+END;
+"""
+
+
+def connect(path=None):
+    """Opens the ledger of the current state directory, creating its tables on first use."""
+    connection = sqlite3.connect(path or state_path(LEDGER_FILE))
+    connection.row_factory = sqlite3.Row
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def get_cursor(connection, name, default=None):
+    row = connection.execute("SELECT value FROM cursors WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else default
+
+
+def set_cursor(connection, name, value):
+    connection.execute("INSERT INTO cursors (name, value) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET value = ?",
+                       (name, value, value))
+
+
+def generations_by_order_id(symbol):
+    """Maps the symbol's acknowledged order IDs to their grid generation (from the intent journal)."""
+    generations = {}
+    for client_id, order_id in order_ids_by_client_id(symbol).items():
+        parsed = parse_client_order_id(client_id)
+        if parsed is not None:
+            generations[order_id] = parsed['generation']
+    return generations
+
+
+def sync_trades(connection, symbol, api_key, api_secret):
+    """
+    Downloads the symbol's trades after the last stored trade ID.
+
+    Trades of orders the bot did not place (or whose acknowledgement is no longer in the
+    journal) are booked under the empty generation.
+
+    Returns:
+        int: Number of new trades, or None if a request failed (the stored part is kept).
+    """
+    cursor_name = f"trades:{symbol}"
+    from_id = get_cursor(connection, cursor_name, -1) + 1
+    generations = generations_by_order_id(symbol)
+    added = 0
+    while True:
+        trades = get_user_trades(symbol, from_id, api_key, api_secret, PAGE_LIMIT)
+        if trades is None:
+            return None
+        rows = [(symbol, trade['id'], trade['orderId'], generations.get(trade['orderId'], ""), trade['side'],
+                 float(trade['price']), float(trade['qty']), float(trade['quoteQty']), float(trade['realizedPnl']),
+                 float(trade['commission']), trade['commissionAsset'], int(trade['maker']), trade['time'])
+                for trade in trades]
+        with connection:
+            added += connection.executemany("INSERT OR IGNORE INTO trades VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                            rows).rowcount
+            if trades:
+                from_id = max(trade['id'] for trade in trades) + 1
+                set_cursor(connection, cursor_name, from_id - 1)
+        if len(trades) < PAGE_LIMIT:
+            return added
+
+
+def fetch_income(connection, api_key, api_secret):
+    """
+    Downloads income records from the stored time cursor on.
+
+    Pages overlap by one millisecond, so records sharing a timestamp are not lost;
+    the overlap is removed by the primary key on insert.
+
+    Returns:
+        list: Income records, or None if a request failed.
+    """
+    start_time = get_cursor(connection, "income", int(time.time() * 1000) - INCOME_BACKFILL_DAYS * 86_400_000)
+    records = []
+    while True:
+        page = get_income_history(start_time, api_key, api_secret, PAGE_LIMIT)
+        if page is None:
+            return None
+        records.extend(page)
+        if len(page) < PAGE_LIMIT:
+            return records
+        last_time = max(record['time'] for record in page)
+        if last_time == start_time:
+            print(f"Ledger: more than {PAGE_LIMIT} income records at {start_time}. Some may be missing.")
+            last_time += 1
+        start_time = last_time
+
+
+def store_income(connection, records):
+    """
+    Stores income records; funding is booked under the generation of the symbol's latest trade before it.
+
+    Returns:
+        int: Number of new records.
+    """
+    added = 0
+    with connection:
+        for record in records:
+            added += connection.execute(
+                "INSERT OR IGNORE INTO income VALUES (?, ?, ?, COALESCE((SELECT generation FROM trades "
+                "WHERE symbol = ? AND time <= ? ORDER BY time DESC LIMIT 1), ''), ?, ?, ?)",
+                (record['tranId'], record['incomeType'], record.get('symbol', ''), record.get('symbol', ''),
+                 record['time'], float(record['income']), record['asset'], record['time'])).rowcount
+        if records:
+            set_cursor(connection, "income", max(record['time'] for record in records))
+    return added
+
+
+def sync_ledger(symbols, api_key, api_secret, path=None):
+    """
+    Brings the ledger up to date with one incremental pass.
+
+    The income history is read first: besides funding it names every symbol that traded
+    since the last sync, so trades are fetched for those and the given symbols only.
+    Trades are stored before income so funding can be attributed to a grid generation.
+
+    Args:
+        symbols (iterable): Symbols whose trades are always synced (e.g. the configured ones).
+        api_key (str): API key.
+        api_secret (str): API secret.
+        path (str, optional): Ledger file (default: ledger.db in the state directory).
+
+    Returns:
+        dict: {'trades': new trades, 'income': new income records, 'failed': [symbols], 'elapsed'}.
+    """
+    start = time.monotonic()
+    connection = connect(path)
+    try:
+        records = fetch_income(connection, api_key, api_secret)
+        traded = {record['symbol'] for record in records or [] if record.get('symbol') and record['incomeType'] != FUNDING_FEE}
+        result = {'trades': 0, 'income': 0, 'failed': []}
+        for symbol in sorted(set(symbols) | traded):
+            added = sync_trades(connection, symbol, api_key, api_secret)
+            if added is None:
+                result['failed'].append(symbol)
+            else:
+                result['trades'] += added
+        if records is None:
+            result['failed'].append("income")
+        else:
+            result['income'] = store_income(connection, records)
+    finally:
+        connection.close()
+    result['elapsed'] = time.monotonic() - start
+    return result
+
+
+def summarize(rows):
+    summary = [dict(row) for row in rows]
+    for row in summary:
+        row['net_pnl'] = row['realized_pnl'] - row['fees'] + row['funding']
+    return summary
+
+
+def symbol_summary(path=None):
+    """
+    Returns per-symbol totals: fills, maker fills, volume, realized PnL, fees, funding and net PnL.
+
+    Reads the rollups only, so the cost does not grow with the number of fills.
+    """
+    connection = connect(path)
+    try:
+        return summarize(connection.execute(
+            "SELECT symbol, SUM(fills) AS fills, SUM(maker_fills) AS maker_fills, SUM(volume) AS volume, "
+            "SUM(realized_pnl) AS realized_pnl, SUM(fees) AS fees, SUM(funding) AS funding, "
+            "MIN(first_time) AS first_time, MAX(last_time) AS last_time FROM rollups GROUP BY symbol ORDER BY symbol"))
+    finally:
+        connection.close()
+
+
+def generation_summary(symbol, path=None):
+    """Returns the totals of every grid generation of a symbol, oldest first ('' = not placed by the grid)."""
+    connection = connect(path)
+    try:
+        return summarize(connection.execute(
+            "SELECT * FROM rollups WHERE symbol = ? ORDER BY COALESCE(first_time, 0)", (symbol,)))
+    finally:
+        connection.close()
@@ -1,20 +1,41 @@
+import os
 import time
 from datetime import datetime
-from order_management import handle_grid_orders, get_open_orders, reset_grid, clear_orders_file, handle_breakout_strategy
-from binance_futures import set_leverage_if_needed, calculate_bot_trigger, get_open_positions
-from file_utils import load_json
+from order_management import handle_grid_orders, get_open_orders, reset_grid, clear_orders_file, handle_breakout_strategy, POSITION_SNAPSHOT_MAX_AGE
+import binance_futures
+from binance_futures import set_leverage_if_needed, calculate_bot_trigger, calculate_bot_triggers, get_open_positions, get_market_prices
+from file_utils import load_json, get_orders_file, get_credentials
+from indicator_cache import cache_stats
+from reconciler import reconcile_startup, apply_reconciliation
+from binance_websockets import start_websocket, update_symbols, add_stream_listener, get_stream_url, get_latest_price, MAX_PRICE_AGE, DEFAULT_STREAM_MODE, PRODUCTION_STREAM_URL
+from candle_store import candle_store
+from paper_trading import active_backend
+from market_recorder import MarketRecorder, DEFAULT_DATA_DIR
+from profiling import profiler
+from risk_model import risk_model
+from latency_tracer import latency_tracer
+from state_snapshot import save_snapshots, restore_snapshots, discard_snapshot, install_shutdown_handler
+from grid_state import load_grid_state
+from action_scheduler import ActionScheduler, REPLACE, PROTECT, CANCEL, BUILD, POLL, DEFAULT_WORKERS
+import shared_state
 import random
 from logging_config import logger
 import pytz
 
+# Parameter changes that re-center a running grid (recenter_grid mode) instead of resetting it
+RECENTER_KEYS = {"grid_levels", "order_quantity", "progressive_grid", "grid_progression", "klines_interval"}
+# Parameter changes that do not affect resting grid orders
+NO_RESET_KEYS = {"bbw_threshold", "trailing_stop_rate", "recenter_grid"}
+
 def update_active_symbols(current_symbols, active_symbols, api_key, api_secret):
     removed_symbols = active_symbols - current_symbols
     for symbol in removed_symbols:
         print(f"Symbol {symbol} was removed. Resetting its grid...")
         reset_grid(symbol, api_key, api_secret)
+        discard_snapshot(symbol)
     return current_symbols
 
-def process_symbol(symbol, params, previous_settings, previous_bot_states, api_key, api_secret):
+def process_symbol(symbol, params, previous_settings, previous_bot_states, api_key, api_secret, use_websocket=False, price_max_age=MAX_PRICE_AGE, trigger_result=None):
     # Time zone eg. "Europe/London", "America/New_York", "Asia/Tokyo",...
     timezone = pytz.timezone("Europe/Helsinki")
     helsinki_time = datetime.now(timezone).strftime('%Y-%m-%d %H:%M:%S')
@@ -22,12 +43,21 @@ def process_symbol(symbol, params, previous_settings, previous_bot_states, api_k
     print(f"Processing symbol: {symbol}")
     print(f"{helsinki_time} | Processing symbol: {symbol}")
 
+    recenter = params.get("recenter_grid", "False").lower() == "true"
+    force_recenter = False
     if symbol in previous_settings and params != previous_settings[symbol]:
-        print(f"Parameters changed for {symbol}. Resetting grid and breakout...")
-        reset_grid(symbol, api_key, api_secret)
-        active_breakouts = previous_bot_states.setdefault('active_breakouts', {})
-        if symbol in active_breakouts:
-            del active_breakouts[symbol]
+        changed = {key for key in set(params) | set(previous_settings[symbol])
+                   if params.get(key) != previous_settings[symbol].get(key)}
+        if recenter and changed <= RECENTER_KEYS | NO_RESET_KEYS:
+            force_recenter = bool(changed & RECENTER_KEYS)
+            print(f"Parameters changed for {symbol} ({', '.join(sorted(changed))}). Keeping the grid"
+                  f"{' and re-centering it' if force_recenter else ''}.")
+        else:
+            print(f"Parameters changed for {symbol}. Resetting grid and breakout...")
+            reset_grid(symbol, api_key, api_secret)
+            active_breakouts = previous_bot_states.setdefault('active_breakouts', {})
+            if symbol in active_breakouts:
+                del active_breakouts[symbol]
     else:
         print(f"Parameters for {symbol} remain unchanged.")
 
@@ -42,20 +72,20 @@ def process_symbol(symbol, params, previous_settings, previous_bot_states, api_k
     trailing_stop_rate = params.get("trailing_stop_rate", 0.5)
     bbw_threshold = params.get("bbw_threshold", 0.07)
     klines_interval = params.get("klines_interval", "4h")
-    use_websocket = False
 
     # Fetch the current bot state from the previous_bot_states dictionary
     bot_active = previous_bot_states.get(symbol, False)
 
-    # Pass bot_active to the calculate_bot_trigger function
-    trigger_result = calculate_bot_trigger(
-        symbol,
-        api_key,
-        api_secret,
-        bbw_threshold=bbw_threshold,
-        klines_interval=klines_interval,
-        bot_active=bot_active
-    )
+    # Pass bot_active to the calculate_bot_trigger function (unless evaluated in the loop's batch)
+    if trigger_result is None:
+        trigger_result = calculate_bot_trigger(
+            symbol,
+            api_key,
+            api_secret,
+            bbw_threshold=bbw_threshold,
+            klines_interval=klines_interval,
+            bot_active=bot_active
+        )
     print(trigger_result['message'])
 
     previous_state = previous_bot_states.get(symbol, False)
@@ -73,7 +103,7 @@ def process_symbol(symbol, params, previous_settings, previous_bot_states, api_k
     else:
         # Check breakout before initializing the grid
         if symbol in active_breakouts:
-            open_positions = get_open_positions(symbol, api_key, api_secret)
+            open_positions = get_open_positions(symbol, api_key, api_secret, max_age=POSITION_SNAPSHOT_MAX_AGE)
             if not open_positions:
                 print(f"{symbol} breakout closed by trailing stop. Enabling grid.")
                 logger.info(f"{symbol} breakout closed. Enabling grid.")
@@ -91,7 +121,10 @@ def process_symbol(symbol, params, previous_settings, previous_bot_states, api_k
             progressive_grid=progressive_grid,
             grid_progression=grid_progression,
             use_websocket=use_websocket,
-            klines_interval=klines_interval
+            klines_interval=klines_interval,
+            price_max_age=price_max_age,
+            recenter=recenter,
+            force_recenter=force_recenter
         )
 
     # Breakout strategy (checked every loop when the bot is stopped)
@@ -108,19 +141,14 @@ def process_symbol(symbol, params, previous_settings, previous_bot_states, api_k
         )
         print("Breakout check done.")
 
-def main_loop():
-    config = load_json("config.json")
-    secrets = load_json("secrets.json")
-    api_key = secrets.get("api_key")
-    api_secret = secrets.get("api_secret")
-    crypto_settings = config.get("crypto_settings", {})
-
-    active_symbols = set(crypto_settings.keys())
-    previous_settings = {}
-    previous_bot_states = {}
+def select_symbols(crypto_settings, symbols=None):
+    """Returns the crypto_settings entries handled by this process (all if symbols is None)."""
+    if symbols is None:
+        return crypto_settings
+    return {symbol: params for symbol, params in crypto_settings.items() if symbol in symbols}
 
-    # Check open orders and synchronize state at startup
-    print("Checking existing grid states and orders on startup...")
+def check_startup_orders(crypto_settings, previous_bot_states, api_key, api_secret):
+    """Fallback startup check that queries open orders symbol by symbol."""
     has_open_orders = False  # Track if any symbol has open orders
     for symbol in crypto_settings.keys():
         open_orders = get_open_orders(symbol, api_key, api_secret)  # Fetch symbol-specific orders
@@ -137,18 +165,155 @@ def main_loop():
         for symbol in crypto_settings.keys():
             clear_orders_file(symbol)  # Clear the orders file for each symbol
 
-    while True:
-        print("Starting a new loop...")
-        config = load_json("config.json")
-        crypto_settings = config.get("crypto_settings", {})
-        current_symbols = set(crypto_settings.keys())
+def get_stream_modes(crypto_settings, default_mode):
+    """Returns {symbol: stream mode}, using the mark price stream for MARK_PRICE symbols."""
+    return {
+        symbol: "markPrice" if params.get("working_type") == "MARK_PRICE" else default_mode
+        for symbol, params in crypto_settings.items()
+    }
+
+def get_trigger_inputs(crypto_settings, previous_bot_states):
+    """Returns {symbol: (bbw_threshold, klines_interval, bot_active)} for calculate_bot_triggers."""
+    return {
+        symbol: (params.get("bbw_threshold", 0.07), params.get("klines_interval", "4h"), previous_bot_states.get(symbol, False))
+        for symbol, params in crypto_settings.items()
+    }
+
+def get_loop_prices(crypto_settings, use_websocket, price_max_age, api_key, api_secret):
+    """Returns {symbol: price} from the stream, or from one bulk request without it (None = unknown)."""
+    if use_websocket:
+        return {symbol: get_latest_price(symbol, price_max_age) for symbol in crypto_settings}
+    return get_market_prices(api_key, api_secret)
+
+def action_priority(symbol, params, previous_settings, previous_bot_states, trigger_result, price):
+    """
+    Estimates from local state what a symbol's action will mostly do this loop.
+
+    A running grid with a resting order the price has crossed has a fill to replace;
+    grids without saved orders are built; everything else is a routine check.
+
+    Returns:
+        int: Priority for the action scheduler.
+    """
+    if symbol in previous_settings and params != previous_settings[symbol]:
+        return CANCEL
+    if trigger_result is None:
+        return POLL
+    if not trigger_result['start_bot']:
+        if previous_bot_states.get(symbol, False):
+            return CANCEL
+        return PROTECT if trigger_result.get('strategy') in ('breakout_long', 'breakout_short') else POLL
+    if symbol in previous_bot_states.get('active_breakouts', {}):
+        return POLL
+    if not os.path.exists(get_orders_file(symbol)):
+        return BUILD
+    state = load_grid_state(symbol)
+    if not len(state):
+        return BUILD
+    if price is not None and any(order.price >= price if order.side == 'BUY' else order.price <= price for order in state):
+        return REPLACE
+    return POLL
+
+def start_scheduler(config):
+    """Starts the action scheduler if enabled; requests are then paced by the rate budget instead of fixed pauses."""
+    if str(config.get("action_scheduler", "False")).lower() != "true":
+        return None
+    if shared_state.rate_budget is None:
+        weight_per_minute = config.get("rate_limit_weight_per_minute", shared_state.DEFAULT_WEIGHT_PER_MINUTE)
+        shared_state.install(shared_state.SharedRateBudget(weight_per_minute), shared_state.account_snapshot)
+    binance_futures.order_pacing = 0
+    return ActionScheduler(int(config.get("scheduler_workers", DEFAULT_WORKERS)))
+
+def main_loop(symbols=None, stop_event=None, config_path="config.json"):
+    """
+    Runs the trading loop.
+
+    Args:
+        symbols (set, optional): Restrict the loop to these symbols (supervisor workers).
+        stop_event (multiprocessing.Event, optional): Ends the loop when set.
+        config_path (str): Configuration file (paper runs use one per candidate config).
+    """
+    config = load_json(config_path)
+    api_key, api_secret = get_credentials()
+    crypto_settings = select_symbols(config.get("crypto_settings", {}), symbols)
+    # Paper runs take their prices from the paper exchange, which is fed by the runner
+    use_websocket = str(config.get("use_websocket", "True")).lower() == "true" and active_backend() is None
+    price_max_age = config.get("price_max_age", MAX_PRICE_AGE)
+    price_stream = config.get("price_stream", DEFAULT_STREAM_MODE)
+    candle_store.enabled = str(config.get("local_candles", "False")).lower() == "true"
+    risk_model.enabled = str(config.get("pre_trade_checks", "True")).lower() == "true"
+    latency_tracer.enabled = str(config.get("trace_latency", "False")).lower() == "true"
+    if use_websocket:
+        # Candles come from production market data, so only the production stream can feed the store
+        if candle_store.enabled and get_stream_url() == PRODUCTION_STREAM_URL:
+            add_stream_listener("@kline_1m", candle_store.on_stream_message)
+        if str(config.get("record_market_data", "False")).lower() == "true":
+            MarketRecorder(config.get("market_data_dir", DEFAULT_DATA_DIR)).attach()
+        start_websocket(get_stream_modes(crypto_settings, price_stream))
+
+    profiler.install_signal_handler()
+    scheduler = start_scheduler(config)
+
+    active_symbols = set(crypto_settings.keys())
+    previous_settings = {}
+    previous_bot_states = {}
+
+    # Reconcile exchange orders and positions with the persisted grids at startup
+    print("Checking existing grid states and orders on startup...")
+    results = reconcile_startup(crypto_settings.keys(), api_key, api_secret)
+    if results is not None:
+        apply_reconciliation(results, previous_bot_states, api_key, api_secret)
+    else:
+        check_startup_orders(crypto_settings, previous_bot_states, api_key, api_secret)
+    # Runtime state the exchange does not know (settings of the running grids, pending starts)
+    restore_snapshots(crypto_settings.keys(), results, previous_settings, previous_bot_states)
+    install_shutdown_handler()
 
-        active_symbols = update_active_symbols(current_symbols, active_symbols, api_key, api_secret)
+    try:
+        while stop_event is None or not stop_event.is_set():
+            print("Starting a new loop...")
+            stats = cache_stats()
+            print(f"Indicator cache: {stats['entries']} entries, {stats['hits']} hits, {stats['misses']} misses")
+            config = load_json(config_path)
+            profiler.poll(config.get("profiling"))
+            crypto_settings = select_symbols(config.get("crypto_settings", {}), symbols)
+            current_symbols = set(crypto_settings.keys())
 
-        for symbol, params in crypto_settings.items():
-            process_symbol(symbol, params, previous_settings, previous_bot_states, api_key, api_secret)
+            active_symbols = update_active_symbols(current_symbols, active_symbols, api_key, api_secret)
+            if use_websocket:
+                update_symbols(get_stream_modes(crypto_settings, price_stream))
 
-        time.sleep(random.uniform(20, 30))
+            # Triggers of all symbols are evaluated in one batch
+            triggers = calculate_bot_triggers(get_trigger_inputs(crypto_settings, previous_bot_states), api_key, api_secret)
+
+            if scheduler is None:
+                for symbol, params in crypto_settings.items():
+                    profiler.call(symbol, process_symbol, symbol, params, previous_settings, previous_bot_states,
+                                  api_key, api_secret, use_websocket=use_websocket, price_max_age=price_max_age,
+                                  trigger_result=triggers.get(symbol))
+            else:
+                # Symbols with a fill to replace run first; bulk work never takes the reserved worker
+                prices = get_loop_prices(crypto_settings, use_websocket, price_max_age, api_key, api_secret)
+                for symbol, params in crypto_settings.items():
+                    priority = action_priority(symbol, params, previous_settings, previous_bot_states,
+                                               triggers.get(symbol), prices.get(symbol))
+                    scheduler.submit(symbol, priority, profiler.call, symbol, process_symbol, symbol, params,
+                                     previous_settings, previous_bot_states, api_key, api_secret,
+                                     use_websocket=use_websocket, price_max_age=price_max_age,
+                                     trigger_result=triggers.get(symbol))
+                scheduler.drain()
+            profiler.end_loop()
+            save_snapshots(crypto_settings, previous_settings, previous_bot_states)
+
+            if stop_event is None:
+                time.sleep(random.uniform(20, 30))
+            else:
+                stop_event.wait(random.uniform(20, 30))
+    finally:
+        # Written on every exit, including SIGTERM and fatal errors, so a restart resumes where this run stopped
+        save_snapshots(active_symbols, previous_settings, previous_bot_states)
+        if scheduler is not None:
+            scheduler.shutdown()
 
 if __name__ == "__main__":
     main_loop()
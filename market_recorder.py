@@ -0,0 +1,235 @@
+import argparse
+import heapq
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from threading import Event, Lock, Thread
+
+import numpy as np
+
+DEFAULT_DATA_DIR = "market_data"
+FLUSH_INTERVAL = 1.0  # Seconds between writes of buffered records
+INDEX_STRIDE = 4096  # One index entry per this many records
+
+# Fixed-width record layouts, one append-only file per symbol, day and stream
+STREAM_DTYPES = {
+    "trade": np.dtype([('time', '<i8'), ('price', '<f8'), ('qty', '<f8')]),
+    "bookTicker": np.dtype([('time', '<i8'), ('bid', '<f8'), ('bid_qty', '<f8'), ('ask', '<f8'), ('ask_qty', '<f8')]),
+    "kline_1m": np.dtype([('time', '<i8'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'), ('close', '<f8'),
+                          ('volume', '<f8')]),
+}
+INDEX_DTYPE = np.dtype([('time', '<i8'), ('row', '<i8')])
+DAY_MS = 86_400_000
+
+
+def day_of(timestamp_ms):
+    return datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc).strftime("%Y%m%d")
+
+
+def data_file(root, symbol, day, stream):
+    return os.path.join(root, symbol.upper(), day, f"{stream}.bin")
+
+
+def index_file(root, symbol, day, stream):
+    return os.path.join(root, symbol.upper(), day, f"{stream}.idx")
+
+
+def parse_record(stream, data):
+    """Converts a stream payload into a record tuple, or None if it is not recorded."""
+    if stream == "trade":
+        return (data['T'], float(data['p']), float(data['q']))
+    if stream == "bookTicker":
+        return (data.get('T') or data['E'], float(data['b']), float(data['B']), float(data['a']), float(data['A']))
+    if stream == "kline_1m":
+        kline = data['k']
+        if not kline['x']:
+            return None  # Only closed candles are recorded
+        return (kline['t'], float(kline['o']), float(kline['h']), float(kline['l']), float(kline['c']),
+                float(kline['v']))
+    return None
+
+
+class MarketRecorder:
+    """
+    Records trade, bookTicker and closed 1m kline messages into fixed-width binary files.
+
+    Messages are buffered in memory by the stream thread and appended by a flush thread,
+    one write per file. Every INDEX_STRIDE records a (time, row) entry is appended to a
+    small index file used for time-range seeks.
+    """
+
+    def __init__(self, root=DEFAULT_DATA_DIR, streams=tuple(STREAM_DTYPES)):
+        self.root = root
+        self.streams = streams
+        self.records_written = 0
+        self._buffers = {}  # (symbol, stream) -> [record, ...]
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+
+    def on_message(self, symbol, message):
+        """Stream listener: buffers one combined-stream message."""
+        payload = json.loads(message)
+        stream = payload['stream'].split('@', 1)[1]
+        record = parse_record(stream, payload['data'])
+        if record is not None:
+            with self._lock:
+                self._buffers.setdefault((symbol.upper(), stream), []).append(record)
+
+    def attach(self):
+        """Subscribes the recorder to the managed WebSocket connection and starts flushing."""
+        from binance_websockets import add_stream_listener
+        for stream in self.streams:
+            add_stream_listener(f"@{stream}", self.on_message)
+        self.start()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = Thread(target=self._run, name="market-recorder", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(FLUSH_INTERVAL):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Market recorder flush failed: {e}")
+
+    def flush(self):
+        """Appends all buffered records to their day files."""
+        with self._lock:
+            buffers, self._buffers = self._buffers, {}
+        for (symbol, stream), records in buffers.items():
+            array = np.array(records, dtype=STREAM_DTYPES[stream])
+            days = np.array([day_of(t) for t in array['time']])
+            for day in dict.fromkeys(days):
+                self._append(symbol, stream, day, array[days == day])
+
+    def _append(self, symbol, stream, day, array):
+        path = data_file(self.root, symbol, day, stream)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "ab") as file:
+            size = os.fstat(file.fileno()).st_size
+            first_row = size // array.itemsize
+            if size % array.itemsize:
+                file.truncate(first_row * array.itemsize)  # Drop a torn record left by a crash
+            file.write(array.tobytes())
+        # Index entries for every row that is a multiple of INDEX_STRIDE
+        rows = np.arange(first_row, first_row + len(array))
+        marks = rows % INDEX_STRIDE == 0
+        if marks.any():
+            index = np.empty(marks.sum(), dtype=INDEX_DTYPE)
+            index['time'] = array['time'][marks]
+            index['row'] = rows[marks]
+            with open(index_file(self.root, symbol, day, stream), "ab") as file:
+                file.write(index.tobytes())
+        self.records_written += len(array)
+
+
+# Readers
+
+def load_day(symbol, stream, day, root=DEFAULT_DATA_DIR):
+    """
+    Memory-maps one day of a stream.
+
+    Returns:
+        np.ndarray: Read-only structured array (empty if nothing was recorded).
+    """
+    path = data_file(root, symbol, day, stream)
+    dtype = STREAM_DTYPES[stream]
+    if not os.path.exists(path) or os.path.getsize(path) < dtype.itemsize:
+        return np.empty(0, dtype=dtype)
+    # A torn last record from a crash is excluded by the shape
+    return np.memmap(path, dtype=dtype, mode="r", shape=(os.path.getsize(path) // dtype.itemsize,))
+
+
+def load_index(symbol, stream, day, root=DEFAULT_DATA_DIR):
+    path = index_file(root, symbol, day, stream)
+    if not os.path.exists(path):
+        return np.empty(0, dtype=INDEX_DTYPE)
+    with open(path, "rb") as file:
+        data = file.read()
+    return np.frombuffer(data[:len(data) // INDEX_DTYPE.itemsize * INDEX_DTYPE.itemsize], dtype=INDEX_DTYPE)
+
+
+def seek(array, index, timestamp_ms):
+    """Returns the first row with time >= timestamp_ms, using the index to bound the search."""
+    if len(index):
+        # Last indexed row before timestamp_ms and the next indexed row bound the search
+        block = np.searchsorted(index['time'], timestamp_ms) - 1
+        low = int(index['row'][block]) if block >= 0 else 0
+        high = min(int(index['row'][block + 1]), len(array)) if block + 1 < len(index) else len(array)
+    else:
+        low, high = 0, len(array)
+    return low + int(np.searchsorted(array['time'][low:high], timestamp_ms))
+
+
+def iter_range(symbol, stream, start_ms, end_ms, root=DEFAULT_DATA_DIR):
+    """
+    Yields memory-mapped slices (no copies) covering [start_ms, end_ms), one per day.
+    """
+    day = datetime.fromtimestamp(start_ms // DAY_MS * DAY_MS / 1000, tz=timezone.utc)
+    while day.timestamp() * 1000 < end_ms:
+        name = day.strftime("%Y%m%d")
+        array = load_day(symbol, stream, name, root)
+        if len(array):
+            index = load_index(symbol, stream, name, root)
+            start = seek(array, index, start_ms)
+            end = seek(array, index, end_ms)
+            if end > start:
+                yield array[start:end]
+        day += timedelta(days=1)
+
+
+def read_range(symbol, stream, start_ms, end_ms, root=DEFAULT_DATA_DIR):
+    """Returns [start_ms, end_ms) of a stream as one array (copies only when spanning days)."""
+    parts = list(iter_range(symbol, stream, start_ms, end_ms, root))
+    if len(parts) == 1:
+        return parts[0]
+    return np.concatenate(parts) if parts else np.empty(0, dtype=STREAM_DTYPES[stream])
+
+
+def replay_prices(symbols, start_ms, end_ms, stream="bookTicker", root=DEFAULT_DATA_DIR):
+    """
+    Yields (timestamp_ms, symbol, price) for several symbols in time order, e.g. for
+    paper_trading replays. bookTicker prices are the mid of bid and ask.
+    """
+    def ticks(symbol):
+        for part in iter_range(symbol, stream, start_ms, end_ms, root):
+            prices = (part['bid'] + part['ask']) / 2 if stream == "bookTicker" else part[
+                'close' if stream == "kline_1m" else 'price']
+            for timestamp, price in zip(part['time'].tolist(), prices.tolist()):
+                yield timestamp, symbol.upper(), price
+
+    return heapq.merge(*(ticks(symbol) for symbol in symbols))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record trades, book tickers and 1m klines to binary files.")
+    parser.add_argument("symbols", nargs="+", help="Symbols to record")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="Output directory")
+    args = parser.parse_args()
+
+    from binance_websockets import start_websocket, stop_ws
+    recorder = MarketRecorder(args.data_dir)
+    recorder.attach()
+    start_websocket(args.symbols)
+    try:
+        while True:
+            time.sleep(60)
+            print(f"Recorded {recorder.records_written} records.")
+    except KeyboardInterrupt:
+        stop_ws()
+        recorder.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+from multiprocessing import Pool
+
+import numpy as np
+
+from binance_futures import get_klines
+from file_utils import load_json
+from indicator_cache import INTERVAL_MS
+from strategy_sim import simulate_strategy
+
+# Default search space for the swept crypto_settings keys
+DEFAULT_SEARCH_SPACE = {
+    "bbw_threshold": [0.04, 0.06, 0.08, 0.1, 0.12],
+    "grid_levels": [3, 4, 5, 6, 8],
+    "grid_progression": [1.0, 1.1, 1.3, 1.5],
+    "klines_interval": ["1h", "4h"],
+    "trailing_stop_rate": [0.5, 1.0, 2.0],
+}
+
+KLINES_PAGE_LIMIT = 1500
+
+# Candle arrays opened by each worker process (memory-mapped, never pickled)
+_candles = {}
+
+
+def fetch_history(symbol, klines_interval, days):
+    """
+    Downloads `days` of candles for one interval, paging through the klines endpoint.
+
+    Args:
+        symbol (str): Trading pair, e.g., "BTCUSDT".
+        klines_interval (str): Candlestick interval.
+        days (int): Number of days of history.
+
+    Returns:
+        np.ndarray: Array of shape (4, candles) with open time, high, low and close.
+    """
+    interval_ms = INTERVAL_MS[klines_interval]
+    end = int(time.time() * 1000)
+    start = end - days * 86_400_000
+    rows = []
+    while start < end:
+        candles = get_klines(symbol, klines_interval, KLINES_PAGE_LIMIT, start_time=start)
+        if not candles:
+            break
+        rows.extend((c[0], c[2], c[3], c[4]) for c in candles)
+        start = int(candles[-1][0]) + interval_ms
+        if len(candles) < KLINES_PAGE_LIMIT:
+            break
+    print(f"Fetched {len(rows)} {klines_interval} candles for {symbol}.")
+    return np.asarray(rows, dtype=np.float64).T.copy()
+
+
+def share_history(histories, directory):
+    """
+    Writes candle arrays to .npy files so worker processes can memory-map them.
+
+    Args:
+        histories (dict): {klines_interval: np.ndarray}.
+        directory (str): Directory for the array files.
+
+    Returns:
+        dict: {klines_interval: file path}.
+    """
+    layout = {}
+    for klines_interval, array in histories.items():
+        path = os.path.join(directory, f"candles_{klines_interval}.npy")
+        np.save(path, array)
+        layout[klines_interval] = path
+    return layout
+
+
+def _attach_history(layout):
+    """Pool initializer: memory-maps the shared candle arrays in the worker."""
+    for klines_interval, path in layout.items():
+        _candles[klines_interval] = np.load(path, mmap_mode="r")
+
+
+def build_candidates(search_space, search, samples, seed=None):
+    """
+    Expands the search space into a list of parameter dicts.
+
+    Args:
+        search_space (dict): {param: [values]}.
+        search (str): "grid" for every combination, "random" for random sampling.
+        samples (int): Number of random samples.
+        seed (int, optional): Random seed.
+
+    Returns:
+        list: Parameter dicts.
+    """
+    keys = sorted(search_space)
+    combos = [dict(zip(keys, values)) for values in itertools.product(*(search_space[k] for k in keys))]
+    if search == "random" and samples < len(combos):
+        combos = random.Random(seed).sample(combos, samples)
+    return combos
+
+
+def build_windows(open_times, train_days, test_days):
+    """
+    Splits a series into walk-forward (train, test) index ranges.
+
+    Args:
+        open_times (np.ndarray): Candle open times in milliseconds.
+        train_days (int): Length of each in-sample window.
+        test_days (int): Length of each out-of-sample window (and step).
+
+    Returns:
+        list: [((train_start, train_end), (test_start, test_end)), ...] as candle indexes.
+    """
+    windows = []
+    if not len(open_times) or not test_days:
+        return windows
+    first = open_times[0]
+    train_ms = train_days * 86_400_000
+    test_ms = test_days * 86_400_000
+    start = first
+    while start + train_ms + test_ms <= open_times[-1]:
+        bounds = np.searchsorted(open_times, [start, start + train_ms, start + train_ms + test_ms])
+        windows.append(((int(bounds[0]), int(bounds[1])), (int(bounds[1]), int(bounds[2]))))
+        start += test_ms
+    return windows
+
+
+def evaluate_chunk(task):
+    """
+    Worker task: simulates a group of candidates sharing one interval over one index range.
+
+    All candidates in the group are simulated together, one row per candidate.
+
+    Args:
+        task (tuple): (klines_interval, start, end, candidates, fixed settings).
+
+    Returns:
+        list: One metrics dict per candidate.
+    """
+    klines_interval, start, end, candidates, fixed = task
+    data = _candles[klines_interval]
+    high = np.asarray(data[1, start:end])
+    low = np.asarray(data[2, start:end])
+    close = np.asarray(data[3, start:end])
+    rows = len(candidates)
+
+    def column(key):
+        return np.array([c[key] for c in candidates])
+
+    result = simulate_strategy(
+        np.broadcast_to(close, (rows, close.size)),
+        np.broadcast_to(high, (rows, high.size)),
+        np.broadcast_to(low, (rows, low.size)),
+        bbw_threshold=column("bbw_threshold"),
+        grid_levels=column("grid_levels"),
+        grid_progression=column("grid_progression"),
+        progressive=column("grid_progression") > 1.0,
+        trailing_stop_rate=column("trailing_stop_rate"),
+        order_quantity=fixed["order_quantity"],
+        leverage=fixed["leverage"],
+        capital=fixed["capital"],
+    )
+    metrics = []
+    for i, candidate in enumerate(candidates):
+        row = {key: result[key][i].item() for key in result}
+        row["score"] = row["pnl"] - row["max_drawdown"]
+        metrics.append({"params": candidate, "start": start, "end": end, **row})
+    return metrics
+
+
+def make_tasks(candidates, ranges, fixed, chunk_size):
+    """Groups candidates by interval and splits them into chunks for every index range."""
+    tasks = []
+    by_interval = {}
+    for candidate in candidates:
+        by_interval.setdefault(candidate["klines_interval"], []).append(candidate)
+    for klines_interval, group in by_interval.items():
+        for start, end in ranges[klines_interval]:
+            for i in range(0, len(group), chunk_size):
+                tasks.append((klines_interval, start, end, group[i:i + chunk_size], fixed))
+    return tasks
+
+
+def to_crypto_settings(symbol, params, base_settings):
+    """
+    Builds a ready-to-paste crypto_settings entry from a winning parameter set.
+
+    Args:
+        symbol (str): Trading pair.
+        params (dict): Optimized parameters.
+        base_settings (dict): Existing config entry for the symbol (kept for other keys).
+
+    Returns:
+        dict: {symbol: settings}.
+    """
+    settings = dict(base_settings)
+    settings["symbol"] = symbol
+    settings["bbw_threshold"] = params["bbw_threshold"]
+    settings["grid_levels"] = int(params["grid_levels"])
+    settings["grid_progression"] = params["grid_progression"]
+    settings["progressive_grid"] = "True" if params["grid_progression"] > 1.0 else "False"
+    settings["klines_interval"] = params["klines_interval"]
+    settings["trailing_stop_rate"] = params["trailing_stop_rate"]
+    return {symbol: settings}
+
+
+def run_optimizer(symbol, days, search_space, search="grid", samples=200, train_days=0, test_days=0,
+                  workers=None, capital=1000.0, output_dir="optimizer_results", seed=None, chunk_size=16):
+    """
+    Runs a parameter sweep (and optional walk-forward analysis) for one symbol.
+
+    Args:
+        symbol (str): Trading pair.
+        days (int): Days of history to download.
+        search_space (dict): {param: [values]} for the swept keys.
+        search (str): "grid" or "random".
+        samples (int): Number of random samples.
+        train_days (int): Walk-forward in-sample length (0 disables walk-forward).
+        test_days (int): Walk-forward out-of-sample length.
+        workers (int, optional): Process count. Defaults to every core.
+        capital (float): Simulated starting equity.
+        output_dir (str): Directory for ranked results.
+        seed (int, optional): Random seed.
+        chunk_size (int): Candidates simulated together in one task.
+
+    Returns:
+        dict: Ranked results, walk-forward report and the suggested crypto_settings block.
+    """
+    config = load_json("config.json")
+    base_settings = config.get("crypto_settings", {}).get(symbol, {})
+    fixed = {
+        "order_quantity": float(base_settings.get("order_quantity", 1.0)),
+        "leverage": float(base_settings.get("leverage", 10)),
+        "capital": capital,
+    }
+    workers = workers or os.cpu_count()
+
+    candidates = build_candidates(search_space, search, samples, seed)
+    intervals = sorted({c["klines_interval"] for c in candidates})
+    histories = {i: fetch_history(symbol, i, days) for i in intervals}
+
+    full_ranges = {i: [(0, histories[i].shape[1])] for i in intervals}
+    windows = {i: build_windows(histories[i][0], train_days, test_days) for i in intervals}
+    wf_ranges = {i: sorted({r for w in windows[i] for r in w}) for i in intervals}
+
+    os.makedirs(output_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory() as directory:
+        layout = share_history(histories, directory)
+        tasks = make_tasks(candidates, full_ranges, fixed, chunk_size)
+        tasks += make_tasks(candidates, wf_ranges, fixed, chunk_size)
+        print(f"Evaluating {len(candidates)} candidates in {len(tasks)} tasks on {workers} processes...")
+        started = time.time()
+        with Pool(processes=workers, initializer=_attach_history, initargs=(layout,)) as pool:
+            results = [row for chunk in pool.imap_unordered(evaluate_chunk, tasks) for row in chunk]
+        print(f"Evaluation finished in {time.time() - started:.1f}s.")
+
+    def key_of(params):
+        return tuple(sorted(params.items()))
+
+    full = {i: full_ranges[i][0] for i in intervals}
+    ranked = sorted(
+        (r for r in results if (r["start"], r["end"]) == full[r["params"]["klines_interval"]]),
+        key=lambda r: r["score"], reverse=True
+    )
+
+    # Walk-forward: pick the best candidate in-sample, report it out-of-sample
+    by_range = {}
+    for r in results:
+        by_range[(r["params"]["klines_interval"], r["start"], r["end"], key_of(r["params"]))] = r
+    walk_forward = []
+    window_count = max((len(w) for w in windows.values()), default=0)
+    for index in range(window_count):
+        best = None
+        for klines_interval in intervals:
+            if index >= len(windows[klines_interval]):
+                continue
+            (train, test) = windows[klines_interval][index]
+            for candidate in candidates:
+                if candidate["klines_interval"] != klines_interval:
+                    continue
+                row = by_range.get((klines_interval, train[0], train[1], key_of(candidate)))
+                if row and (best is None or row["score"] > best[0]["score"]):
+                    best = (row, test)
+        if best:
+            row, test = best
+            oos = by_range[(row["params"]["klines_interval"], test[0], test[1], key_of(row["params"]))]
+            walk_forward.append({"window": index, "params": row["params"], "train_score": row["score"],
+                                 "test_pnl": oos["pnl"], "test_max_drawdown": oos["max_drawdown"]})
+
+    report = {
+        "symbol": symbol,
+        "generated": datetime.now().astimezone().strftime("%Y-%m-%d %H:%M:%S"),
+        "ranked": ranked,
+        "walk_forward": walk_forward,
+        "walk_forward_test_pnl": sum(w["test_pnl"] for w in walk_forward),
+        "crypto_settings": to_crypto_settings(symbol, ranked[0]["params"], base_settings) if ranked else {},
+    }
+
+    results_file = os.path.join(output_dir, f"{symbol}_optimizer.json")
+    with open(results_file, "w") as file:
+        json.dump(report, file, indent=4)
+    settings_file = os.path.join(output_dir, f"{symbol}_crypto_settings.json")
+    with open(settings_file, "w") as file:
+        json.dump(report["crypto_settings"], file, indent=2)
+    print(f"Saved ranked results to {results_file} and settings block to {settings_file}.")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parameter sweep and walk-forward optimizer for grid settings.")
+    parser.add_argument("symbol", help="Trading pair, e.g. SXPUSDT")
+    parser.add_argument("--days", type=int, default=180, help="Days of history to download")
+    parser.add_argument("--search", choices=["grid", "random"], default="grid")
+    parser.add_argument("--samples", type=int, default=200, help="Samples for random search")
+    parser.add_argument("--space", help="JSON file with {param: [values]} overriding the default search space")
+    parser.add_argument("--train-days", type=int, default=0, help="Walk-forward in-sample window (0 = off)")
+    parser.add_argument("--test-days", type=int, default=0, help="Walk-forward out-of-sample window")
+    parser.add_argument("--workers", type=int, default=None, help="Process count (default: all cores)")
+    parser.add_argument("--capital", type=float, default=1000.0)
+    parser.add_argument("--output", default="optimizer_results")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    search_space = dict(DEFAULT_SEARCH_SPACE)
+    if args.space:
+        search_space.update(load_json(args.space))
+
+    report = run_optimizer(args.symbol, args.days, search_space, args.search, args.samples,
+                           args.train_days, args.test_days, args.workers, args.capital, args.output, args.seed)
+
+    for row in report["ranked"][:args.top]:
+        print(f"score={row['score']:.2f} pnl={row['pnl']:.2f} dd={row['max_drawdown']:.2f} "
+              f"fills={row['fills']} params={row['params']}")
+    if report["walk_forward"]:
+        print(f"Walk-forward out-of-sample PnL: {report['walk_forward_test_pnl']:.2f}")
+    print(json.dumps(report["crypto_settings"], indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+import json
+import os
+import threading
+import time
+
+from file_utils import get_orders_file, state_path
+from grid_state import load_grid_state
+
+JOURNAL_FILE_TEMPLATE = "{}_intents.jsonl"
+CLIENT_ID_PREFIX = "gb"
+MAX_CLIENT_ID_LENGTH = 36  # Binance limit for newClientOrderId
+MAX_RETAINED_ACKS = 2000  # Acknowledgements of orders no longer in the grid kept for the ledger
+COMPACT_EVERY = 1000  # Records appended to a journal between compactions
+
+ORDER_NOT_FOUND = -2013
+DUPLICATE_CLIENT_ORDER_ID = -4116
+
+BASE36 = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+# Records appended per journal since its last compaction, and a lock per journal
+_appended = {}
+_journal_locks = {}
+# Last generation handed out by this process (milliseconds)
+_last_generation = 0
+_generation_lock = threading.Lock()
+
+
+def to_base36(value):
+    value = int(value)
+    digits = ""
+    while True:
+        value, remainder = divmod(value, 36)
+        digits = BASE36[remainder] + digits
+        if value == 0:
+            return digits
+
+
+def new_generation():
+    """
+    Returns a new grid generation tag (build time in milliseconds, base 36).
+
+    Tags are strictly increasing within the process, so two builds of a symbol in the
+    same millisecond (e.g. a reset followed by an immediate rebuild) never share client order IDs.
+    """
+    global _last_generation
+    with _generation_lock:
+        _last_generation = max(int(time.time() * 1000), _last_generation + 1)
+        return to_base36(_last_generation)
+
+
+def make_client_order_id(symbol, generation, side, level, seq=0):
+    """
+    Builds a deterministic newClientOrderId for a grid order.
+
+    The ID encodes symbol, grid generation, side, level and replacement sequence, so
+    retrying the same order always sends the same ID and the exchange rejects duplicates.
+    If the ID would exceed the exchange limit, the symbol part is truncated; the rest of
+    the ID is unchanged, so it still parses and stays deterministic.
+
+    Args:
+        symbol (str): Trading symbol.
+        generation (str): Grid generation tag from new_generation().
+        side (str): "BUY" or "SELL".
+        level (int): Grid level (1 = closest to the starting price).
+        seq (int): Replacement sequence for the level (0 = initial order).
+
+    Returns:
+        str: Client order ID, e.g. "gb-SXPUSDT-mgx3k2a1-B2-0".
+    """
+    suffix = f"-{generation}-{side[0]}{level}-{seq}"
+    room = MAX_CLIENT_ID_LENGTH - len(CLIENT_ID_PREFIX) - 1 - len(suffix)
+    return f"{CLIENT_ID_PREFIX}-{symbol[:max(room, 1)]}{suffix}"
+
+
+def parse_client_order_id(client_id):
+    """
+    Parses a client order ID created by make_client_order_id.
+
+    Returns:
+        dict: {'symbol', 'generation', 'side', 'level', 'seq'}, or None for foreign IDs.
+    """
+    if not client_id or not client_id.startswith(CLIENT_ID_PREFIX + "-"):
+        return None
+    try:
+        _, symbol, generation, side_level, seq = client_id.split("-")
+        side = {"B": "BUY", "S": "SELL"}[side_level[0]]
+        return {'symbol': symbol, 'generation': generation, 'side': side,
+                'level': int(side_level[1:]), 'seq': int(seq)}
+    except (ValueError, KeyError):
+        return None
+
+
+def next_client_order_id(client_id, new_side):
+    """
+    Returns the deterministic ID of the counter-order that replaces a filled order.
+
+    Args:
+        client_id (str): Client order ID of the filled order.
+        new_side (str): Side of the replacement order.
+
+    Returns:
+        str: Replacement client order ID, or None if client_id is not ours.
+    """
+    parsed = parse_client_order_id(client_id)
+    if parsed is None:
+        return None
+    return make_client_order_id(parsed['symbol'], parsed['generation'], new_side,
+                                parsed['level'], parsed['seq'] + 1)
+
+
+def get_journal_file(symbol):
+    """Returns the intent journal filename for the specific symbol."""
+    return state_path(JOURNAL_FILE_TEMPLATE.format(symbol))
+
+
+def _journal_lock(symbol):
+    return _journal_locks.setdefault(symbol, threading.Lock())
+
+
+def _append(symbol, record):
+    record['t'] = int(time.time() * 1000)
+    with _journal_lock(symbol):
+        with open(get_journal_file(symbol), "a") as file:
+            file.write(json.dumps(record, separators=(',', ':')) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        _appended[symbol] = _appended.get(symbol, 0) + 1
+        if _appended[symbol] >= COMPACT_EVERY:
+            _compact(symbol)
+
+
+def record_intent(symbol, client_id, side, price, quantity, order_type="LIMIT"):
+    """Writes an order intent to the journal before the order is sent."""
+    _append(symbol, {'event': 'intent', 'clientOrderId': client_id, 'side': side,
+                     'price': price, 'quantity': quantity, 'type': order_type})
+
+
+def record_ack(symbol, client_id, order_id):
+    """Marks an intent as acknowledged by the exchange."""
+    _append(symbol, {'event': 'ack', 'clientOrderId': client_id, 'orderId': order_id})
+
+
+def record_failed(symbol, client_id, reason):
+    """Marks an intent as not placed."""
+    _append(symbol, {'event': 'failed', 'clientOrderId': client_id, 'reason': str(reason)})
+
+
+def read_journal(symbol):
+    """Reads all journal records for a symbol (ignores a torn last line)."""
+    filename = get_journal_file(symbol)
+    records = []
+    if not os.path.exists(filename):
+        return records
+    with open(filename, "r") as file:
+        for line in file:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+
+def pending_intents(symbol):
+    """
+    Returns intents that were written but never acknowledged or failed.
+
+    Returns:
+        list: Intent records, oldest first.
+    """
+    return _pending(read_journal(symbol))
+
+
+def _pending(records):
+    intents = {}
+    for record in records:
+        if record['event'] == 'intent':
+            intents[record['clientOrderId']] = record
+        else:
+            intents.pop(record['clientOrderId'], None)
+    return list(intents.values())
+
+
+def order_ids_by_client_id(symbol):
+    """Returns {clientOrderId: orderId} for every acknowledged intent."""
+    return {r['clientOrderId']: r['orderId'] for r in read_journal(symbol) if r['event'] == 'ack'}
+
+
+def compact_journal(symbol):
+    """
+    Rewrites the journal keeping only what is still needed.
+
+    Pending intents are kept, as are the acknowledgements of orders in the grid state and
+    the latest MAX_RETAINED_ACKS others, which the ledger uses to attribute trades not
+    synced yet. Runs at startup and every COMPACT_EVERY appended records.
+    """
+    with _journal_lock(symbol):
+        _compact(symbol)
+
+
+def _compact(symbol):
+    _appended[symbol] = 0
+    records = read_journal(symbol)
+    if not records:
+        return
+    pending = {id(r) for r in _pending(records)}
+    active = {order.order_id for order in load_grid_state(symbol)} if os.path.exists(get_orders_file(symbol)) else set()
+    retired = [r for r in records if r['event'] == 'ack' and r['orderId'] not in active]
+    retained = {id(r) for r in retired[-MAX_RETAINED_ACKS:]}
+    keep = [r for r in records
+            if id(r) in pending
+            or (r['event'] == 'ack' and (r['orderId'] in active or id(r) in retained))]
+    filename = get_journal_file(symbol)
+    temp_filename = filename + ".tmp"
+    with open(temp_filename, "w") as file:
+        for record in keep:
+            file.write(json.dumps(record, separators=(',', ':')) + "\n")
+    os.replace(temp_filename, filename)
+
+
+def recover_pending(symbol, api_key, api_secret):
+    """
+    Resolves pending intents by querying the exchange by client order ID.
+
+    Args:
+        symbol (str): Trading symbol.
+        api_key (str): API key.
+        api_secret (str): API secret.
+
+    Returns:
+        list: Exchange orders that were placed but never recorded (to be adopted).
+    """
+    from binance_futures import get_order
+
+    adopted = []
+    for intent in pending_intents(symbol):
+        client_id = intent['clientOrderId']
+        order = get_order(symbol, api_key, api_secret, client_order_id=client_id)
+        if order and 'orderId' in order:
+            record_ack(symbol, client_id, order['orderId'])
+            adopted.append(order)
+        elif order and order.get('code') == ORDER_NOT_FOUND:
+            record_failed(symbol, client_id, "not found on exchange")
+    compact_journal(symbol)
+    return adopted
@@ -1,20 +1,20 @@
 import json
 import os
-from binance_futures import get_open_orders, get_tick_size, place_limit_order, reset_grid, get_open_positions, log_and_print, get_step_size, calculate_dynamic_base_spacing, get_market_price, open_trailing_stop_order, place_market_order, get_bollinger_bands
-from file_utils import load_json
-# from binance_websockets import get_latest_price
-
-# Fetch settings
-secrets = load_json("secrets.json")
-api_key = secrets.get("api_key")
-api_secret = secrets.get("api_secret")
-base_url = secrets.get("base_url")
+from decimal import Decimal, ROUND_DOWN
+from binance_futures import modify_limit_order, cancel_order, get_open_orders, get_tick_size, place_limit_order, reset_grid, get_open_positions, log_and_print, get_step_size, calculate_dynamic_base_spacing, get_market_price, open_trailing_stop_order, place_market_order, get_cached_bollinger_bands, place_batch_orders, get_recent_orders, get_server_time, get_order
+from file_utils import get_credentials, state_path
+from indicator_cache import memoize_on_candle
+from order_journal import new_generation, make_client_order_id, next_client_order_id, parse_client_order_id
+from binance_websockets import get_latest_price, MAX_PRICE_AGE
+from grid_state import GridOrder, GridState, load_grid_state, forget
+from risk_model import risk_model, DEFER, SKIP
+from latency_tracer import latency_tracer, current_trace
 
 ORDERS_FILE_TEMPLATE = "{}_open_orders.json"
 
 def get_orders_file(symbol):
     """Returns the filename for the specific symbol."""
-    return ORDERS_FILE_TEMPLATE.format(symbol)
+    return state_path(ORDERS_FILE_TEMPLATE.format(symbol))
 
 def load_previous_orders(symbol):
     """Loads previous orders from a file for the specific symbol."""
@@ -35,33 +35,24 @@ def clear_orders_file(symbol=None):
     filename = get_orders_file(symbol)
     with open(filename, 'w') as file:
         json.dump([], file)
+    forget(symbol)
     print(f"{filename} cleared.")
 
 def save_open_orders_to_file(symbol, open_orders):
-    """Saves open orders to a file for the specific symbol."""
-    filename = get_orders_file(symbol)
+    """Saves open orders ({'orders': [...], 'limit_orders', 'generation'}) for the specific symbol."""
+    save_grid_state(GridState.from_dict(symbol, open_orders), force=True)
+
+def save_grid_state(state, force=False):
+    """Writes a grid state if it changed (or when forced)."""
     try:
-        with open(filename, 'w') as file:
-            json.dump(open_orders, file, indent=4)
-        print(f"Saved open orders to {filename}.")
+        if state.save(force):
+            print(f"Saved open orders to {get_orders_file(state.symbol)}.")
     except Exception as e:
         print(f"Error saving open orders to file: {e}")
 
 def load_open_orders_from_file(symbol):
-    """Reads open orders from the specific symbol's file."""
-    filename = get_orders_file(symbol)
-    try:
-        with open(filename, 'r') as file:
-            return json.load(file)
-    except FileNotFoundError:
-        print(f"{filename} not found. Assuming no previous orders.")
-        return []
-    except json.JSONDecodeError:
-        print(f"Error decoding JSON from {filename}. Assuming no valid orders.")
-        return []
-    except Exception as e:
-        print(f"Error reading {filename}: {e}")
-        return []
+    """Reads open orders from the specific symbol's file as {'orders': [...], 'limit_orders', 'generation'}."""
+    return load_grid_state(symbol).to_dict()
 
 def round_to_tick_size(price, tick_size, offset=0.000001):
     """Rounds the price to the nearest tick size with a small offset to avoid repeated prices."""
@@ -71,6 +62,11 @@ def round_to_step_size(quantity, step_size, offset=0.000001):
     """Rounds the quantity to the nearest step size with a small offset."""
     return round((quantity + offset) / step_size) * step_size
 
+def format_to_step(quantity, step_size):
+    """Formats a quantity as an exact multiple of the step size (rounded down), e.g. for batch orders."""
+    step = Decimal(str(step_size)).normalize()
+    return str((Decimal(str(quantity)) / step).to_integral_value(ROUND_DOWN) * step)
+
 def calculate_variable_grid_spacing(level, base_spacing, grid_progression, max_spacing=None):
     """Calculate progressive grid spacing using a multiplier, constrained by a max_spacing value."""
     spacing = base_spacing * (grid_progression ** (level - 1))
@@ -78,13 +74,17 @@ def calculate_variable_grid_spacing(level, base_spacing, grid_progression, max_s
         return min(spacing, max_spacing)
     return spacing
 
-spacing_cache = {}
+# Maximum age (seconds) of the shared account snapshot for non-critical position checks
+POSITION_SNAPSHOT_MAX_AGE = 5
 
-def handle_grid_orders(symbol, grid_levels, order_quantity, working_type, leverage, progressive_grid, grid_progression, use_websocket, klines_interval, use_bollinger_bands=True, spacing_percent=1.0):
-    # Fetch market price
+def handle_grid_orders(symbol, grid_levels, order_quantity, working_type, leverage, progressive_grid, grid_progression, use_websocket, klines_interval, use_bollinger_bands=True, spacing_percent=1.0, price_max_age=MAX_PRICE_AGE, recenter=False, force_recenter=False):
+    api_key, api_secret = get_credentials()
+
+    # Fetch market price (streamed price if fresh, REST otherwise)
     if use_websocket:
-        market_price = get_latest_price(symbol)
+        market_price = get_latest_price(symbol, max_age=price_max_age)
         if market_price is None:
+            print(f"No fresh streamed price for {symbol}. Falling back to REST.")
             market_price = get_market_price(symbol, api_key, api_secret)
     else:
         market_price = get_market_price(symbol, api_key, api_secret)
@@ -104,7 +104,7 @@ def handle_grid_orders(symbol, grid_levels, order_quantity, working_type, levera
 
     # Fetch Bollinger Bands data
     if use_bollinger_bands:
-        bb_data = get_bollinger_bands(symbol, api_key, api_secret, klines_interval, 20)
+        bb_data = get_cached_bollinger_bands(symbol, api_key, api_secret, klines_interval, 20)
         if bb_data is None:
             print(f"Error: Could not fetch Bollinger Bands for {symbol}. Using fallback bounds.")
             upper_band = market_price * 1.05
@@ -134,34 +134,39 @@ def handle_grid_orders(symbol, grid_levels, order_quantity, working_type, levera
         print(f"Skipping this loop due to API error: {open_orders['error']}")
         return
 
-    previous_orders = load_open_orders_from_file(symbol)
-    new_orders = []
-    limit_orders = {}
+    state = load_grid_state(symbol)
+
+    # Re-center a running grid after a parameter change instead of resetting it
+    if force_recenter and open_orders:
+        recenter_grid(symbol, open_orders, state, market_price, upper_band, lower_band,
+                      grid_levels, order_quantity, tick_size, step_size, working_type)
+        return
 
     # Check orders in Bollinger Bands mode
     if use_bollinger_bands and bbw is not None:
-        check_orders_within_bands(symbol, open_orders, api_key, api_secret, upper_band, lower_band)
-        # Update open_orders if a reset occurred
-        updated_orders = get_open_orders(symbol, api_key, api_secret)
-        if isinstance(updated_orders, dict) and "error" in updated_orders:
-            print(f"Skipping this loop due to API error after reset: {updated_orders['error']}")
-            return
-        open_orders = updated_orders
-
-    # Fetch or calculate base_spacing
-    if symbol not in spacing_cache:
-        if use_bollinger_bands and bbw is not None:
-            total_levels = grid_levels * 2
-            base_spacing = (upper_band - lower_band) / total_levels
-            spacing_cache[symbol] = base_spacing
-        else:
-            base_spacing = calculate_dynamic_base_spacing(symbol, api_key, api_secret)
-        if base_spacing is None:
-            print(f"Error: Could not calculate base spacing for {symbol}.")
+        outside = check_orders_within_bands(symbol, open_orders, api_key, api_secret, upper_band, lower_band, recenter=recenter)
+        if outside and recenter:
+            recenter_grid(symbol, open_orders, state, market_price, upper_band, lower_band,
+                          grid_levels, order_quantity, tick_size, step_size, working_type)
             return
-        spacing_cache[symbol] = base_spacing
+        if outside:
+            # Update open_orders after the reset
+            updated_orders = get_open_orders(symbol, api_key, api_secret)
+            if isinstance(updated_orders, dict) and "error" in updated_orders:
+                print(f"Skipping this loop due to API error after reset: {updated_orders['error']}")
+                return
+            open_orders = updated_orders
+
+    # Fetch or calculate base_spacing (memoized until the next candle closes)
+    if use_bollinger_bands and bbw is not None:
+        total_levels = grid_levels * 2
+        base_spacing = memoize_on_candle(symbol, 'base_spacing', klines_interval, 20,
+                                         lambda: (upper_band - lower_band) / total_levels, grid_levels)
     else:
-        base_spacing = spacing_cache[symbol]
+        base_spacing = calculate_dynamic_base_spacing(symbol, api_key, api_secret)
+    if base_spacing is None:
+        print(f"Error: Could not calculate base spacing for {symbol}.")
+        return
 
     print(f"Debug: market_price={market_price}, sma={sma}, base_spacing={base_spacing}, tick_size={tick_size}, lower_band={lower_band}, upper_band={upper_band}, use_bollinger_bands={use_bollinger_bands}")
 
@@ -172,6 +177,20 @@ def handle_grid_orders(symbol, grid_levels, order_quantity, working_type, levera
             return
 
         order_quantity_adjusted = round_to_step_size(order_quantity, step_size)
+        generation = new_generation()
+        state = GridState(symbol, generation=generation)
+
+        # Levels the account can carry; the rest would be rejected by the exchange
+        if use_bollinger_bands:
+            planned_sells, planned_buys = compute_grid_targets(market_price, base_spacing, tick_size, grid_levels)
+        else:
+            planned_sells = [round_to_tick_size(market_price + level * base_spacing, tick_size) for level in range(1, grid_levels + 1)]
+            planned_buys = [round_to_tick_size(market_price - level * base_spacing, tick_size) for level in range(1, grid_levels + 1)]
+        sell_levels, buy_levels = risk_model.plan_grid(symbol, order_quantity_adjusted, planned_sells, planned_buys,
+                                                       leverage, api_key, api_secret)
+        if not (sell_levels or buy_levels):
+            print(f"{symbol}: Not enough margin for any grid level. Deferring grid setup.")
+            return
 
         if use_bollinger_bands:
             # Start from market price
@@ -180,22 +199,19 @@ def handle_grid_orders(symbol, grid_levels, order_quantity, working_type, levera
             # Place SELL orders above
             current_price = starting_price
             count = 0
-            sell_orders = []
-            while count < grid_levels:  # Removed upper_band restriction
+            sell_orders = 0
+            while count < sell_levels:  # Removed upper_band restriction
                 if current_price <= market_price:
                     current_price = round_to_tick_size(current_price + base_spacing, tick_size)
                     continue
                 side = 'SELL'
                 position_side = 'SHORT'
-                print(f"Checking {side} order at {current_price}, count={count}/{grid_levels}")
-                order = place_limit_order(symbol, side, order_quantity_adjusted, current_price, api_key, api_secret, position_side, working_type)
+                print(f"Checking {side} order at {current_price}, count={count}/{sell_levels}")
+                client_order_id = make_client_order_id(symbol, generation, side, count + 1)
+                order = place_limit_order(symbol, side, order_quantity_adjusted, current_price, api_key, api_secret, position_side, working_type, client_order_id)
                 if order and 'orderId' in order:
-                    sell_orders.append({
-                        'orderId': order['orderId'],
-                        'price': current_price,
-                        'side': side,
-                        'quantity': order_quantity_adjusted
-                    })
+                    state.add(GridOrder(order['orderId'], client_order_id, current_price, side, order_quantity_adjusted))
+                    sell_orders += 1
                     print(f"{side} at {current_price}")
                     count += 1
                 else:
@@ -205,30 +221,26 @@ def handle_grid_orders(symbol, grid_levels, order_quantity, working_type, levera
             # Place BUY orders below
             current_price = starting_price
             count = 0
-            buy_orders = []
-            while count < grid_levels:  # Removed lower_band restriction
+            buy_orders = 0
+            while count < buy_levels:  # Removed lower_band restriction
                 if current_price >= market_price:
                     current_price = round_to_tick_size(current_price - base_spacing, tick_size)
                     continue
                 side = 'BUY'
                 position_side = 'LONG'
-                print(f"Checking {side} order at {current_price}, count={count}/{grid_levels}")
-                order = place_limit_order(symbol, side, order_quantity_adjusted, current_price, api_key, api_secret, position_side, working_type)
+                print(f"Checking {side} order at {current_price}, count={count}/{buy_levels}")
+                client_order_id = make_client_order_id(symbol, generation, side, count + 1)
+                order = place_limit_order(symbol, side, order_quantity_adjusted, current_price, api_key, api_secret, position_side, working_type, client_order_id)
                 if order and 'orderId' in order:
-                    buy_orders.append({
-                        'orderId': order['orderId'],
-                        'price': current_price,
-                        'side': side,
-                        'quantity': order_quantity_adjusted
-                    })
+                    state.add(GridOrder(order['orderId'], client_order_id, current_price, side, order_quantity_adjusted))
+                    buy_orders += 1
                     print(f"{side} at {current_price}")
                     count += 1
                 else:
                     print(f"Order failed at {current_price}, skipping this level.")
                 current_price = round_to_tick_size(current_price - base_spacing, tick_size)
 
-            new_orders = sell_orders + buy_orders
-            print(f"Grid setup complete: {len(new_orders)} orders placed (SELL: {len(sell_orders)}, BUY: {len(buy_orders)})")
+            print(f"Grid setup complete: {len(state)} orders placed (SELL: {sell_orders}, BUY: {buy_orders})")
 
         else:  # Basic bot logic
             for level in range(1, grid_levels + 1):
@@ -237,49 +249,62 @@ def handle_grid_orders(symbol, grid_levels, order_quantity, working_type, levera
                 buy_price = round_to_tick_size(market_price - (level * buy_spacing), tick_size)
                 sell_price = round_to_tick_size(market_price + (level * sell_spacing), tick_size)
 
-                buy_order = place_limit_order(symbol, 'BUY', order_quantity_adjusted, buy_price, api_key, api_secret, 'LONG', working_type)
-                if buy_order and 'orderId' in buy_order:
-                    new_orders.append({'orderId': buy_order['orderId'], 'price': buy_price, 'side': 'BUY', 'quantity': order_quantity_adjusted})
-                    print(f"BUY at {buy_price}")
+                if level <= buy_levels:
+                    buy_id = make_client_order_id(symbol, generation, 'BUY', level)
+                    buy_order = place_limit_order(symbol, 'BUY', order_quantity_adjusted, buy_price, api_key, api_secret, 'LONG', working_type, buy_id)
+                    if buy_order and 'orderId' in buy_order:
+                        state.add(GridOrder(buy_order['orderId'], buy_id, buy_price, 'BUY', order_quantity_adjusted))
+                        print(f"BUY at {buy_price}")
 
-                sell_order = place_limit_order(symbol, 'SELL', order_quantity_adjusted, sell_price, api_key, api_secret, 'SHORT', working_type)
-                if sell_order and 'orderId' in sell_order:
-                    new_orders.append({'orderId': sell_order['orderId'], 'price': sell_price, 'side': 'SELL', 'quantity': order_quantity_adjusted})
-                    print(f"SELL at {sell_price}")
+                if level <= sell_levels:
+                    sell_id = make_client_order_id(symbol, generation, 'SELL', level)
+                    sell_order = place_limit_order(symbol, 'SELL', order_quantity_adjusted, sell_price, api_key, api_secret, 'SHORT', working_type, sell_id)
+                    if sell_order and 'orderId' in sell_order:
+                        state.add(GridOrder(sell_order['orderId'], sell_id, sell_price, 'SELL', order_quantity_adjusted))
+                        print(f"SELL at {sell_price}")
 
-        previous_orders = {'orders': new_orders, 'limit_orders': limit_orders}
-        save_open_orders_to_file(symbol, previous_orders)
+        save_grid_state(state, force=True)
 
-    else:  # Replacement logic
-        limit_orders = previous_orders.get('limit_orders', {}).copy()
+    else:  # Replacement logic: filled orders are replaced in their slot of the state
         tolerance = 0.001 * market_price
+        open_ids = {order['orderId'] for order in open_orders}
 
-        for previous_order in previous_orders.get('orders', []):
-            matching_order = next((order for order in open_orders if order['orderId'] == previous_order['orderId']), None)
-            if matching_order:
-                new_orders.append(previous_order)
-            else:
+        for previous_order in list(state):
+            if previous_order.order_id not in open_ids:
+                trace = latency_tracer.start(symbol, previous_order.order_id, previous_order.side)
+                if trace is not None:
+                    trace.mark("positions_start")
                 open_positions = get_open_positions(symbol, api_key, api_secret)
+                if trace is not None:
+                    trace.mark("positions_end")
                 if isinstance(open_positions, dict) and "error" in open_positions:
                     log_and_print(f"Skipping this loop due to API error: {open_positions['error']}")
+                    save_grid_state(state)  # Keep the replacements placed so far
                     return
 
                 if not open_positions:
                     message = f"{symbol} No open positions detected. Assuming that position is closed. Resetting grid."
                     log_and_print(message)
                     reset_grid(symbol, api_key, api_secret)
-                    if symbol in spacing_cache:
-                        del spacing_cache[symbol]
                     return
 
-                side = previous_order['side']
+                side = previous_order.side
                 new_side = 'SELL' if side == 'BUY' else 'BUY'
                 base_price = float(open_positions[0]['entryPrice'])
 
+                # A replacement placed before a crash or timeout is already resting: resume it
+                new_client_order_id = next_client_order_id(previous_order.client_order_id, new_side)
+                resting = next((order for order in open_orders if new_client_order_id and order.get('clientOrderId') == new_client_order_id), None)
+                if resting:
+                    log_and_print(f"{symbol} Replacement {new_client_order_id} already on the book. Resuming it.")
+                    state.replace(previous_order.order_id, GridOrder(resting['orderId'], new_client_order_id,
+                                                                     float(resting['price']), new_side, previous_order.quantity))
+                    continue
+
                 if use_bollinger_bands:
                     spacing = base_spacing
                 else:
-                    level = round(abs(previous_order['price'] - market_price) / base_spacing)
+                    level = round(abs(previous_order.price - market_price) / base_spacing)
                     spacing = calculate_variable_grid_spacing(level, base_spacing, grid_progression) if progressive_grid else base_spacing
 
                 new_price = (
@@ -301,35 +326,54 @@ def handle_grid_orders(symbol, grid_levels, order_quantity, working_type, levera
                 if any(abs(float(order['price']) - new_price) <= tolerance and order['side'] == new_side for order in open_orders):
                     message = f"{symbol} {new_side} order already exists at {new_price} within tolerance range. Skipping order replacement."
                     log_and_print(message)
+                    state.remove(previous_order.order_id)
                     continue
 
-                print(f"Placing new {new_side} order at {new_price} with quantity {previous_order['quantity']} "
+                # Deferred orders stay in the state, so the replacement is retried next loop
+                check = risk_model.check_order(symbol, new_side, previous_order.quantity, new_price, leverage,
+                                               float(open_positions[0].get('positionAmt', 0)), api_key, api_secret)
+                if check == DEFER:
+                    continue
+                if check == SKIP:
+                    state.remove(previous_order.order_id)
+                    continue
+
+                print(f"Placing new {new_side} order at {new_price} with quantity {previous_order.quantity} "
                       f"to replace filled {side} order")
-                new_order = place_limit_order(
-                    symbol, new_side, previous_order['quantity'], new_price, api_key, api_secret,
-                    'SHORT' if new_side == 'SELL' else 'LONG', working_type
-                )
+                if trace is not None:
+                    trace.mark("place")
+                trace_token = current_trace.set(trace)
+                try:
+                    new_order = place_limit_order(
+                        symbol, new_side, previous_order.quantity, new_price, api_key, api_secret,
+                        'SHORT' if new_side == 'SELL' else 'LONG', working_type, new_client_order_id
+                    )
+                finally:
+                    current_trace.reset(trace_token)
 
                 if new_order is None:
                     print(f"Error placing new {new_side} order at {new_price}. Skipping to the next iteration.")
+                    state.remove(previous_order.order_id)
                     continue
                 elif 'orderId' in new_order:
-                    new_orders.append({
-                        'orderId': new_order['orderId'],
-                        'price': new_price,
-                        'side': new_side,
-                        'quantity': previous_order['quantity']
-                    })
+                    state.replace(previous_order.order_id, GridOrder(new_order['orderId'], new_client_order_id,
+                                                                     new_price, new_side, previous_order.quantity))
                     message = f"{symbol} Placed a new replacement order {new_side} at {new_price}."
                     log_and_print(message)
+                    if trace is not None:
+                        # The fill time is looked up only after the replacement is on the book
+                        trace.mark("ack")
+                        filled = get_order(symbol, api_key, api_secret, order_id=previous_order.order_id)
+                        latency_tracer.finish(trace, new_order['orderId'], (filled or {}).get('updateTime'))
                 else:
                     print(f"Error placing new order at {new_price}")
+                    state.remove(previous_order.order_id)
                     continue
 
-        previous_orders = {'orders': new_orders, 'limit_orders': limit_orders}
-        save_open_orders_to_file(symbol, previous_orders)
+        # Written only if an order was replaced or dropped
+        save_grid_state(state)
 
-def check_orders_within_bands(symbol, open_orders, api_key, api_secret, upper_band, lower_band, tolerance=0.01):
+def check_orders_within_bands(symbol, open_orders, api_key, api_secret, upper_band, lower_band, tolerance=0.01, recenter=False):
     """
     Checks if open orders are within Bollinger Bands with tolerance and resets the grid if they are not (when no positions are open).
 
@@ -341,17 +385,21 @@ def check_orders_within_bands(symbol, open_orders, api_key, api_secret, upper_ba
         upper_band (float): Upper Bollinger Band limit.
         lower_band (float): Lower Bollinger Band limit.
         tolerance (float): Percentage tolerance (e.g., 0.01 = 1%).
+        recenter (bool): Only report drift; the caller re-centers the grid instead of resetting it.
+
+    Returns:
+        bool: True if an order was outside the bands (and the grid was reset unless recenter is set).
     """
-    open_positions = get_open_positions(symbol, api_key, api_secret)
+    open_positions = get_open_positions(symbol, api_key, api_secret, max_age=POSITION_SNAPSHOT_MAX_AGE)
     if open_positions and len(open_positions) > 0:
-        return  # Positions exist, no check needed
+        return False  # Positions exist, no check needed
 
     if not isinstance(open_orders, list):
         print(f"Invalid open_orders format in check_orders_within_bands: {open_orders}")
-        return
+        return False
 
     if not open_orders:
-        return
+        return False
 
     # Calculate expanded bounds with tolerance
     band_width = upper_band - lower_band
@@ -362,15 +410,145 @@ def check_orders_within_bands(symbol, open_orders, api_key, api_secret, upper_ba
         try:
             order_price = float(order['price'])
             if order_price < lower_bound or order_price > upper_bound:
+                if recenter:
+                    log_and_print(f"{symbol}: Order at {order_price} is outside Bollinger Bands with tolerance ({lower_bound} - {upper_bound}). Re-centering grid.")
+                    return True
                 message = f"{symbol}: Order at {order_price} is outside Bollinger Bands with tolerance ({lower_bound} - {upper_bound}). Resetting grid."
                 log_and_print(message)
                 reset_grid(symbol, api_key, api_secret)
-                if symbol in spacing_cache:
-                    del spacing_cache[symbol]
-                return
+                return True
         except (KeyError, TypeError) as e:
             print(f"Error processing order in check_orders_within_bands: {order}, Error: {e}")
             continue
+    return False
+
+def compute_grid_targets(market_price, base_spacing, tick_size, grid_levels):
+    """
+    Computes the target grid prices around the market price, as used when building a grid.
+
+    Returns:
+        tuple: (sell_prices, buy_prices), each ordered from the closest level outwards.
+    """
+    starting_price = round_to_tick_size(market_price, tick_size)
+    sell_prices, buy_prices = [], []
+    current_price = starting_price
+    while len(sell_prices) < grid_levels:
+        if current_price > market_price:
+            sell_prices.append(current_price)
+        current_price = round_to_tick_size(current_price + base_spacing, tick_size)
+    current_price = starting_price
+    while len(buy_prices) < grid_levels:
+        if current_price < market_price:
+            buy_prices.append(current_price)
+        current_price = round_to_tick_size(current_price - base_spacing, tick_size)
+    return sell_prices, buy_prices
+
+def position_counter_orders(open_orders, position_amount):
+    """
+    Returns the resting counter-orders of an open position.
+
+    These are replacement orders (client order sequence above 0) on the side that
+    reduces the position, closest to the market first, until they cover the position.
+    """
+    if not position_amount:
+        return []
+    side = 'SELL' if position_amount > 0 else 'BUY'
+    candidates = [o for o in open_orders if o.get('type') == 'LIMIT' and o['side'] == side
+                  and (parse_client_order_id(o.get('clientOrderId')) or {}).get('seq', 0) > 0]
+    candidates.sort(key=lambda o: float(o['price']), reverse=(side == 'BUY'))
+    counters = []
+    remaining = abs(position_amount)
+    for order in candidates:
+        if remaining <= 1e-12:
+            break
+        counters.append(order)
+        remaining -= float(order['origQty'])
+    return counters
+
+def recenter_grid(symbol, open_orders, state, market_price, upper_band, lower_band, grid_levels, order_quantity, tick_size, step_size, working_type):
+    """
+    Moves a running grid onto the level set for the current bands with as few requests as possible.
+
+    Targets are computed like a new grid. Resting grid orders are paired side by side
+    with them (closest first); paired orders are modified in place, surplus orders are
+    cancelled and only missing levels are placed. Open positions are kept: their resting
+    counter-orders stay untouched in place of the levels that were filled, and filled
+    orders that were not replaced yet stay in the state for the replacement pass.
+
+    Args:
+        symbol (str): Trading pair symbol.
+        open_orders (list): Exchange open orders for the symbol.
+        state (GridState): Persisted grid state.
+        market_price (float): Current market price.
+        upper_band (float): Upper Bollinger Band.
+        lower_band (float): Lower Bollinger Band.
+        grid_levels (int): Number of levels per side.
+        order_quantity (float): Quantity per order.
+        tick_size (float): Price tick size.
+        step_size (float): Quantity step size.
+        working_type (str): Order working type.
+    """
+    api_key, api_secret = get_credentials()
+    open_positions = get_open_positions(symbol, api_key, api_secret)
+    if isinstance(open_positions, dict) and "error" in open_positions:
+        log_and_print(f"{symbol} Skipping grid re-centering due to API error: {open_positions['error']}")
+        return
+    position_amount = sum(float(position['positionAmt']) for position in open_positions or [])
+
+    base_spacing = (upper_band - lower_band) / (grid_levels * 2)
+    quantity = round_to_step_size(order_quantity, step_size)
+    targets = dict(zip(('SELL', 'BUY'), compute_grid_targets(market_price, base_spacing, tick_size, grid_levels)))
+
+    generation = new_generation()
+    recentered = GridState(symbol, limit_orders=state.limit_orders, generation=generation)
+    modified = cancelled = placed = kept = 0
+
+    # Fills still waiting for their replacement and the position's counter-orders are carried over as they are
+    open_ids = {order['orderId'] for order in open_orders}
+    filled = [order for order in state if order.order_id not in open_ids]
+    counters = position_counter_orders(open_orders, position_amount)
+    counter_ids = {order['orderId'] for order in counters}
+    for order in filled:
+        recentered.add(order)
+    for order in counters:
+        recentered.add(GridOrder(order['orderId'], order.get('clientOrderId'), float(order['price']), order['side'],
+                                 float(order['origQty'])))
+
+    for side, prices in targets.items():
+        # The innermost levels of a side are taken by its fills
+        consumed = sum(order['side'] != side for order in counters) + sum(order.side == side for order in filled)
+        levels = list(enumerate(prices, start=1))[consumed:]
+        resting = sorted((o for o in open_orders if o.get('type') == 'LIMIT' and o['side'] == side
+                          and o['orderId'] not in counter_ids),
+                         key=lambda o: abs(float(o['price']) - market_price))
+        for index, (level, target_price) in enumerate(levels):
+            if index < len(resting):
+                order = resting[index]
+                entry = GridOrder(order['orderId'], order.get('clientOrderId'), target_price, side, quantity)
+                if abs(float(order['price']) - target_price) < tick_size / 2 and abs(float(order['origQty']) - quantity) < step_size / 2:
+                    kept += 1
+                    recentered.add(entry)
+                    continue
+                if modify_limit_order(symbol, order['orderId'], side, quantity, target_price, api_key, api_secret):
+                    modified += 1
+                    recentered.add(entry)
+                    continue
+                # Modify rejected (e.g. partially filled meanwhile): replace the order
+                cancel_order(symbol, order['orderId'], api_key, api_secret)
+                cancelled += 1
+            client_order_id = make_client_order_id(symbol, generation, side, level)
+            order = place_limit_order(symbol, side, quantity, target_price, api_key, api_secret,
+                                      'SHORT' if side == 'SELL' else 'LONG', working_type, client_order_id)
+            if order and 'orderId' in order:
+                placed += 1
+                recentered.add(GridOrder(order['orderId'], client_order_id, target_price, side, quantity))
+        for order in resting[len(levels):]:
+            cancel_order(symbol, order['orderId'], api_key, api_secret)
+            cancelled += 1
+
+    save_grid_state(recentered, force=True)
+    log_and_print(f"{symbol} Grid re-centered: {kept} kept, {modified} modified, {placed} placed, {cancelled} cancelled, "
+                  f"{len(counters)} counter-orders and {len(filled)} unreplaced fills carried over.")
 
 def handle_breakout_strategy(symbol, trigger_result, order_quantity, trailing_stop_rate, api_key, api_secret, working_type, active_breakouts):
     """
@@ -399,40 +577,83 @@ def handle_breakout_strategy(symbol, trigger_result, order_quantity, trailing_st
             log_and_print(f"Breakout already active for {symbol}, skipping new position.")
             return
 
-    # Breakout-long
     if trigger_result['strategy'] == 'breakout_long':
         print(f"Initiating long position for {symbol}.")
-        market_order = place_market_order(symbol, "BUY", order_quantity, api_key, api_secret)
-        if market_order:
-            log_and_print(f"{symbol} Breakout long opened: {market_order}.")
-            trailing_stop = open_trailing_stop_order(
-                symbol=symbol, side="SELL", quantity=order_quantity,
-                callback_rate=trailing_stop_rate, api_key=api_key, api_secret=api_secret, working_type=working_type
-            )
-            if trailing_stop:
-                log_and_print(f"{symbol} Trailing stop set for long: {trailing_stop}.")
-                active_breakouts[symbol] = 'long'
-            else:
-                log_and_print(f"Failed to set trailing stop for {symbol}. Closing position.")
-                place_market_order(symbol, "SELL", order_quantity, api_key, api_secret)
-        else:
-            log_and_print(f"Failed to open long position for {symbol}.")
-
-    # Breakout-short
+        if open_breakout_position(symbol, "BUY", order_quantity, trailing_stop_rate, working_type, api_key, api_secret):
+            active_breakouts[symbol] = 'long'
     elif trigger_result['strategy'] == 'breakout_short':
         print(f"Initiating short position for {symbol}.")
-        market_order = place_market_order(symbol, "SELL", order_quantity, api_key, api_secret)
-        if market_order:
-            log_and_print(f"{symbol} Short position opened: {market_order}")
-            trailing_stop = open_trailing_stop_order(
-                symbol=symbol, side="BUY", quantity=order_quantity,
-                callback_rate=trailing_stop_rate, api_key=api_key, api_secret=api_secret, working_type=working_type
-            )
-            if trailing_stop:
-                log_and_print(f"{symbol} Trailing stop set for short: {trailing_stop}")
-                active_breakouts[symbol] = 'short'
-            else:
-                log_and_print(f"Failed to set trailing stop for {symbol}. Closing position.")
-                place_market_order(symbol, "BUY", order_quantity, api_key, api_secret)
-        else:
-            log_and_print(f"Failed to open short position for {symbol}.")
+        if open_breakout_position(symbol, "SELL", order_quantity, trailing_stop_rate, working_type, api_key, api_secret):
+            active_breakouts[symbol] = 'short'
+
+BATCH_LOOKBACK_MS = 5000  # Clock margin when looking up the legs of a batch
+
+def open_breakout_position(symbol, side, order_quantity, trailing_stop_rate, working_type, api_key, api_secret):
+    """
+    Opens a breakout position together with its trailing stop in one batch request.
+
+    The market entry and the trailing stop are sent in one batchOrders request with
+    exact step-size quantities and client order IDs. Both legs are then verified with a
+    single allOrders query. A filled entry without a stop gets one more stop attempt
+    before it is closed with a reduce-only market order; a stop without a filled entry
+    is cancelled.
+
+    Args:
+        symbol (str): Trading pair.
+        side (str): Entry side, "BUY" (long) or "SELL" (short).
+        order_quantity (float): Position size.
+        trailing_stop_rate (float): Trailing stop callback rate (e.g., 1.0 for 1%).
+        working_type (str): Order working type.
+        api_key (str): Binance API key.
+        api_secret (str): Binance API secret.
+
+    Returns:
+        bool: True if the position is open and protected by the trailing stop.
+    """
+    step_size = get_step_size(symbol, api_key, api_secret)
+    if not step_size:
+        log_and_print(f"Failed to open breakout for {symbol}: no step size.")
+        return False
+    quantity = format_to_step(order_quantity, step_size)
+    if float(quantity) <= 0:
+        log_and_print(f"Failed to open breakout for {symbol}: quantity {order_quantity} below step size {step_size}.")
+        return False
+
+    stop_side = "SELL" if side == "BUY" else "BUY"
+    generation = new_generation()
+    entry_id = make_client_order_id(symbol, generation, side, 0)
+    stop_id = make_client_order_id(symbol, generation, stop_side, 0)
+    start_time = get_server_time(api_key, api_secret) - BATCH_LOOKBACK_MS
+    results = place_batch_orders(symbol, [
+        {'symbol': symbol, 'side': side, 'type': 'MARKET', 'quantity': quantity, 'newClientOrderId': entry_id},
+        {'symbol': symbol, 'side': stop_side, 'type': 'TRAILING_STOP_MARKET', 'quantity': quantity,
+         'callbackRate': str(trailing_stop_rate), 'workingType': working_type, 'newClientOrderId': stop_id},
+    ], api_key, api_secret)
+    log_and_print(f"{symbol} Breakout batch response: {results}")
+
+    # One query verifies both legs (the batch answer is unreliable after retries or timeouts)
+    orders = get_recent_orders(symbol, start_time, api_key, api_secret)
+    if orders is None:
+        orders = [result for result in results or [] if 'orderId' in result]
+    legs = {order.get('clientOrderId'): order for order in orders}
+    entry, stop = legs.get(entry_id), legs.get(stop_id)
+    filled = float(entry['executedQty']) if entry else 0.0
+    stop_live = stop is not None and stop['status'] == 'NEW'
+
+    if filled and stop_live:
+        log_and_print(f"{symbol} Breakout {'long' if side == 'BUY' else 'short'} opened with trailing stop {stop['orderId']}.")
+        return True
+    if not filled:
+        if stop_live:
+            cancel_order(symbol, stop['orderId'], api_key, api_secret)
+        log_and_print(f"Failed to open breakout position for {symbol}.")
+        return False
+
+    log_and_print(f"Trailing stop missing for {symbol} breakout. Retrying it once.")
+    trailing_stop = open_trailing_stop_order(symbol, stop_side, filled, trailing_stop_rate, api_key, api_secret, working_type)
+    if trailing_stop and 'orderId' in trailing_stop:
+        log_and_print(f"{symbol} Trailing stop set: {trailing_stop}.")
+        return True
+    log_and_print(f"Failed to set trailing stop for {symbol}. Closing position.")
+    place_market_order(symbol, stop_side, filled, api_key, api_secret, reduce_only=True)
+    return False
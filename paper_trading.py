@@ -0,0 +1,509 @@
+import argparse
+import csv
+import json
+import os
+import time
+from contextvars import ContextVar, copy_context
+from datetime import datetime, timezone
+from threading import Event, RLock, Thread
+
+from file_utils import load_json, state_dir
+from strategy_sim import MAKER_FEE, TAKER_FEE
+
+DEFAULT_CAPITAL = 1000.0
+DEFAULT_FUNDING_RATE = 0.0001  # Per funding interval, paid by longs when positive
+FUNDING_INTERVAL_MS = 8 * 3_600_000  # Funding at 00:00, 08:00 and 16:00 UTC
+PRICE_POLL_INTERVAL = 0.25  # Seconds between live price pushes to the matching engines
+SYMBOL_REFRESH_INTERVAL = 30  # Seconds between re-reading the configs for new symbols
+SUMMARY_INTERVAL = 60  # Seconds between summary reports
+DEFAULT_STATE_ROOT = "paper_runs"
+
+UNKNOWN_ORDER = -2011
+ORDER_NOT_FOUND = -2013
+REDUCE_ONLY_REJECTED = -2022
+
+# Execution backend of the current run. None means the real exchange.
+execution_backend = ContextVar("execution_backend", default=None)
+
+
+def active_backend():
+    """Returns the paper exchange of the current context, or None for live trading."""
+    return execution_backend.get()
+
+
+def submit_with_context(pool, fn, *args):
+    """
+    Submits fn to a thread pool inside a copy of the caller's context, so worker
+    threads keep using the caller's execution backend and state directory.
+    """
+    return pool.submit(copy_context().run, fn, *args)
+
+
+class PaperExchange:
+    """
+    In-memory matching engine that mirrors the order and position endpoints used by the bot.
+
+    Limit orders fill at their price when the market trades through it (maker fee);
+    market, stop-market and trailing-stop orders fill at the current price (taker fee).
+    Positions are one-way (BOTH) and funding is charged at every funding boundary.
+    """
+
+    def __init__(self, name, capital=DEFAULT_CAPITAL, maker_fee=MAKER_FEE, taker_fee=TAKER_FEE,
+                 funding_rate=DEFAULT_FUNDING_RATE):
+        self.name = name
+        self.capital = capital
+        self.maker_fee = maker_fee
+        self.taker_fee = taker_fee
+        self.funding_rate = funding_rate
+        self.orders = {}  # orderId -> order (all statuses, so filled orders stay queryable)
+        self.open_order_ids = {}  # symbol -> [orderId, ...] of working orders
+        self.client_ids = {}  # (symbol, clientOrderId) -> orderId
+        self.positions = {}  # symbol -> [signed amount, entry price]
+        self.leverage = {}
+        self.prices = {}
+        self.trail_extremes = {}  # orderId -> best price seen by a trailing stop
+        self.realized_pnl = 0.0
+        self.fees = 0.0
+        self.funding = 0.0
+        self.fills = 0
+        self.peak_equity = capital
+        self.max_drawdown = 0.0
+        self._next_id = 1
+        self._last_time = None
+        self._lock = RLock()
+
+    # Matching engine
+
+    def on_price(self, symbol, price, timestamp_ms=None):
+        """
+        Advances the engine with a new price: charges funding, then triggers and fills
+        the symbol's working orders.
+        """
+        timestamp_ms = int(time.time() * 1000) if timestamp_ms is None else int(timestamp_ms)
+        with self._lock:
+            if self._last_time is not None and timestamp_ms // FUNDING_INTERVAL_MS > self._last_time // FUNDING_INTERVAL_MS:
+                self._charge_funding()
+            self._last_time = max(timestamp_ms, self._last_time or 0)
+            self.prices[symbol] = price
+            for order_id in list(self.open_order_ids.get(symbol, [])):
+                order = self.orders[order_id]
+                if self._triggered(order, price):
+                    if order['type'] == 'LIMIT':
+                        self._fill(order, float(order['price']), self.maker_fee)
+                    else:
+                        self._fill(order, price, self.taker_fee)
+            equity = self.equity()
+            self.peak_equity = max(self.peak_equity, equity)
+            self.max_drawdown = max(self.max_drawdown, self.peak_equity - equity)
+
+    def _triggered(self, order, price):
+        side, order_type = order['side'], order['type']
+        if order_type == 'LIMIT':
+            limit = float(order['price'])
+            return price <= limit if side == 'BUY' else price >= limit
+        if order_type == 'STOP_MARKET':
+            stop = float(order['stopPrice'])
+            return price >= stop if side == 'BUY' else price <= stop
+        if order_type == 'TRAILING_STOP_MARKET':
+            callback = float(order['priceRate']) / 100
+            extreme = self.trail_extremes[order['orderId']]
+            if side == 'SELL':  # Protects a long: follows the high
+                extreme = self.trail_extremes[order['orderId']] = max(extreme, price)
+                return price <= extreme * (1 - callback)
+            extreme = self.trail_extremes[order['orderId']] = min(extreme, price)
+            return price >= extreme * (1 + callback)
+        return False
+
+    def _fill(self, order, price, fee_rate):
+        quantity = float(order['origQty'])
+        signed = quantity if order['side'] == 'BUY' else -quantity
+        amount, entry = self.positions.get(order['symbol'], [0.0, 0.0])
+        if amount == 0 or (amount > 0) == (signed > 0):
+            new_amount = amount + signed
+            entry = (amount * entry + signed * price) / new_amount
+        else:
+            closed = min(abs(amount), abs(signed))
+            self.realized_pnl += closed * (price - entry) * (1 if amount > 0 else -1)
+            new_amount = amount + signed
+            if abs(new_amount) < 1e-12:
+                new_amount = 0.0
+            elif (new_amount > 0) != (amount > 0):
+                entry = price  # Position flipped
+        self.positions[order['symbol']] = [new_amount, entry]
+        self.fees += quantity * price * fee_rate
+        self.fills += 1
+        order.update(status='FILLED', executedQty=order['origQty'], avgPrice=str(price),
+                     updateTime=self._last_time or int(time.time() * 1000))
+        self._close(order)
+
+    def _charge_funding(self):
+        for symbol, (amount, _) in self.positions.items():
+            if amount and symbol in self.prices:
+                self.funding += amount * self.prices[symbol] * self.funding_rate
+
+    def _close(self, order):
+        working = self.open_order_ids.get(order['symbol'], [])
+        if order['orderId'] in working:
+            working.remove(order['orderId'])
+        self.trail_extremes.pop(order['orderId'], None)
+
+    def _new_order(self, symbol, side, order_type, quantity, price=0.0, client_order_id=None, **extra):
+        order_id = self._next_id
+        self._next_id += 1
+        client_order_id = client_order_id or f"paper-{order_id}"
+        order = {
+            'orderId': order_id,
+            'symbol': symbol,
+            'status': 'NEW',
+            'clientOrderId': client_order_id,
+            'price': str(round(price, 7)),
+            'avgPrice': '0',
+            'origQty': str(abs(round(quantity, 3))),
+            'executedQty': '0',
+            'type': order_type,
+            'side': side,
+            'positionSide': 'BOTH',
+            'timeInForce': 'GTC',
+            'updateTime': self._last_time or int(time.time() * 1000),
+        }
+        order['time'] = order['updateTime']
+        order.update(extra)
+        self.orders[order_id] = order
+        self.client_ids[(symbol, client_order_id)] = order_id
+        self.open_order_ids.setdefault(symbol, []).append(order_id)
+        return order
+
+    def equity(self):
+        unrealized = sum(amount * (self.prices.get(symbol, entry) - entry)
+                         for symbol, (amount, entry) in self.positions.items())
+        return self.capital + self.realized_pnl + unrealized - self.fees - self.funding
+
+    def summary(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'equity': self.equity(),
+                'realized_pnl': self.realized_pnl,
+                'fees': self.fees,
+                'funding': self.funding,
+                'fills': self.fills,
+                'max_drawdown': self.max_drawdown,
+                'open_orders': sum(len(ids) for ids in self.open_order_ids.values()),
+                'positions': {symbol: amount for symbol, (amount, _) in self.positions.items() if amount},
+            }
+
+    # Exchange endpoints (same return shapes as binance_futures)
+
+    def get_market_price(self, symbol):
+        return self.prices.get(symbol)
+
+    def get_open_orders(self, symbol):
+        with self._lock:
+            return [dict(self.orders[order_id]) for order_id in self.open_order_ids.get(symbol, [])]
+
+    def get_all_open_orders(self):
+        with self._lock:
+            return [dict(self.orders[order_id]) for ids in self.open_order_ids.values() for order_id in ids]
+
+    def _position_view(self, symbol):
+        amount, entry = self.positions[symbol]
+        mark = self.prices.get(symbol, entry)
+        return {
+            'symbol': symbol,
+            'positionAmt': str(amount),
+            'entryPrice': str(entry),
+            'markPrice': str(mark),
+            'unRealizedProfit': str(amount * (mark - entry)),
+            'leverage': str(self.leverage.get(symbol, 20)),
+            'positionSide': 'BOTH',
+        }
+
+    def get_open_positions(self, symbol):
+        with self._lock:
+            if self.positions.get(symbol, [0.0])[0] == 0:
+                return []
+            return [self._position_view(symbol)]
+
+    def get_all_open_positions(self):
+        with self._lock:
+            return [self._position_view(symbol) for symbol, (amount, _) in self.positions.items() if amount]
+
+    def get_order(self, symbol, order_id=None, client_order_id=None):
+        with self._lock:
+            if order_id is None:
+                order_id = self.client_ids.get((symbol, client_order_id))
+            order = self.orders.get(order_id)
+            if order is None or order['symbol'] != symbol:
+                return {'code': ORDER_NOT_FOUND, 'msg': 'Order does not exist.'}
+            return dict(order)
+
+    def place_limit_order(self, symbol, side, quantity, price, client_order_id=None):
+        with self._lock:
+            existing = self.client_ids.get((symbol, client_order_id)) if client_order_id else None
+            if existing is not None:
+                return dict(self.orders[existing])  # Same as resuming a duplicate clientOrderId
+            order = self._new_order(symbol, side, 'LIMIT', quantity, price, client_order_id)
+            market_price = self.prices.get(symbol)
+            if market_price is not None and self._triggered(order, market_price):
+                self._fill(order, market_price, self.taker_fee)  # Crossing order takes liquidity
+            return dict(order)
+
+    def modify_limit_order(self, symbol, order_id, side, quantity, price):
+        with self._lock:
+            order = self.orders.get(order_id)
+            if order is None or order['status'] != 'NEW' or order['side'] != side:
+                print(f"Failed to modify paper order {order_id} for {symbol}.")
+                return None
+            order.update(price=str(round(price, 7)), origQty=str(round(quantity, 3)))
+            return dict(order)
+
+    def place_market_order(self, symbol, side, quantity, reduce_only=False, client_order_id=None):
+        with self._lock:
+            price = self.prices.get(symbol)
+            if price is None:
+                print(f"No paper price for {symbol}. Market order rejected.")
+                return None
+            if reduce_only:
+                amount = self.positions.get(symbol, [0.0, 0.0])[0]
+                if amount == 0 or (amount > 0) == (side == 'BUY'):
+                    return {'code': REDUCE_ONLY_REJECTED, 'msg': 'ReduceOnly Order is rejected.'}
+                quantity = min(quantity, abs(amount))
+            order = self._new_order(symbol, side, 'MARKET', quantity, client_order_id=client_order_id)
+            self._fill(order, price, self.taker_fee)
+            return dict(order)
+
+    def place_stop_market_order(self, symbol, side, quantity, stop_price):
+        with self._lock:
+            return dict(self._new_order(symbol, side, 'STOP_MARKET', quantity, stopPrice=str(round(stop_price, 7))))
+
+    def open_trailing_stop_order(self, symbol, side, quantity, callback_rate, client_order_id=None):
+        with self._lock:
+            price = self.prices.get(symbol)
+            order = self._new_order(symbol, side, 'TRAILING_STOP_MARKET', quantity, client_order_id=client_order_id,
+                                    priceRate=str(callback_rate), activatePrice=str(price))
+            self.trail_extremes[order['orderId']] = price if price is not None else float(
+                'inf' if side == 'BUY' else '-inf')
+            return dict(order)
+
+    def place_batch_orders(self, orders):
+        results = []
+        for order in orders:
+            if order['type'] == 'MARKET':
+                result = self.place_market_order(order['symbol'], order['side'], float(order['quantity']),
+                                                 order.get('reduceOnly') == 'true', order.get('newClientOrderId'))
+            elif order['type'] == 'TRAILING_STOP_MARKET':
+                result = self.open_trailing_stop_order(order['symbol'], order['side'], float(order['quantity']),
+                                                       float(order['callbackRate']), order.get('newClientOrderId'))
+            else:
+                result = None
+            results.append(result or {'code': -1116, 'msg': 'Invalid orderType.'})
+        return results
+
+    def get_account(self):
+        """Account view with a conservative availableBalance: equity minus position and open order margin."""
+        with self._lock:
+            used = sum(abs(amount) * self.prices.get(symbol, entry) / self.leverage.get(symbol, 20)
+                       for symbol, (amount, entry) in self.positions.items())
+            used += sum(float(order['origQty']) * float(order['price']) / self.leverage.get(symbol, 20)
+                        for symbol, ids in self.open_order_ids.items() for order in (self.orders[i] for i in ids)
+                        if order['type'] == 'LIMIT')
+            equity = self.equity()
+            return {'totalWalletBalance': str(equity), 'availableBalance': str(max(equity - used, 0.0)),
+                    'positions': [{'symbol': symbol, 'leverage': str(leverage)} for symbol, leverage in self.leverage.items()]}
+
+    def get_server_time(self):
+        return self._last_time or int(time.time() * 1000)
+
+    def get_recent_orders(self, symbol, start_time):
+        with self._lock:
+            return [dict(order) for order in self.orders.values()
+                    if order['symbol'] == symbol and order['time'] >= start_time]
+
+    def cancel_order(self, symbol, order_id):
+        with self._lock:
+            order = self.orders.get(order_id)
+            if order is None or order['status'] != 'NEW':
+                print(f"Failed to cancel paper order {order_id}.")
+                return {'code': UNKNOWN_ORDER, 'msg': 'Unknown order sent.'}
+            order['status'] = 'CANCELED'
+            self._close(order)
+            print(f"Order {order_id} canceled successfully.")
+            return dict(order)
+
+    def cancel_existing_orders(self, symbol):
+        with self._lock:
+            order_ids = list(self.open_order_ids.get(symbol, []))
+            for order_id in order_ids:
+                self.orders[order_id]['status'] = 'CANCELED'
+                self._close(self.orders[order_id])
+        print(f"Total cancelled orders: {len(order_ids)}" if order_ids else f"No open orders found for {symbol}.")
+
+    def set_leverage(self, symbol, leverage):
+        with self._lock:
+            self.leverage[symbol] = int(leverage)
+        return {'symbol': symbol, 'leverage': int(leverage)}
+
+
+# Runner
+
+def collect_symbols(config_paths):
+    symbols = set()
+    for path in config_paths:
+        try:
+            symbols.update(load_json(path).get("crypto_settings", {}).keys())
+        except Exception as e:
+            print(f"Could not read {path}: {e}")
+    return symbols
+
+
+def read_recording(path):
+    """Yields (timestamp_ms, symbol, price) from a CSV recording with those three columns."""
+    with open(path, newline="") as file:
+        for row in csv.reader(file):
+            if not row or not row[0].isdigit():
+                continue  # Header or blank line
+            yield int(row[0]), row[1].upper(), float(row[2])
+
+
+def feed_live(backends, config_paths, stop_event):
+    """Pushes streamed prices for every configured symbol to all paper exchanges."""
+    from binance_websockets import start_websocket, update_symbols, get_latest_price
+
+    symbols = collect_symbols(config_paths)
+    start_websocket(symbols)
+    refreshed = time.time()
+    while not stop_event.is_set():
+        if time.time() - refreshed > SYMBOL_REFRESH_INTERVAL:
+            symbols = collect_symbols(config_paths)
+            update_symbols(symbols)
+            refreshed = time.time()
+        now = int(time.time() * 1000)
+        for symbol in symbols:
+            price = get_latest_price(symbol)
+            if price is not None:
+                for backend in backends:
+                    backend.on_price(symbol, price, now)
+        stop_event.wait(PRICE_POLL_INTERVAL)
+
+
+def feed_recording(backends, recording, stop_event, speed=1.0):
+    """
+    Replays a price recording to all paper exchanges, `speed` times faster than real time.
+
+    Args:
+        recording (str or iterable): CSV file, or (timestamp_ms, symbol, price) ticks
+            such as market_recorder.replay_prices().
+    """
+    ticks = read_recording(recording) if isinstance(recording, str) else recording
+    started = time.time()
+    first = None
+    for timestamp, symbol, price in ticks:
+        if stop_event.is_set():
+            return
+        first = timestamp if first is None else first
+        delay = (timestamp - first) / 1000 / speed - (time.time() - started)
+        if delay > 0 and stop_event.wait(delay):
+            return
+        for backend in backends:
+            backend.on_price(symbol, price, timestamp)
+    print("Price recording finished.")
+    stop_event.set()
+
+
+def run_config(config_path, backend, run_dir, stop_event):
+    """Runs the unchanged main_loop for one config against its paper exchange."""
+    execution_backend.set(backend)
+    state_dir.set(run_dir)
+    from main import main_loop
+    try:
+        main_loop(config_path=config_path, stop_event=stop_event)
+    except Exception as e:
+        print(f"Paper run {backend.name} stopped: {e}")
+
+
+def write_summary(backends, state_root):
+    summaries = [backend.summary() for backend in backends]
+    with open(os.path.join(state_root, "summary.json"), "w") as file:
+        json.dump(summaries, file, indent=4)
+    for s in sorted(summaries, key=lambda s: s['equity'], reverse=True):
+        print(f"{s['name']}: equity={s['equity']:.2f} realized={s['realized_pnl']:.2f} fees={s['fees']:.2f} "
+              f"funding={s['funding']:.2f} fills={s['fills']} max_dd={s['max_drawdown']:.2f}")
+    return summaries
+
+
+def run_paper(config_paths, recording=None, speed=1.0, capital=DEFAULT_CAPITAL,
+              funding_rate=DEFAULT_FUNDING_RATE, state_root=DEFAULT_STATE_ROOT, stop_event=None):
+    """
+    Runs several configs side by side in one process, each against its own paper exchange
+    and its own state directory (orders files and intent journals).
+
+    Args:
+        config_paths (list): Config files to run.
+        recording (str or iterable, optional): CSV price recording or ticks; None uses
+            the live price stream.
+        speed (float): Replay speed of the recording.
+        capital (float): Starting capital of each run.
+        funding_rate (float): Funding rate per 8 hours.
+        state_root (str): Directory for the per-run state directories and summary.json.
+        stop_event (threading.Event, optional): Stops all runs when set.
+
+    Returns:
+        list: Final summary of every run.
+    """
+    stop_event = stop_event or Event()
+    backends = []
+    threads = []
+    for path in config_paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        while any(backend.name == name for backend in backends):
+            name += "_"
+        run_dir = os.path.join(state_root, name)
+        os.makedirs(run_dir, exist_ok=True)
+        backend = PaperExchange(name, capital, funding_rate=funding_rate)
+        backends.append(backend)
+        threads.append(Thread(target=run_config, args=(path, backend, run_dir, stop_event),
+                              name=f"paper-{name}", daemon=True))
+
+    if recording:
+        feeder = Thread(target=feed_recording, args=(backends, recording, stop_event, speed), daemon=True)
+    else:
+        feeder = Thread(target=feed_live, args=(backends, config_paths, stop_event), daemon=True)
+    feeder.start()
+    for thread in threads:
+        thread.start()
+
+    try:
+        while not stop_event.wait(SUMMARY_INTERVAL):
+            write_summary(backends, state_root)
+    except KeyboardInterrupt:
+        print("Stopping paper runs...")
+        stop_event.set()
+    for thread in threads:
+        thread.join(timeout=5)
+    return write_summary(backends, state_root)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run configs against local paper exchanges.")
+    parser.add_argument("configs", nargs="+", help="Config files to run side by side")
+    parser.add_argument("--recording", help="CSV price recording (timestamp_ms,symbol,price); default is the live stream")
+    parser.add_argument("--replay-from", help="Replay recorded market data from this UTC time (e.g. 2026-10-01T00:00)")
+    parser.add_argument("--replay-to", help="End of the market data replay (default: now)")
+    parser.add_argument("--data-dir", default="market_data", help="Recorded market data directory")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed of the recording")
+    parser.add_argument("--capital", type=float, default=DEFAULT_CAPITAL, help="Starting capital per run")
+    parser.add_argument("--funding-rate", type=float, default=DEFAULT_FUNDING_RATE, help="Funding rate per 8 hours")
+    parser.add_argument("--state-root", default=DEFAULT_STATE_ROOT, help="Directory for run state and summary.json")
+    args = parser.parse_args()
+    recording = args.recording
+    if args.replay_from:
+        from market_recorder import replay_prices
+        start = int(datetime.fromisoformat(args.replay_from).replace(tzinfo=timezone.utc).timestamp() * 1000)
+        end = int(datetime.fromisoformat(args.replay_to).replace(tzinfo=timezone.utc).timestamp() * 1000) \
+            if args.replay_to else int(time.time() * 1000)
+        recording = replay_prices(collect_symbols(args.configs), start, end, root=args.data_dir)
+    run_paper(args.configs, recording, args.speed, args.capital, args.funding_rate, args.state_root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+import cProfile
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import requests
+
+MODES = ("cprofile", "sample", "rest")
+DEFAULT_MODE = "cprofile"
+DEFAULT_LOOPS = 3  # Loops profiled when toggled by signal without further settings
+CONTROL_FILE = "profile.json"  # {"mode": "sample", "loops": 5} or {"mode": "rest", "seconds": 120}
+DEFAULT_OUTPUT_DIR = "profiles"
+SAMPLE_INTERVAL = 0.005  # Seconds between stack samples
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def collapse(frame):
+    """Returns the stack of a frame as a collapsed-stack string (root first)."""
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Profiler:
+    """
+    On-demand profiling of the trading loop.
+
+    A session is started by SIGUSR1, the control file or the "profiling" config key and
+    runs for a number of loops or seconds. When no session is active, call() is a plain
+    function call and nothing is patched or sampled.
+
+    Modes:
+        cprofile: cProfile of each process_symbol call, one .pstats file per symbol.
+        sample: stack samples of all threads, one collapsed-stack file per symbol/thread.
+        rest: wall-clock time of every REST call, collapsed per symbol and endpoint.
+    """
+
+    def __init__(self, output_dir=DEFAULT_OUTPUT_DIR):
+        self.output_dir = output_dir
+        self.active = False
+        self.mode = None
+        self.loops_left = None
+        self.deadline = None
+        self._profiles = {}  # symbol -> cProfile.Profile
+        self._stacks = Counter()  # (owner, collapsed stack) -> samples
+        self._rest = {}  # (symbol, "METHOD path") -> [calls, total seconds, max seconds]
+        self._symbols = {}  # thread ident -> symbol being processed
+        self._signal_pending = False
+        self._last_config = None
+        self._lock = threading.Lock()
+        self._stop_sampler = threading.Event()
+        self._sampler = None
+        self._original_request = None
+
+    # Triggers
+
+    def install_signal_handler(self):
+        """Toggles profiling on SIGUSR1 (main thread only, where the platform supports it)."""
+        if hasattr(signal, "SIGUSR1") and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGUSR1, self._on_signal)
+
+    def _on_signal(self, signum, frame):
+        self._signal_pending = True  # Handled at the start of the next loop
+
+    def poll(self, config_value=None):
+        """
+        Checks the triggers; called at the start of every loop.
+
+        Args:
+            config_value (dict, optional): The "profiling" key of config.json.
+        """
+        if self._signal_pending:
+            self._signal_pending = False
+            if self.active:
+                self.stop()
+            else:
+                self.start(DEFAULT_MODE, loops=DEFAULT_LOOPS)
+        if os.path.exists(CONTROL_FILE):
+            try:
+                with open(CONTROL_FILE, "r") as file:
+                    settings = json.load(file)
+                os.remove(CONTROL_FILE)
+                self._apply(settings)
+            except Exception as e:
+                print(f"Ignoring invalid {CONTROL_FILE}: {e}")
+        if config_value != self._last_config:
+            self._last_config = config_value
+            if config_value:
+                self._apply(config_value)
+        if self.active and self.deadline is not None and time.time() >= self.deadline:
+            self.stop()
+
+    def _apply(self, settings):
+        if settings.get("mode", DEFAULT_MODE) == "off":
+            self.stop()
+        else:
+            self.start(settings.get("mode", DEFAULT_MODE), settings.get("loops"), settings.get("seconds"))
+
+    def end_loop(self):
+        """Counts a finished loop and ends the session when its loops are used up."""
+        if self.active and self.loops_left is not None:
+            self.loops_left -= 1
+            if self.loops_left <= 0:
+                self.stop()
+
+    # Session
+
+    def start(self, mode, loops=None, seconds=None):
+        if mode not in MODES:
+            print(f"Unknown profiling mode {mode}. Use one of {', '.join(MODES)}.")
+            return
+        if self.active:
+            self.stop()
+        if loops is None and seconds is None:
+            loops = DEFAULT_LOOPS
+        self.mode = mode
+        self.loops_left = loops
+        self.deadline = time.time() + seconds if seconds is not None else None
+        self._profiles = {}
+        self._stacks = Counter()
+        self._rest = {}
+        if mode == "sample":
+            self._stop_sampler.clear()
+            self._sampler = threading.Thread(target=self._sample, name="profiler-sampler", daemon=True)
+            self._sampler.start()
+        elif mode == "rest":
+            self._patch_requests()
+        self.active = True
+        limit = f"{loops} loops" if loops is not None else f"{seconds} seconds"
+        print(f"Profiling started: {mode} for {limit}.")
+
+    def stop(self):
+        """Ends the session and writes its output files."""
+        if not self.active:
+            return None
+        self.active = False
+        if self._sampler is not None:
+            self._stop_sampler.set()
+            self._sampler.join(timeout=1)
+            self._sampler = None
+        if self._original_request is not None:
+            requests.Session.request = self._original_request
+            self._original_request = None
+        run_dir = os.path.join(self.output_dir, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{self.mode}")
+        os.makedirs(run_dir, exist_ok=True)
+        self._write(run_dir)
+        print(f"Profiling finished: {self.mode} output written to {run_dir}.")
+        return run_dir
+
+    def call(self, symbol, fn, *args, **kwargs):
+        """Runs fn for a symbol, profiled when a session is active."""
+        if not self.active:
+            return fn(*args, **kwargs)
+        ident = threading.get_ident()
+        self._symbols[ident] = symbol
+        try:
+            if self.mode != "cprofile":
+                return fn(*args, **kwargs)
+            with self._lock:
+                profile = self._profiles.setdefault(symbol, cProfile.Profile())
+            try:
+                profile.enable()
+            except ValueError:
+                return fn(*args, **kwargs)  # Another profiler is running in this process
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profile.disable()
+        finally:
+            self._symbols.pop(ident, None)
+
+    # Collectors
+
+    def _sample(self):
+        own = threading.get_ident()
+        while not self._stop_sampler.wait(SAMPLE_INTERVAL):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                owner = self._symbols.get(ident) or f"thread-{names.get(ident, ident)}"
+                self._stacks[(owner, collapse(frame))] += 1
+
+    def _patch_requests(self):
+        original = requests.Session.request
+        profiler = self
+
+        def timed_request(session, method, url, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(session, method, url, *args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                key = (profiler._symbols.get(threading.get_ident(), "other"), f"{method.upper()} {urlsplit(url).path}")
+                with profiler._lock:
+                    stats = profiler._rest.setdefault(key, [0, 0.0, 0.0])
+                    stats[0] += 1
+                    stats[1] += elapsed
+                    stats[2] = max(stats[2], elapsed)
+
+        self._original_request = original
+        requests.Session.request = timed_request
+
+    # Output
+
+    def _write(self, run_dir):
+        if self.mode == "cprofile":
+            for symbol, profile in self._profiles.items():
+                profile.dump_stats(os.path.join(run_dir, f"{symbol}.pstats"))
+        elif self.mode == "sample":
+            by_owner = {}
+            for (owner, stack), count in self._stacks.items():
+                by_owner.setdefault(owner, []).append(f"{stack} {count}")
+            for owner, lines in by_owner.items():
+                with open(os.path.join(run_dir, f"{owner}.collapsed"), "w") as file:
+                    file.write("\n".join(lines) + "\n")
+        elif self.mode == "rest":
+            by_symbol = {}
+            for (symbol, endpoint), (calls, total, longest) in sorted(self._rest.items(), key=lambda item: -item[1][1]):
+                # Collapsed-stack weights are integer microseconds
+                by_symbol.setdefault(symbol, []).append(f"{symbol};{endpoint} {int(total * 1_000_000)}")
+                print(f"{symbol} {endpoint}: {calls} calls, {total * 1000:.0f} ms total, "
+                      f"{total / calls * 1000:.1f} ms mean, {longest * 1000:.1f} ms max")
+            for symbol, lines in by_symbol.items():
+                with open(os.path.join(run_dir, f"{symbol}.rest.collapsed"), "w") as file:
+                    file.write("\n".join(lines) + "\n")
+
+
+profiler = Profiler()
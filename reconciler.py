@@ -0,0 +1,174 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from binance_futures import get_all_open_orders, get_all_open_positions, log_and_print
+from logging_config import logger
+from order_journal import next_client_order_id, pending_intents, recover_pending
+from order_management import load_open_orders_from_file, save_open_orders_to_file, clear_orders_file
+from paper_trading import submit_with_context
+
+# Startup actions
+RESUME = "resume"  # Persisted grid matches the exchange, continue as is
+REBUILD = "rebuild"  # Persisted state is stale (unknown or replaced orders), rebuild the state file
+RESET = "reset"  # No grid and no position on the exchange, clear state
+HOLD = "hold"  # Position without grid orders, left open for the operator
+
+GRID_ORDER_TYPES = ("LIMIT",)
+BREAKOUT_ORDER_TYPES = ("TRAILING_STOP_MARKET",)
+# Statuses of recovered orders that belong in the grid state (resting or filled)
+RECOVERED_STATUSES = ("NEW", "PARTIALLY_FILLED", "FILLED")
+
+
+def group_by_symbol(items, symbols):
+    grouped = {symbol: [] for symbol in symbols}
+    for item in items:
+        if item['symbol'] in grouped:
+            grouped[item['symbol']].append(item)
+    return grouped
+
+
+def to_grid_order(order):
+    """Converts an exchange order into the persisted grid order format."""
+    return {
+        'orderId': order['orderId'],
+        'clientOrderId': order.get('clientOrderId'),
+        'price': float(order['price']),
+        'side': order['side'],
+        'quantity': float(order['origQty'])
+    }
+
+
+def classify_symbol(symbol, open_orders, positions, saved, recovered=()):
+    """
+    Decides how a symbol resumes after a restart.
+
+    Args:
+        symbol (str): Trading symbol.
+        open_orders (list): Exchange open orders for the symbol.
+        positions (list): Exchange open positions for the symbol.
+        saved (dict or list): Persisted grid state from the symbol's orders file.
+        recovered (list): Orders placed before the restart but never recorded (from recover_pending).
+
+    Returns:
+        dict: {'action', 'grid_active', 'breakout', 'orders', 'positions', 'reason'}.
+    """
+    grid_orders = [o for o in open_orders if o.get('type') in GRID_ORDER_TYPES]
+    breakout_stops = [o for o in open_orders if o.get('type') in BREAKOUT_ORDER_TYPES]
+    saved_orders = saved.get('orders', []) if isinstance(saved, dict) else []
+    saved_ids = {o['orderId'] for o in saved_orders}
+    # Recovered grid orders are part of the persisted grid; filled ones still need their replacement
+    recovered = [to_grid_order(o) for o in recovered
+                 if o.get('type') in GRID_ORDER_TYPES and o.get('status') in RECOVERED_STATUSES and o['orderId'] not in saved_ids]
+    saved_orders = saved_orders + recovered
+    saved_ids |= {o['orderId'] for o in recovered}
+    exchange_ids = {o['orderId'] for o in grid_orders}
+
+    result = {'grid_active': False, 'breakout': None, 'orders': saved_orders, 'positions': positions}
+
+    if not grid_orders:
+        if positions and breakout_stops:
+            # Position protected by a trailing stop: an active breakout
+            side = 'long' if float(positions[0]['positionAmt']) > 0 else 'short'
+            result.update(action=RESUME, breakout=side, orders=[],
+                          reason=f"breakout {side} position with trailing stop")
+        elif positions:
+            result.update(action=HOLD, orders=[], reason="position without grid orders, left open for the operator")
+        else:
+            result.update(action=RESET, orders=[], reason="no grid orders")
+        return result
+
+    result['grid_active'] = True
+    # Saved orders whose deterministic replacement is already resting were filled and replaced
+    exchange_client_ids = {o.get('clientOrderId') for o in grid_orders}
+    replaced = {o['orderId'] for o in saved_orders
+                if o['orderId'] not in exchange_ids
+                and next_client_order_id(o.get('clientOrderId'), 'SELL' if o['side'] == 'BUY' else 'BUY') in exchange_client_ids}
+    saved_orders = [o for o in saved_orders if o['orderId'] not in replaced]
+    result['orders'] = saved_orders
+
+    unknown = exchange_ids - saved_ids
+    if not unknown and not replaced and not recovered:
+        # Persisted orders missing from the exchange are fills the replacement logic will handle
+        result.update(action=RESUME, reason=f"{len(exchange_ids)} orders match persisted grid")
+        return result
+
+    # Keep persisted orders (filled ones need replacements) and adopt the unknown exchange orders
+    merged = saved_orders + [to_grid_order(o) for o in grid_orders if o['orderId'] in unknown]
+    result.update(action=REBUILD, orders=merged,
+                  reason=f"{len(unknown)} unknown, {len(recovered)} recovered and {len(replaced)} already replaced orders")
+    return result
+
+
+def reconcile_startup(symbols, api_key, api_secret):
+    """
+    Matches the account's open orders and positions against each symbol's persisted grid.
+
+    Open orders and positions for the whole account are fetched concurrently in one
+    request each, so all symbols are classified in a single round trip.
+
+    Args:
+        symbols (iterable): Configured symbols.
+        api_key (str): API key.
+        api_secret (str): API secret.
+
+    Returns:
+        dict: {symbol: classification} (see classify_symbol), or None if the exchange
+              state could not be fetched.
+    """
+    symbols = list(symbols)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        orders_future = submit_with_context(pool, get_all_open_orders, api_key, api_secret)
+        positions_future = submit_with_context(pool, get_all_open_positions, api_key, api_secret)
+        open_orders = orders_future.result()
+        positions = positions_future.result()
+
+    if isinstance(open_orders, dict) or isinstance(positions, dict):
+        log_and_print("Startup reconciliation failed to fetch account state.")
+        return None
+
+    # Resolve journaled intents that were sent but never acknowledged
+    recovered = {}
+    with_pending = [symbol for symbol in symbols if pending_intents(symbol)]
+    if with_pending:
+        with ThreadPoolExecutor(max_workers=len(with_pending)) as pool:
+            futures = {symbol: submit_with_context(pool, recover_pending, symbol, api_key, api_secret) for symbol in with_pending}
+            recovered = {symbol: future.result() for symbol, future in futures.items()}
+
+    orders_by_symbol = group_by_symbol(open_orders, symbols)
+    positions_by_symbol = group_by_symbol(positions, symbols)
+    return {
+        symbol: classify_symbol(symbol, orders_by_symbol[symbol], positions_by_symbol[symbol],
+                                load_open_orders_from_file(symbol), recovered.get(symbol, []))
+        for symbol in symbols
+    }
+
+
+def apply_reconciliation(results, previous_bot_states, api_key, api_secret):
+    """
+    Applies startup classifications: updates bot states, rewrites stale state files
+    and clears the state of symbols without a grid. Positions are never closed here;
+    a position without grid orders is logged for the operator and left as it is.
+
+    Args:
+        results (dict): Output of reconcile_startup.
+        previous_bot_states (dict): Bot state dictionary used by main_loop.
+        api_key (str): API key.
+        api_secret (str): API secret.
+    """
+    active_breakouts = previous_bot_states.setdefault('active_breakouts', {})
+    for symbol, result in results.items():
+        log_and_print(f"{symbol}: startup action {result['action']} ({result['reason']})")
+        previous_bot_states[symbol] = result['grid_active']
+        if result['breakout']:
+            active_breakouts[symbol] = result['breakout']
+        if result['action'] == REBUILD:
+            saved = load_open_orders_from_file(symbol)
+            saved = saved if isinstance(saved, dict) else {}
+            save_open_orders_to_file(symbol, {'orders': result['orders'], 'limit_orders': saved.get('limit_orders', {}),
+                                              'generation': saved.get('generation')})
+        elif result['action'] == RESET:
+            clear_orders_file(symbol)
+        elif result['action'] == HOLD:
+            clear_orders_file(symbol)
+            amounts = ", ".join(str(position['positionAmt']) for position in result['positions'])
+            logger.warning(f"{symbol}: open position ({amounts}) without grid orders at startup. "
+                           f"It is left open; close or protect it manually.")
@@ -0,0 +1,235 @@
+import hashlib
+import hmac
+import random
+import time
+from collections import deque
+from threading import Lock
+from urllib.parse import urlsplit
+
+import requests
+
+from shared_state import acquire_weight
+
+REQUEST_TIMEOUT = 10  # Seconds before a request is abandoned
+MAX_ATTEMPTS = 3
+BACKOFF_BASE = 0.05  # Seconds; attempt n waits up to BACKOFF_BASE * 2**n (full jitter)
+BACKOFF_MAX = 1.0
+BREAKER_THRESHOLD = 5  # Consecutive transient failures that open an endpoint's circuit
+BREAKER_COOLDOWN = (5, 60)  # Initial and maximum seconds an open circuit rejects calls
+TIME_SYNC_INTERVAL = 600  # Seconds between server time offset refreshes
+FAILURE_HISTORY = 50  # Failures kept per symbol
+
+# Error categories
+OK = "ok"
+PERMANENT = "permanent"  # Request was understood and rejected; retrying cannot help
+TRANSIENT = "transient"  # Network errors, 5xx and backend timeouts
+OVERLOADED = "overloaded"  # -1008: the exchange sheds load
+RATE_LIMITED = "rate_limited"  # 429/418, -1003, -1015
+TIMESTAMP = "timestamp"  # -1021: local clock is out of the recvWindow
+
+TRANSIENT_CODES = {-1000, -1001, -1006, -1007}
+RATE_LIMIT_CODES = {-1003, -1015}
+OVERLOADED_CODE = -1008
+TIMESTAMP_CODE = -1021
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised instead of sending a request while the endpoint's circuit is open."""
+
+
+class CircuitBreaker:
+    """Closed -> open after repeated failures -> half-open trial after the cooldown."""
+
+    def __init__(self, name):
+        self.name = name
+        self.failures = 0
+        self.opened_until = 0.0
+        self.cooldown = BREAKER_COOLDOWN[0]
+        self._trial = False
+        self._lock = Lock()
+
+    def allow(self):
+        with self._lock:
+            now = time.monotonic()
+            if now >= self.opened_until:
+                if self.opened_until and not self._trial:
+                    self._trial = True  # Half-open: let one request through
+                    return True
+                return not self.opened_until
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_until = 0.0
+            self.cooldown = BREAKER_COOLDOWN[0]
+            self._trial = False
+
+    def record_failure(self, open_for=None):
+        with self._lock:
+            self.failures += 1
+            if open_for is not None or self.failures >= BREAKER_THRESHOLD or self._trial:
+                duration = open_for if open_for is not None else self.cooldown
+                self.opened_until = time.monotonic() + duration
+                self.cooldown = min(self.cooldown * 2, BREAKER_COOLDOWN[1])
+                self._trial = False
+                print(f"Circuit open for {self.name} ({duration:.0f} s).")
+
+
+_breakers = {}
+_breakers_lock = Lock()
+_failures = {}  # symbol -> deque of failure records
+_time_offset = {'offset': 0, 'synced': 0.0}
+
+
+def breaker_for(name):
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def record_failure(symbol, endpoint, category, code=None, message=None):
+    """Appends a failure to the symbol's history."""
+    history = _failures.setdefault(symbol or "account", deque(maxlen=FAILURE_HISTORY))
+    history.append({'time': time.time(), 'endpoint': endpoint, 'category': category, 'code': code,
+                    'message': message})
+
+
+def recent_failures(symbol, window=300, category=None):
+    """Returns the symbol's failures of the last `window` seconds (optionally one category)."""
+    cutoff = time.time() - window
+    return [f for f in _failures.get(symbol, ()) if f['time'] >= cutoff and (category is None or f['category'] == category)]
+
+
+def sync_time(base_url):
+    """Measures the server clock offset from /fapi/v1/time, compensating for half the round trip."""
+    try:
+        acquire_weight(1)
+        sent = time.time() * 1000
+        response = requests.get(base_url + "/fapi/v1/time", timeout=REQUEST_TIMEOUT)
+        received = time.time() * 1000
+        response.raise_for_status()
+        _time_offset['offset'] = int(response.json()['serverTime'] - (sent + received) / 2)
+        _time_offset['synced'] = time.time()
+    except Exception as e:
+        print(f"Error synchronizing server time: {e}")
+
+
+def server_timestamp(base_url=None):
+    """Returns the current server time in milliseconds from the local clock and the measured offset."""
+    if base_url and time.time() - _time_offset['synced'] > TIME_SYNC_INTERVAL:
+        sync_time(base_url)
+    return int(time.time() * 1000) + _time_offset['offset']
+
+
+def classify_response(response):
+    """
+    Returns (category, code, message) of a response.
+
+    Error bodies are only parsed for non-2xx responses.
+    """
+    if response.status_code < 400:
+        return OK, None, None
+    try:
+        body = response.json()
+        code, message = body.get('code'), body.get('msg')
+    except ValueError:
+        code, message = None, response.text[:200]
+    if response.status_code in (418, 429) or code in RATE_LIMIT_CODES:
+        return RATE_LIMITED, code, message
+    if code == OVERLOADED_CODE:
+        return OVERLOADED, code, message
+    if code == TIMESTAMP_CODE:
+        return TIMESTAMP, code, message
+    if response.status_code >= 500 or code in TRANSIENT_CODES:
+        return TRANSIENT, code, message
+    return PERMANENT, code, message
+
+
+def backoff(attempt):
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def request(method, url, params=None, api_key=None, api_secret=None, symbol=None, weight=1,
+            idempotent=None, body=False):
+    """
+    Sends a Binance request with retries, circuit breaking and server-time signing.
+
+    Transient failures are retried with jittered exponential backoff, but only when
+    repeating the request is safe: reads, cancels and modifications always, new orders
+    only when they carry a client order ID (the exchange rejects the duplicate). Signed
+    requests get a fresh timestamp and signature on every attempt.
+
+    Args:
+        method (str): HTTP method.
+        url (str): Full URL.
+        params (dict, optional): Request parameters (without timestamp/signature).
+        api_key (str, optional): API key (sent as X-MBX-APIKEY).
+        api_secret (str, optional): Signs the request when given.
+        symbol (str, optional): Symbol the failures are recorded for.
+        weight (int): Request weight drawn from the shared rate budget.
+        idempotent (bool, optional): Overrides the retry safety rule above.
+        body (bool): Send the parameters form-encoded in the body instead of the query.
+
+    Returns:
+        requests.Response: The final response (callers keep their own status handling).
+
+    Raises:
+        CircuitOpenError: The endpoint's circuit is open.
+        requests.exceptions.RequestException: The last network error after all attempts.
+    """
+    method = method.upper()
+    endpoint = f"{method} {urlsplit(url).path}"
+    breaker = breaker_for(endpoint)
+    params = dict(params or {})
+    if idempotent is None:
+        idempotent = method != "POST" or 'newClientOrderId' in params
+    base_url = f"{urlsplit(url).scheme}://{urlsplit(url).netloc}"
+    headers = {'X-MBX-APIKEY': api_key} if api_key else None
+
+    for attempt in range(MAX_ATTEMPTS):
+        if not breaker.allow():
+            record_failure(symbol, endpoint, OVERLOADED, message="circuit open")
+            raise CircuitOpenError(f"Circuit open for {endpoint}")
+        payload = dict(params)
+        if api_secret:
+            payload['timestamp'] = server_timestamp(base_url)
+            query_string = '&'.join([f"{key}={value}" for key, value in payload.items()])
+            payload['signature'] = hmac.new(api_secret.encode('utf-8'), query_string.encode('utf-8'),
+                                            hashlib.sha256).hexdigest()
+        acquire_weight(weight)
+        try:
+            response = requests.request(method, url, headers=headers, timeout=REQUEST_TIMEOUT,
+                                        **({'data': payload} if body else {'params': payload}))
+        except requests.exceptions.RequestException as e:
+            # Only a connect timeout is known not to have reached the exchange
+            sent = not isinstance(e, requests.exceptions.ConnectTimeout)
+            record_failure(symbol, endpoint, TRANSIENT, message=str(e))
+            breaker.record_failure()
+            if attempt + 1 == MAX_ATTEMPTS or (sent and not idempotent):
+                raise
+            time.sleep(backoff(attempt))
+            continue
+
+        category, code, message = classify_response(response)
+        if category in (OK, PERMANENT):
+            breaker.record_success()
+            return response
+        record_failure(symbol, endpoint, category, code, message)
+        if category == TIMESTAMP:
+            sync_time(base_url)  # The retry is signed with the corrected clock
+        elif category == RATE_LIMITED:
+            breaker.record_failure(open_for=float(response.headers.get('Retry-After', BREAKER_COOLDOWN[0])))
+            return response
+        elif category == OVERLOADED:
+            breaker.record_failure(open_for=BREAKER_COOLDOWN[0])  # Shed load instead of retrying
+            return response
+        else:
+            breaker.record_failure()
+            if not idempotent:
+                return response  # Execution status unknown: the caller resolves it
+        if attempt + 1 == MAX_ATTEMPTS:
+            return response
+        time.sleep(backoff(attempt))
+    return response
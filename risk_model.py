@@ -0,0 +1,184 @@
+import time
+from threading import Lock
+
+from binance_futures import get_account_info, get_exchange_info
+from paper_trading import active_backend
+
+ACCOUNT_MAX_AGE = 30  # Seconds an account snapshot is trusted for
+FILTERS_MAX_AGE = 3600
+MARGIN_BUFFER = 0.05  # Fraction of the available balance kept free for fees and price moves
+
+# Outcomes of check_order
+PLACE, DEFER, SKIP = "place", "defer", "skip"
+
+
+def symbol_filters(exchange_info):
+    """Returns {symbol: {'min_notional', 'min_qty', 'step_size'}} for every symbol in the exchange info."""
+    symbols = {}
+    for info in exchange_info.get('symbols', []):
+        filters = {f['filterType']: f for f in info.get('filters', [])}
+        symbols[info['symbol']] = {
+            'min_notional': float(filters.get('MIN_NOTIONAL', {}).get('notional', 0)),
+            'min_qty': float(filters.get('LOT_SIZE', {}).get('minQty', 0)),
+            'step_size': float(filters.get('LOT_SIZE', {}).get('stepSize', 0)),
+        }
+    return symbols
+
+
+def required_margin(quantity, prices, leverage):
+    """Initial margin of orders of the given quantity at the given prices."""
+    return sum(quantity * price for price in prices) / leverage
+
+
+class RiskModel:
+    """
+    Local pre-trade checks against a cached account snapshot and the exchange filters.
+
+    Orders that the exchange would reject for insufficient margin (-2019) or a too small
+    notional (-4164) are shrunk, deferred or skipped before they are sent. The available
+    balance is refreshed at most every account_max_age seconds and reduced locally by
+    the margin of every order placed in between. If the account cannot be fetched,
+    orders are allowed and the exchange has the last word.
+    """
+
+    def __init__(self, enabled=True, account_max_age=ACCOUNT_MAX_AGE, margin_buffer=MARGIN_BUFFER):
+        self.enabled = enabled
+        self.account_max_age = account_max_age
+        self.margin_buffer = margin_buffer
+        self._lock = Lock()
+        # Account snapshots by backend (None = the live account), each [fetched_at, available, leverages]
+        self._accounts = {}
+        self._filters = {}
+        self._filters_time = 0
+
+    # Snapshots
+
+    def _account(self, api_key, api_secret):
+        key = active_backend()
+        with self._lock:
+            account = self._accounts.get(key)
+        if account is not None and time.monotonic() - account[0] < self.account_max_age:
+            return account
+        data = get_account_info(api_key, api_secret)
+        if not isinstance(data, dict) or "error" in data:
+            print(f"Risk model: account snapshot unavailable ({data}). Orders are not checked locally.")
+            return None
+        leverages = {position['symbol']: float(position['leverage'])
+                     for position in data.get('positions', []) if position.get('leverage')}
+        account = [time.monotonic(), float(data.get('availableBalance', 0)), leverages]
+        with self._lock:
+            self._accounts[key] = account
+        return account
+
+    def filters(self, symbol):
+        """Returns the symbol's filters, refreshing the exchange info at most once per FILTERS_MAX_AGE."""
+        if time.monotonic() - self._filters_time > FILTERS_MAX_AGE:
+            try:
+                self._filters = symbol_filters(get_exchange_info())
+                self._filters_time = time.monotonic()
+            except Exception as e:
+                print(f"Risk model: exchange filters unavailable: {e}")
+        return self._filters.get(symbol)
+
+    def invalidate(self):
+        """Drops the account snapshot of the current backend (e.g. after a reset)."""
+        with self._lock:
+            self._accounts.pop(active_backend(), None)
+
+    def margin_budget(self, symbol, leverage, api_key, api_secret):
+        """
+        Returns (spendable margin, effective leverage), or (None, leverage) without a snapshot.
+
+        The account's leverage of the symbol takes precedence over the configured one.
+        """
+        account = self._account(api_key, api_secret)
+        if account is None:
+            return None, leverage
+        return account[1] * (1 - self.margin_buffer), account[2].get(symbol, leverage)
+
+    def reserve(self, margin):
+        """Books margin of placed orders against the cached available balance."""
+        with self._lock:
+            account = self._accounts.get(active_backend())
+            if account is not None:
+                account[1] -= margin
+
+    # Checks
+
+    def plan_grid(self, symbol, quantity, sell_prices, buy_prices, leverage, api_key, api_secret):
+        """
+        Decides how many grid levels per side can be placed.
+
+        Levels below the minimum notional are skipped. If the margin of the grid (the
+        larger of the two sides, as the exchange nets opposite open orders) exceeds the
+        budget, the outermost levels of the larger side are dropped first.
+
+        Args:
+            symbol (str): Trading pair symbol.
+            quantity (float): Quantity per order.
+            sell_prices (list): Planned SELL prices, closest first.
+            buy_prices (list): Planned BUY prices, closest first.
+            leverage (int): Configured leverage.
+            api_key (str): API key.
+            api_secret (str): API secret.
+
+        Returns:
+            tuple: (sell_levels, buy_levels). (0, 0) defers the grid to a later loop.
+        """
+        if not self.enabled:
+            return len(sell_prices), len(buy_prices)
+        filters = self.filters(symbol)
+        if filters is not None:
+            if quantity < filters['min_qty']:
+                print(f"Risk model: {symbol} order quantity {quantity} is below the minimum {filters['min_qty']}. Skipping grid.")
+                return 0, 0
+            sell_prices = [price for price in sell_prices if quantity * price >= filters['min_notional']]
+            buy_prices = [price for price in buy_prices if quantity * price >= filters['min_notional']]
+        budget, leverage = self.margin_budget(symbol, leverage, api_key, api_secret)
+        sell_levels, buy_levels = len(sell_prices), len(buy_prices)
+        if budget is None:
+            return sell_levels, buy_levels
+
+        def margin():
+            return max(required_margin(quantity, sell_prices[:sell_levels], leverage),
+                       required_margin(quantity, buy_prices[:buy_levels], leverage))
+
+        while (sell_levels or buy_levels) and margin() > budget:
+            if required_margin(quantity, sell_prices[:sell_levels], leverage) >= required_margin(quantity, buy_prices[:buy_levels], leverage):
+                sell_levels -= 1
+            else:
+                buy_levels -= 1
+        if (sell_levels, buy_levels) != (len(sell_prices), len(buy_prices)):
+            print(f"Risk model: {symbol} grid shrunk to {sell_levels} SELL and {buy_levels} BUY levels "
+                  f"(available margin {budget:.2f}, leverage {leverage}).")
+        if sell_levels or buy_levels:
+            self.reserve(margin())
+        return sell_levels, buy_levels
+
+    def check_order(self, symbol, side, quantity, price, leverage, position_amount, api_key, api_secret):
+        """
+        Checks a single order (a grid replacement) before it is sent.
+
+        An order against the open position only reduces it and needs no margin.
+
+        Returns:
+            str: PLACE, DEFER (not enough margin now, retry in a later loop) or SKIP (below the minimum notional).
+        """
+        if not self.enabled:
+            return PLACE
+        filters = self.filters(symbol)
+        if filters is not None and (quantity * price < filters['min_notional'] or quantity < filters['min_qty']):
+            print(f"Risk model: {symbol} {side} {quantity} at {price} is below the minimum notional {filters['min_notional']}.")
+            return SKIP
+        if (side == 'SELL' and position_amount > 0) or (side == 'BUY' and position_amount < 0):
+            return PLACE
+        budget, leverage = self.margin_budget(symbol, leverage, api_key, api_secret)
+        margin = required_margin(quantity, [price], leverage)
+        if budget is not None and margin > budget:
+            print(f"Risk model: {symbol} {side} at {price} needs {margin:.2f} margin, {budget:.2f} available. Deferring.")
+            return DEFER
+        self.reserve(margin)
+        return PLACE
+
+
+risk_model = RiskModel()
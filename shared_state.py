@@ -0,0 +1,88 @@
+import time
+from multiprocessing import Lock, Value
+
+# Binance Futures REQUEST_WEIGHT limit per minute for the whole account/IP
+DEFAULT_WEIGHT_PER_MINUTE = 2400
+SAFETY_FACTOR = 0.8
+
+# Installed by supervisor workers; None means single-process mode (no shared budget)
+rate_budget = None
+account_snapshot = None
+
+
+class SharedRateBudget:
+    """
+    Token bucket of request weight shared by every worker process.
+
+    The bucket lives in shared memory (multiprocessing.Value), so all workers draw
+    from one account-wide budget regardless of how symbols are sharded.
+    """
+
+    def __init__(self, weight_per_minute=DEFAULT_WEIGHT_PER_MINUTE, burst_seconds=6):
+        rate = weight_per_minute * SAFETY_FACTOR
+        self.refill_per_second = rate / 60.0
+        self.capacity = max(self.refill_per_second * burst_seconds, 1.0)
+        self._lock = Lock()
+        self._tokens = Value('d', self.capacity, lock=False)
+        self._updated = Value('d', time.monotonic(), lock=False)
+
+    def acquire(self, weight=1):
+        """Blocks until `weight` tokens are available, then consumes them."""
+        weight = min(weight, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                elapsed = now - self._updated.value
+                self._tokens.value = min(self.capacity, self._tokens.value + elapsed * self.refill_per_second)
+                self._updated.value = now
+                if self._tokens.value >= weight:
+                    self._tokens.value -= weight
+                    return
+                wait = (weight - self._tokens.value) / self.refill_per_second
+            time.sleep(wait)
+
+
+def install(budget=None, snapshot=None):
+    """Installs the shared rate budget and account snapshot in this process."""
+    global rate_budget, account_snapshot
+    rate_budget = budget
+    account_snapshot = snapshot
+
+
+def acquire_weight(weight=1):
+    """Consumes request weight from the shared budget (no-op in single-process mode)."""
+    if rate_budget is not None:
+        rate_budget.acquire(weight)
+
+
+def klines_weight(limit):
+    """Returns the request weight of a klines call for the given limit."""
+    if limit < 100:
+        return 1
+    if limit < 500:
+        return 2
+    if limit <= 1000:
+        return 5
+    return 10
+
+
+def update_positions_snapshot(positions):
+    """Stores an account-wide positionRisk response in the shared snapshot."""
+    if account_snapshot is not None:
+        account_snapshot['positions'] = positions
+        account_snapshot['positions_updated'] = time.time()
+
+
+def get_positions_snapshot(max_age):
+    """
+    Returns the shared account-wide positions if they are fresher than max_age seconds.
+
+    Returns:
+        list: positionRisk entries for every symbol, or None if missing or stale.
+    """
+    if account_snapshot is None:
+        return None
+    updated = account_snapshot.get('positions_updated')
+    if updated is None or time.time() - updated > max_age:
+        return None
+    return account_snapshot.get('positions')
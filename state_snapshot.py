@@ -0,0 +1,149 @@
+import json
+import os
+import signal
+import threading
+import time
+
+from file_utils import state_path
+
+SNAPSHOT_FILE_TEMPLATE = "{}_bot_state.json"
+SNAPSHOT_VERSION = 1
+
+# Last snapshot written per file, so unchanged symbols are not rewritten every loop
+_written = {}
+_written_lock = threading.Lock()
+
+
+def get_snapshot_file(symbol):
+    """Returns the runtime state snapshot filename for the specific symbol."""
+    return state_path(SNAPSHOT_FILE_TEMPLATE.format(symbol))
+
+
+def symbol_snapshot(symbol, previous_settings, previous_bot_states):
+    """Collects the in-memory runtime state of one symbol."""
+    return {
+        'settings': previous_settings.get(symbol),
+        'bot_active': bool(previous_bot_states.get(symbol, False)),
+        'breakout': previous_bot_states.get('active_breakouts', {}).get(symbol),
+    }
+
+
+def write_snapshot(symbol, snapshot):
+    """
+    Writes a symbol's snapshot atomically if it differs from the last one written.
+
+    Returns:
+        bool: True if the file was written.
+    """
+    filename = get_snapshot_file(symbol)
+    content = json.dumps(snapshot, sort_keys=True, separators=(',', ':'))
+    with _written_lock:
+        if _written.get(filename) == content:
+            return False
+    temporary = filename + ".tmp"
+    with open(temporary, 'w') as file:
+        file.write(json.dumps({'v': SNAPSHOT_VERSION, 'saved_at': time.time(), **snapshot}, separators=(',', ':')))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, filename)
+    with _written_lock:
+        _written[filename] = content
+    return True
+
+
+def save_snapshots(symbols, previous_settings, previous_bot_states):
+    """
+    Snapshots the runtime state (settings, bot state, breakout) of every symbol processed so far.
+
+    Returns:
+        int: Number of files written.
+    """
+    written = 0
+    for symbol in symbols:
+        if symbol not in previous_settings:
+            continue
+        try:
+            written += write_snapshot(symbol, symbol_snapshot(symbol, previous_settings, previous_bot_states))
+        except OSError as e:
+            print(f"Error writing state snapshot of {symbol}: {e}")
+    return written
+
+
+def load_snapshot(symbol):
+    """
+    Loads a symbol's snapshot.
+
+    Returns:
+        dict: {'v', 'saved_at', 'settings', 'bot_active', 'breakout'}, or None if missing,
+              unreadable or written by an unknown version.
+    """
+    filename = get_snapshot_file(symbol)
+    if not os.path.exists(filename):
+        return None
+    try:
+        with open(filename, 'r') as file:
+            snapshot = json.load(file)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Ignoring unreadable state snapshot {filename}: {e}")
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get('v') != SNAPSHOT_VERSION:
+        print(f"Ignoring state snapshot {filename} of version {snapshot.get('v') if isinstance(snapshot, dict) else None}.")
+        return None
+    with _written_lock:
+        _written[filename] = json.dumps({key: snapshot.get(key) for key in ('settings', 'bot_active', 'breakout')},
+                                        sort_keys=True, separators=(',', ':'))
+    return snapshot
+
+
+def discard_snapshot(symbol):
+    """Removes the snapshot of a symbol that is no longer traded."""
+    filename = get_snapshot_file(symbol)
+    with _written_lock:
+        _written.pop(filename, None)
+    if os.path.exists(filename):
+        os.remove(filename)
+
+
+def restore_snapshots(symbols, results, previous_settings, previous_bot_states):
+    """
+    Restores runtime state after the startup reconciliation.
+
+    The exchange stays authoritative for grids and breakouts. The snapshot supplies the
+    settings the running grids were built with, so configuration changes made while the
+    bot was down are detected by the first loop, and the bot state of symbols that were
+    active but had no orders yet (e.g. waiting for the price to reach the SMA), so the
+    start hysteresis continues where it was.
+
+    Args:
+        symbols (iterable): Configured symbols.
+        results (dict): Output of reconciler.reconcile_startup, or None if it failed.
+        previous_settings (dict): Settings dictionary used by main_loop.
+        previous_bot_states (dict): Bot state dictionary used by main_loop.
+
+    Returns:
+        int: Number of symbols restored from a snapshot.
+    """
+    restored = 0
+    for symbol in symbols:
+        snapshot = load_snapshot(symbol)
+        if snapshot is None:
+            continue
+        restored += 1
+        if snapshot.get('settings') is not None:
+            previous_settings[symbol] = snapshot['settings']
+        result = (results or {}).get(symbol)
+        if result is not None and snapshot.get('bot_active') and not result['grid_active'] and not result['positions']:
+            previous_bot_states[symbol] = True
+        age = time.time() - snapshot.get('saved_at', 0)
+        print(f"{symbol}: restored state snapshot from {age:.0f} s ago (bot active: {previous_bot_states.get(symbol, False)}).")
+    return restored
+
+
+def install_shutdown_handler():
+    """Turns SIGTERM into a normal exit, so the final snapshot is written (main thread only)."""
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, _on_sigterm)
+
+
+def _on_sigterm(signum, frame):
+    raise SystemExit(0)
@@ -0,0 +1,328 @@
+import numpy as np
+
+MAKER_FEE = 0.0002
+TAKER_FEE = 0.0005
+MAINTENANCE_MARGIN_RATE = 0.005
+
+
+def rolling_bollinger(close, period):
+    """
+    Calculates Bollinger Bands for every row of a 2-D close array in one pass.
+
+    Matches the pandas rolling mean/std (ddof=1) used by get_bollinger_bands.
+
+    Args:
+        close (np.ndarray): Close prices, shape (rows, candles).
+        period (int): Rolling window length.
+
+    Returns:
+        dict: 'sma', 'upper_band', 'lower_band' and 'bbw' arrays shaped like close.
+              The first period - 1 columns are NaN.
+    """
+    close = np.atleast_2d(np.asarray(close, dtype=np.float64))
+    rows, n = close.shape
+    sma = np.full((rows, n), np.nan)
+    sd = np.full((rows, n), np.nan)
+    if n >= period:
+        # Shift each row by its first value so the running sums stay well conditioned
+        shifted = close - close[:, :1]
+        csum = np.concatenate([np.zeros((rows, 1)), np.cumsum(shifted, axis=1)], axis=1)
+        csq = np.concatenate([np.zeros((rows, 1)), np.cumsum(shifted * shifted, axis=1)], axis=1)
+        window_sum = csum[:, period:] - csum[:, :-period]
+        window_sq = csq[:, period:] - csq[:, :-period]
+        mean = window_sum / period
+        var = (window_sq - window_sum * mean) / (period - 1)
+        sma[:, period - 1:] = mean + close[:, :1]
+        sd[:, period - 1:] = np.sqrt(np.clip(var, 0.0, None))
+    upper = sma + 2 * sd
+    lower = sma - 2 * sd
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bbw = np.where(sma > 0, (upper - lower) / sma, np.nan)
+    return {"sma": sma, "upper_band": upper, "lower_band": lower, "bbw": bbw}
+
+
+def apply_trigger_hysteresis(bbw, bbw_threshold, bot_active):
+    """
+    Applies the calculate_bot_trigger start/stop rule to one BBW value per row.
+
+    The bot starts when BBW < bbw_threshold / 2 and stops when BBW > bbw_threshold.
+    A NaN BBW never starts or keeps the bot.
+
+    Args:
+        bbw (np.ndarray): Current BBW per row.
+        bbw_threshold (np.ndarray or float): Stop threshold per row.
+        bot_active (np.ndarray): Current bot state per row.
+
+    Returns:
+        np.ndarray: New bot state per row (bool).
+    """
+    bbw = np.asarray(bbw, dtype=np.float64)
+    valid = ~np.isnan(bbw)
+    filled = np.where(valid, bbw, np.inf)
+    start = filled < np.asarray(bbw_threshold) / 2
+    keep = filled <= np.asarray(bbw_threshold)
+    return valid & np.where(bot_active, keep, start)
+
+
+def evaluate_triggers(close, high, low, bbw_threshold, bot_active, bb_period=15, min_candles=5, bb_tolerance=0.001):
+    """
+    Evaluates the calculate_bot_trigger inputs for many symbols in one vectorized pass.
+
+    Args:
+        close, high, low (np.ndarray): Candle prices, shape (symbols, candles).
+        bbw_threshold (np.ndarray or float): Stop threshold per symbol.
+        bot_active (np.ndarray): Current bot state per symbol.
+        bb_period (int): Bollinger Bands period.
+        min_candles (int): Candles before the latest one averaged for the size deviation.
+        bb_tolerance (float): Relative distance outside a band that counts as outside.
+
+    Returns:
+        dict: Per-symbol arrays 'sma', 'upper_band', 'lower_band', 'bbw', 'close',
+              'candle_outside_bb', 'candle_size_deviation' (NaN when undefined) and 'start_bot'.
+    """
+    close = np.atleast_2d(np.asarray(close, dtype=np.float64))
+    high = np.atleast_2d(np.asarray(high, dtype=np.float64))
+    low = np.atleast_2d(np.asarray(low, dtype=np.float64))
+    bands = rolling_bollinger(close, bb_period)
+    latest = {key: values[:, -1] for key, values in bands.items()}
+    latest_close = close[:, -1]
+    outside = ((latest_close > latest['upper_band'] * (1 + bb_tolerance)) |
+               (latest_close < latest['lower_band'] * (1 - bb_tolerance)))
+    size = high - low
+    average = size[:, -min_candles - 1:-1].mean(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        deviation = np.where(average > 0, size[:, -1] / average, np.nan)
+    return {
+        **latest,
+        "close": latest_close,
+        "candle_outside_bb": outside,
+        "candle_size_deviation": deviation,
+        "start_bot": apply_trigger_hysteresis(latest['bbw'], bbw_threshold, np.asarray(bot_active, dtype=bool)),
+    }
+
+
+def grid_level_offsets(grid_levels, grid_progression, progressive, max_levels):
+    """
+    Calculates cumulative price offsets (in units of base spacing) for each grid level.
+
+    Args:
+        grid_levels (np.ndarray): Grid levels per row.
+        grid_progression (np.ndarray): Progression multiplier per row.
+        progressive (np.ndarray): Whether the progressive grid is used per row.
+        max_levels (int): Number of level slots per side.
+
+    Returns:
+        tuple: (offsets, enabled) arrays of shape (rows, max_levels).
+    """
+    level = np.arange(1, max_levels + 1)
+    steps = np.where(progressive[:, None], grid_progression[:, None] ** (level[None, :] - 1), 1.0)
+    offsets = np.cumsum(steps, axis=1)
+    enabled = level[None, :] <= grid_levels[:, None]
+    return offsets, enabled
+
+
+def simulate_strategy(close, high, low, bbw_threshold, grid_levels, order_quantity=1.0,
+                      grid_progression=1.0, progressive=False, trailing_stop_rate=0.5,
+                      leverage=10, capital=1000.0, breakout=True, trigger_period=15,
+                      grid_period=20, band_tolerance=0.01):
+    """
+    Replays the grid and breakout logic over candle arrays, vectorized across rows.
+
+    Each row is an independent run: a different symbol, window, price path or
+    parameter set. Parameters may be scalars or arrays with one value per row.
+
+    The replay follows the live bot: calculate_bot_trigger hysteresis on the
+    trigger_period BBW, a grid built around the price once it is within one base
+    spacing of the SMA, base spacing = band width / (2 * grid_levels), filled
+    orders replaced one spacing away on the opposite side, a reset when an order
+    drifts outside the bands while flat, and a market close when the bot stops.
+    While the bot is stopped, a close outside the trigger bands opens a breakout
+    position protected by a trailing stop of trailing_stop_rate percent.
+
+    Args:
+        close, high, low (np.ndarray): Candle prices, shape (rows, candles) or (candles,).
+        bbw_threshold: BBW stop threshold.
+        grid_levels: Number of buy and sell levels.
+        order_quantity: Quantity per order.
+        grid_progression: Progressive spacing multiplier.
+        progressive: Whether spacing grows towards the edges.
+        trailing_stop_rate: Breakout trailing stop callback rate in percent.
+        leverage: Leverage used for margin estimates.
+        capital: Starting account equity per row.
+        breakout (bool): Whether breakout entries are simulated.
+        trigger_period (int): Bollinger period used by the trigger.
+        grid_period (int): Bollinger period used for grid bands.
+        band_tolerance (float): Tolerance used by the band check.
+
+    Returns:
+        dict: Per-row arrays 'pnl', 'fees', 'fills', 'max_drawdown', 'max_inventory',
+              'max_margin_usage', 'liquidated', 'active_fraction', 'breakouts'.
+    """
+    close = np.atleast_2d(np.asarray(close, dtype=np.float64))
+    high = np.atleast_2d(np.asarray(high, dtype=np.float64))
+    low = np.atleast_2d(np.asarray(low, dtype=np.float64))
+    rows, n = close.shape
+
+    def per_row(value, dtype=np.float64):
+        return np.broadcast_to(np.asarray(value, dtype=dtype), (rows,)).copy()
+
+    bbw_threshold = per_row(bbw_threshold)
+    grid_levels = per_row(grid_levels, np.int64)
+    order_quantity = per_row(order_quantity)
+    grid_progression = per_row(grid_progression)
+    progressive = per_row(progressive, bool)
+    trailing = per_row(trailing_stop_rate) / 100
+    leverage = per_row(leverage)
+    capital = per_row(capital)
+
+    trigger_bb = rolling_bollinger(close, trigger_period)
+    grid_bb = rolling_bollinger(close, grid_period)
+
+    max_levels = int(grid_levels.max()) if rows else 0
+    offsets, enabled = grid_level_offsets(grid_levels, grid_progression, progressive, max_levels)
+    slots = 2 * max_levels
+    slot_enabled = np.concatenate([enabled, enabled], axis=1)
+
+    # Slot state: price, side (+1 buy, -1 sell), resting flag
+    slot_price = np.zeros((rows, slots))
+    slot_side = np.concatenate([np.ones((rows, max_levels)), -np.ones((rows, max_levels))], axis=1)
+    slot_live = np.zeros((rows, slots), dtype=bool)
+
+    active = np.zeros(rows, dtype=bool)
+    grid_on = np.zeros(rows, dtype=bool)
+    spacing = np.zeros(rows)
+    inventory = np.zeros(rows)
+    cash = np.zeros(rows)
+    fees = np.zeros(rows)
+    fills = np.zeros(rows, dtype=np.int64)
+    breakout_side = np.zeros(rows)
+    breakout_peak = np.zeros(rows)
+    breakouts = np.zeros(rows, dtype=np.int64)
+    peak_equity = capital.copy()
+    max_drawdown = np.zeros(rows)
+    max_inventory = np.zeros(rows)
+    max_margin = np.zeros(rows)
+    liquidated = np.zeros(rows, dtype=bool)
+    active_candles = np.zeros(rows, dtype=np.int64)
+
+    def market_close(mask, price):
+        # Flatten inventory at market with taker fee
+        qty = np.where(mask, inventory, 0.0)
+        cash[:] += qty * price
+        fees[:] += np.abs(qty) * price * TAKER_FEE
+        cash[:] -= np.abs(qty) * price * TAKER_FEE
+        inventory[:] -= qty
+
+    for t in range(n):
+        c, h, lo = close[:, t], high[:, t], low[:, t]
+        alive = ~liquidated
+
+        previous = active
+        active = apply_trigger_hysteresis(trigger_bb["bbw"][:, t], bbw_threshold, previous) & alive
+        active_candles += active
+
+        # Bot stopped: close the grid position and cancel the grid
+        stopped = previous & ~active & grid_on
+        market_close(stopped, c)
+        grid_on &= ~stopped
+        slot_live &= ~stopped[:, None]
+
+        # Breakout trailing stop
+        if breakout:
+            in_long = breakout_side > 0
+            in_short = breakout_side < 0
+            hit_long = in_long & (lo <= breakout_peak * (1 - trailing))
+            hit_short = in_short & (h >= breakout_peak * (1 + trailing))
+            exit_price = np.where(hit_long, breakout_peak * (1 - trailing), breakout_peak * (1 + trailing))
+            market_close(hit_long | hit_short, exit_price)
+            breakout_side[hit_long | hit_short] = 0
+            breakout_peak = np.where(breakout_side > 0, np.maximum(breakout_peak, h),
+                                     np.where(breakout_side < 0, np.minimum(breakout_peak, lo), breakout_peak))
+
+            # New breakout entries while the grid is stopped
+            upper, lower = trigger_bb["upper_band"][:, t], trigger_bb["lower_band"][:, t]
+            idle = ~active & (breakout_side == 0) & alive & ~np.isnan(upper)
+            go_long = idle & (c > upper * 1.001)
+            go_short = idle & (c < lower * 0.999)
+            entry = go_long | go_short
+            direction = np.where(go_long, 1.0, -1.0)
+            qty = np.where(entry, direction * order_quantity, 0.0)
+            inventory[:] += qty
+            cash[:] -= qty * c
+            fees[:] += np.abs(qty) * c * TAKER_FEE
+            cash[:] -= np.abs(qty) * c * TAKER_FEE
+            breakout_side[entry] = direction[entry]
+            breakout_peak[entry] = c[entry]
+            breakouts += entry
+
+        # Grid fills and replacements
+        if slots:
+            buy_hit = slot_live & (slot_side > 0) & (slot_price >= lo[:, None])
+            sell_hit = slot_live & (slot_side < 0) & (slot_price <= h[:, None])
+            hit = buy_hit | sell_hit
+            traded = np.where(hit, slot_side * order_quantity[:, None], 0.0)
+            notional = np.abs(traded) * slot_price
+            inventory[:] += traded.sum(axis=1)
+            cash[:] -= (traded * slot_price).sum(axis=1)
+            fees[:] += notional.sum(axis=1) * MAKER_FEE
+            cash[:] -= notional.sum(axis=1) * MAKER_FEE
+            fills += hit.sum(axis=1)
+            # Counter order one spacing away on the opposite side
+            slot_price = np.where(hit, slot_price + slot_side * spacing[:, None], slot_price)
+            slot_side = np.where(hit, -slot_side, slot_side)
+
+        # Band check: reset a flat grid whose orders drifted outside the bands
+        g_upper, g_lower = grid_bb["upper_band"][:, t], grid_bb["lower_band"][:, t]
+        width = g_upper - g_lower
+        flat = np.abs(inventory) < 1e-12
+        outside = slot_live & ((slot_price < (g_lower - width * band_tolerance)[:, None]) |
+                               (slot_price > (g_upper + width * band_tolerance)[:, None]))
+        drift = grid_on & flat & outside.any(axis=1) & ~np.isnan(width)
+        grid_on &= ~drift
+        slot_live &= ~drift[:, None]
+
+        # Grid build when active, flat and the price is close to the SMA
+        sma = grid_bb["sma"][:, t]
+        candidate = np.where(np.isnan(width), 0.0, width / (2 * np.maximum(grid_levels, 1)))
+        build = (active & ~grid_on & (breakout_side == 0) & (candidate > 0)
+                 & (np.abs(c - np.nan_to_num(sma)) <= candidate))
+        if build.any() and slots:
+            spacing = np.where(build, candidate, spacing)
+            step = offsets * spacing[:, None]
+            new_prices = np.concatenate([c[:, None] - step, c[:, None] + step], axis=1)
+            slot_price = np.where(build[:, None], new_prices, slot_price)
+            slot_side = np.where(build[:, None], np.concatenate(
+                [np.ones((rows, max_levels)), -np.ones((rows, max_levels))], axis=1), slot_side)
+            slot_live = np.where(build[:, None], slot_enabled, slot_live)
+            grid_on |= build
+
+        # Account metrics
+        equity = capital + cash + inventory * c
+        peak_equity = np.maximum(peak_equity, equity)
+        max_drawdown = np.maximum(max_drawdown, peak_equity - equity)
+        max_inventory = np.maximum(max_inventory, np.abs(inventory))
+        resting = (np.where(slot_live, slot_price, 0.0) * order_quantity[:, None]).sum(axis=1) if slots else 0.0
+        margin = (np.abs(inventory) * c + resting) / leverage
+        max_margin = np.maximum(max_margin, margin / capital)
+        liquidated |= alive & (equity <= np.abs(inventory) * c * MAINTENANCE_MARGIN_RATE) & (np.abs(inventory) > 0)
+        newly = liquidated & alive
+        if newly.any():
+            cash[newly] = -capital[newly]
+            inventory[newly] = 0.0
+            grid_on &= ~newly
+            slot_live &= ~newly[:, None]
+            breakout_side[newly] = 0
+
+    # Mark open inventory to the last close
+    final_equity = capital + cash + inventory * close[:, -1] if n else capital
+    return {
+        "pnl": final_equity - capital,
+        "fees": fees,
+        "fills": fills,
+        "max_drawdown": max_drawdown,
+        "max_inventory": max_inventory,
+        "max_margin_usage": max_margin,
+        "liquidated": liquidated,
+        "active_fraction": active_candles / max(n, 1),
+        "breakouts": breakouts,
+    }
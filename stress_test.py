@@ -0,0 +1,256 @@
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+from multiprocessing import Pool
+
+import numpy as np
+
+from file_utils import load_json
+from strategy_sim import simulate_strategy
+
+MODELS = ("gbm", "jump", "regime")
+SUBSTEPS = 8  # Price steps per candle; their extremes become the candle's high and low
+CHUNK_PATHS = 500  # Paths simulated together in one task
+PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+METRICS = ("pnl", "max_drawdown", "max_inventory", "max_margin_usage", "fees", "fills", "breakouts", "active_fraction")
+# Model parameters used when no history is available, per candle
+DEFAULT_MODEL = {
+    "sigma": 0.015,
+    "drift": 0.0,
+    "jump_intensity": 0.02,  # Expected jumps per candle
+    "jump_mean": 0.0,
+    "jump_std": 0.05,
+    "regime_sigmas": [0.008, 0.03],  # Calm and volatile volatility
+    "regime_switch": [0.02, 0.08],  # Probability per candle of leaving the calm / volatile regime
+}
+JUMP_THRESHOLD = 4.0  # Returns beyond this many robust standard deviations count as jumps
+
+
+def calibrate(close):
+    """
+    Estimates model parameters from historical closes (per candle).
+
+    Volatility uses the median absolute deviation of the log returns, so jumps do not
+    inflate it; returns beyond JUMP_THRESHOLD robust deviations are treated as jumps.
+    Regime volatilities are the 25th and 90th percentiles of the rolling 20-candle volatility.
+
+    Returns:
+        dict: Parameters in the DEFAULT_MODEL format.
+    """
+    returns = np.diff(np.log(close))
+    returns = returns[np.isfinite(returns)]
+    if len(returns) < 50:
+        return dict(DEFAULT_MODEL)
+    sigma = float(1.4826 * np.median(np.abs(returns - np.median(returns))))
+    jumps = returns[np.abs(returns) > JUMP_THRESHOLD * sigma]
+    window = np.lib.stride_tricks.sliding_window_view(returns, 20)
+    rolling = window.std(axis=1)
+    return {
+        "sigma": sigma,
+        "drift": 0.0,
+        "jump_intensity": len(jumps) / len(returns),
+        "jump_mean": float(jumps.mean()) if len(jumps) else 0.0,
+        "jump_std": float(jumps.std()) if len(jumps) > 1 else JUMP_THRESHOLD * sigma,
+        "regime_sigmas": [float(np.percentile(rolling, 25)), float(np.percentile(rolling, 90))],
+        "regime_switch": list(DEFAULT_MODEL["regime_switch"]),
+    }
+
+
+def generate_paths(model, paths, candles, start_price, params, rng, substeps=SUBSTEPS):
+    """
+    Generates price paths as candle arrays, all paths at once.
+
+    Models:
+        gbm: geometric Brownian motion with the per-candle volatility sigma.
+        jump: GBM plus compound Poisson jumps (normal log jump sizes), drift-compensated.
+        regime: GBM whose volatility follows a two-state Markov chain (calm/volatile) per candle.
+
+    Args:
+        model (str): One of MODELS.
+        paths (int): Number of paths.
+        candles (int): Candles per path.
+        start_price (float): Price at the start of every path.
+        params (dict): Model parameters (see DEFAULT_MODEL), per candle.
+        rng (np.random.Generator): Random generator.
+        substeps (int): Price steps per candle.
+
+    Returns:
+        tuple: (close, high, low) arrays of shape (paths, candles).
+    """
+    dt = 1.0 / substeps
+    if model == "regime":
+        calm, volatile = params["regime_sigmas"]
+        leave_calm, leave_volatile = params["regime_switch"]
+        state = rng.random(paths) < leave_calm / (leave_calm + leave_volatile)  # Stationary start, True = volatile
+        sigma = np.empty((paths, candles))
+        draws = rng.random((paths, candles))
+        for t in range(candles):
+            state = np.where(state, draws[:, t] >= leave_volatile, draws[:, t] < leave_calm)
+            sigma[:, t] = np.where(state, volatile, calm)
+        sigma = np.repeat(sigma, substeps, axis=1)
+    else:
+        sigma = params["sigma"]
+    drift = params["drift"]
+    if model == "jump":
+        # Keeps the expected price unchanged by the jumps
+        drift -= params["jump_intensity"] * (np.exp(params["jump_mean"] + params["jump_std"] ** 2 / 2) - 1)
+
+    steps = paths, candles * substeps
+    log_returns = (drift - 0.5 * sigma ** 2) * dt + sigma * np.sqrt(dt) * rng.standard_normal(steps)
+    if model == "jump":
+        count = rng.poisson(params["jump_intensity"] * dt, steps)
+        jumping = count > 0
+        log_returns[jumping] += (count[jumping] * params["jump_mean"]
+                                 + np.sqrt(count[jumping]) * params["jump_std"] * rng.standard_normal(jumping.sum()))
+
+    prices = start_price * np.exp(np.cumsum(log_returns, axis=1)).reshape(paths, candles, substeps)
+    close = prices[:, :, -1]
+    opens = np.concatenate([np.full((paths, 1), start_price), close[:, :-1]], axis=1)
+    high = np.maximum(prices.max(axis=2), opens)
+    low = np.minimum(prices.min(axis=2), opens)
+    return close, high, low
+
+
+def simulation_settings(settings, capital):
+    """Maps a crypto_settings entry to simulate_strategy keyword arguments."""
+    return {
+        "bbw_threshold": float(settings.get("bbw_threshold", 0.07)),
+        "grid_levels": int(settings.get("grid_levels", 5)),
+        "order_quantity": float(settings.get("order_quantity", 1.0)),
+        "grid_progression": float(settings.get("grid_progression", 1.0) or 1.0),
+        "progressive": str(settings.get("progressive_grid", "False")).lower() == "true",
+        "trailing_stop_rate": float(settings.get("trailing_stop_rate", 0.5)),
+        "leverage": float(settings.get("leverage", 10)),
+        "capital": capital,
+    }
+
+
+def run_chunk(task):
+    """
+    Worker task: generates one chunk of paths and replays the strategy over all of them.
+
+    Args:
+        task (tuple): (model, paths, candles, start price, model params, simulation kwargs, seed sequence).
+
+    Returns:
+        dict: Per-path metric arrays of simulate_strategy.
+    """
+    model, paths, candles, start_price, params, kwargs, seed = task
+    rng = np.random.default_rng(seed)
+    close, high, low = generate_paths(model, paths, candles, start_price, params, rng)
+    return simulate_strategy(close, high, low, **kwargs)
+
+
+def distribution(values):
+    values = np.asarray(values, dtype=np.float64)
+    summary = {f"p{p}": float(v) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+    summary.update(mean=float(values.mean()), std=float(values.std()), min=float(values.min()), max=float(values.max()))
+    return summary
+
+
+def run_stress_test(symbol, settings, start_price, models=MODELS, paths=5000, candles=500, params=None,
+                    workers=None, capital=1000.0, seed=None, chunk_paths=CHUNK_PATHS):
+    """
+    Runs Monte Carlo stress tests of one crypto_settings entry on synthetic price paths.
+
+    Paths are generated inside the worker processes in chunks, so only the per-path
+    metrics are sent back. Every chunk replays the same grid and breakout logic as the
+    optimizer (simulate_strategy).
+
+    Args:
+        symbol (str): Trading pair (for the report).
+        settings (dict): crypto_settings entry of the symbol.
+        start_price (float): Price at the start of every path (order_quantity is in its units).
+        models (iterable): Path models to run (see MODELS).
+        paths (int): Paths per model.
+        candles (int): Candles per path, at the entry's klines_interval.
+        params (dict, optional): Model parameters (default DEFAULT_MODEL).
+        workers (int, optional): Process count. Defaults to every core.
+        capital (float): Simulated starting equity per path.
+        seed (int, optional): Seed of the whole run.
+        chunk_paths (int): Paths simulated together in one task.
+
+    Returns:
+        dict: {model: {'pnl': distribution, ..., 'liquidation_probability', 'paths'}} plus run details.
+    """
+    params = {**DEFAULT_MODEL, **(params or {})}
+    kwargs = simulation_settings(settings, capital)
+    workers = workers or os.cpu_count()
+    chunks = [min(chunk_paths, paths - i) for i in range(0, paths, chunk_paths)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks) * len(models))
+    tasks = [(model, size, candles, start_price, params, kwargs, seeds[m * len(chunks) + c])
+             for m, model in enumerate(models) for c, size in enumerate(chunks)]
+
+    print(f"Simulating {paths} paths x {candles} candles for {len(models)} models in {len(tasks)} tasks on {workers} processes...")
+    started = time.time()
+    with Pool(processes=workers) as pool:
+        results = pool.map(run_chunk, tasks)
+    elapsed = time.time() - started
+    print(f"Simulation finished in {elapsed:.1f}s.")
+
+    report = {"symbol": symbol, "settings": settings, "params": params, "start_price": start_price,
+              "paths": paths, "candles": candles, "capital": capital, "elapsed": elapsed, "models": {}}
+    for m, model in enumerate(models):
+        chunk_results = results[m * len(chunks):(m + 1) * len(chunks)]
+        merged = {key: np.concatenate([r[key] for r in chunk_results]) for key in chunk_results[0]}
+        summary = {metric: distribution(merged[metric]) for metric in METRICS}
+        summary["liquidation_probability"] = float(merged["liquidated"].mean())
+        summary["loss_probability"] = float((merged["pnl"] < 0).mean())
+        report["models"][model] = summary
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Monte Carlo stress test of a crypto_settings entry on synthetic paths.")
+    parser.add_argument("symbol", help="Configured trading pair, e.g. SXPUSDT")
+    parser.add_argument("--model", choices=MODELS + ("all",), default="all")
+    parser.add_argument("--paths", type=int, default=5000, help="Paths per model")
+    parser.add_argument("--candles", type=int, default=500, help="Candles per path at the entry's klines_interval")
+    parser.add_argument("--calibrate-days", type=int, default=90, help="Days of history to calibrate on (0 = defaults)")
+    parser.add_argument("--params", help="JSON file overriding model parameters")
+    parser.add_argument("--start-price", type=float, help="Starting price (default: the last calibration close)")
+    parser.add_argument("--workers", type=int, default=None, help="Process count (default: all cores)")
+    parser.add_argument("--capital", type=float, default=1000.0)
+    parser.add_argument("--config", default="config.json")
+    parser.add_argument("--output", default="stress_results")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    settings = load_json(args.config).get("crypto_settings", {}).get(args.symbol)
+    if settings is None:
+        parser.error(f"{args.symbol} is not in the crypto_settings of {args.config}.")
+
+    params, start_price = dict(DEFAULT_MODEL), None
+    if args.calibrate_days:
+        from optimizer import fetch_history
+        history = fetch_history(args.symbol, settings.get("klines_interval", "4h"), args.calibrate_days)
+        if history.size:
+            params, start_price = calibrate(history[3]), float(history[3, -1])
+    if args.params:
+        params.update(load_json(args.params))
+    start_price = args.start_price or start_price
+    if start_price is None:
+        parser.error("--start-price is required without calibration history.")
+
+    models = MODELS if args.model == "all" else (args.model,)
+    report = run_stress_test(args.symbol, settings, start_price, models, args.paths, args.candles, params,
+                             args.workers, args.capital, args.seed)
+    report["generated"] = datetime.now().astimezone().strftime("%Y-%m-%d %H:%M:%S")
+
+    for model, summary in report["models"].items():
+        pnl, margin = summary["pnl"], summary["max_margin_usage"]
+        print(f"{model}: PnL p5 {pnl['p5']:.2f} / p50 {pnl['p50']:.2f} / p95 {pnl['p95']:.2f}, "
+              f"max inventory p95 {summary['max_inventory']['p95']:.4g}, margin usage p95 {margin['p95'] * 100:.1f}%, "
+              f"liquidation {summary['liquidation_probability'] * 100:.2f}%, loss {summary['loss_probability'] * 100:.1f}%")
+
+    os.makedirs(args.output, exist_ok=True)
+    results_file = os.path.join(args.output, f"{args.symbol}_stress.json")
+    with open(results_file, "w") as file:
+        json.dump(report, file, indent=4)
+    print(f"Saved the stress report to {results_file}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import argparse
+import os
+import time
+from multiprocessing import Event, Manager, Process
+
+from file_utils import load_json, get_credentials
+from logging_config import logger
+import shared_state
+
+CONFIG_POLL_INTERVAL = 10  # Seconds between config.json checks
+SNAPSHOT_INTERVAL = 2  # Seconds between account snapshot refreshes
+RESTART_BACKOFF = (5, 60)  # Initial and maximum delay before restarting a crashed worker
+STOP_TIMEOUT = 60  # Seconds to wait for a worker to finish its loop
+
+
+def log_and_print(message):
+    print(message)
+    logger.info(message)
+
+
+def worker_main(worker_id, symbols, budget, snapshot, stop_event):
+    """
+    Worker process entry point: runs the regular main_loop for a shard of symbols.
+
+    Args:
+        worker_id (int): Worker slot number.
+        symbols (set): Symbols handled by this worker.
+        budget (SharedRateBudget): Account-wide rate budget.
+        snapshot (DictProxy): Shared account snapshot.
+        stop_event (multiprocessing.Event): Set by the supervisor to stop the worker.
+    """
+    shared_state.install(budget, snapshot)
+    from main import main_loop  # Imported after install so every request draws from the shared budget
+    log_and_print(f"Worker {worker_id} (pid {os.getpid()}) started for {sorted(symbols)}")
+    main_loop(symbols=symbols, stop_event=stop_event)
+    log_and_print(f"Worker {worker_id} stopped.")
+
+
+def assign_symbols(symbols, assignment, worker_count):
+    """
+    Rebalances symbols across workers while moving as few symbols as possible.
+
+    Symbols that are still configured stay with their worker, removed symbols are
+    dropped and new symbols go to the least loaded worker. Workers that hold more
+    than their fair share give up their surplus.
+
+    Args:
+        symbols (iterable): Currently configured symbols.
+        assignment (list): Previous list of symbol sets, one per worker.
+        worker_count (int): Number of worker slots.
+
+    Returns:
+        list: New list of symbol sets, one per worker.
+    """
+    symbols = set(symbols)
+    shards = [set(shard) & symbols for shard in assignment[:worker_count]]
+    shards += [set() for _ in range(worker_count - len(shards))]
+    fair_share = -(-len(symbols) // worker_count) if worker_count else 0
+
+    spare = symbols - set().union(*shards)
+    for shard in shards:
+        while len(shard) > fair_share:
+            spare.add(shard.pop())
+    for symbol in sorted(spare):
+        min(shards, key=len).add(symbol)
+    return shards
+
+
+class Supervisor:
+    """Starts, watches and rebalances the worker processes."""
+
+    def __init__(self, worker_count=None, weight_per_minute=None):
+        config = load_json("config.json")
+        symbol_count = len(config.get("crypto_settings", {}))
+        self.worker_count = worker_count or max(1, min(os.cpu_count() or 1, symbol_count))
+        weight_per_minute = weight_per_minute or config.get("rate_limit_weight_per_minute",
+                                                            shared_state.DEFAULT_WEIGHT_PER_MINUTE)
+        self.budget = shared_state.SharedRateBudget(weight_per_minute)
+        self.manager = Manager()
+        self.snapshot = self.manager.dict()
+        self.assignment = [set() for _ in range(self.worker_count)]
+        self.workers = [None] * self.worker_count
+        self.stop_events = [None] * self.worker_count
+        self.restart_delay = [RESTART_BACKOFF[0]] * self.worker_count
+        self.restart_at = [0.0] * self.worker_count
+
+        self.api_key, self.api_secret = get_credentials()
+        shared_state.install(self.budget, self.snapshot)
+
+    def start_worker(self, index):
+        symbols = self.assignment[index]
+        if not symbols:
+            self.workers[index] = None
+            return
+        stop_event = Event()
+        process = Process(
+            target=worker_main,
+            args=(index, set(symbols), self.budget, self.snapshot, stop_event),
+            name=f"grid-worker-{index}",
+            daemon=True
+        )
+        process.start()
+        self.workers[index] = process
+        self.stop_events[index] = stop_event
+
+    def stop_worker(self, index):
+        process = self.workers[index]
+        if process is None:
+            return
+        self.stop_events[index].set()
+        process.join(STOP_TIMEOUT)
+        if process.is_alive():
+            log_and_print(f"Worker {index} did not stop in time. Terminating.")
+            process.terminate()
+            process.join()
+        self.workers[index] = None
+
+    def rebalance(self, symbols):
+        """Applies a new symbol set, restarting only the workers whose shard changed."""
+        from binance_futures import reset_grid
+
+        configured = set().union(*self.assignment)
+        removed = configured - set(symbols)
+        new_assignment = assign_symbols(symbols, self.assignment, self.worker_count)
+
+        for index, (old, new) in enumerate(zip(self.assignment, new_assignment)):
+            if old != new or (new and self.workers[index] is None):
+                self.stop_worker(index)
+
+        # Removed symbols are reset here because their worker no longer owns them
+        for symbol in removed:
+            log_and_print(f"Symbol {symbol} was removed. Resetting its grid...")
+            reset_grid(symbol, self.api_key, self.api_secret)
+
+        for index, shard in enumerate(new_assignment):
+            changed = shard != self.assignment[index]
+            self.assignment[index] = shard
+            if changed or self.workers[index] is None:
+                self.start_worker(index)
+        log_and_print(f"Symbol assignment: {[sorted(shard) for shard in self.assignment]}")
+
+    def check_workers(self):
+        """Restarts crashed workers with exponential backoff."""
+        now = time.time()
+        for index, process in enumerate(self.workers):
+            if process is None or process.is_alive():
+                continue
+            if not self.restart_at[index]:
+                log_and_print(f"Worker {index} exited with code {process.exitcode}. "
+                              f"Restarting in {self.restart_delay[index]}s.")
+                self.restart_at[index] = now + self.restart_delay[index]
+            elif now >= self.restart_at[index]:
+                self.restart_at[index] = 0.0
+                self.restart_delay[index] = min(self.restart_delay[index] * 2, RESTART_BACKOFF[1])
+                self.start_worker(index)
+
+    def refresh_snapshot(self):
+        """Refreshes the shared account-wide positions (one positionRisk call for every worker)."""
+        from binance_futures import get_open_positions
+        get_open_positions(None, self.api_key, self.api_secret)
+
+    def run(self):
+        log_and_print(f"Supervisor starting with {self.worker_count} workers.")
+        symbols = set(load_json("config.json").get("crypto_settings", {}).keys())
+        self.rebalance(symbols)
+        last_config_check = time.time()
+        try:
+            while True:
+                self.refresh_snapshot()
+                self.check_workers()
+                if time.time() - last_config_check >= CONFIG_POLL_INTERVAL:
+                    last_config_check = time.time()
+                    try:
+                        current = set(load_json("config.json").get("crypto_settings", {}).keys())
+                    except Exception as e:
+                        print(f"Error reading config.json: {e}")
+                        current = set().union(*self.assignment)
+                    if current != set().union(*self.assignment):
+                        log_and_print("Configured symbols changed. Rebalancing workers...")
+                        self.rebalance(current)
+                time.sleep(SNAPSHOT_INTERVAL)
+        except KeyboardInterrupt:
+            log_and_print("Supervisor stopping workers...")
+        finally:
+            for index in range(self.worker_count):
+                self.stop_worker(index)
+            self.manager.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the grid bot as sharded worker processes.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker process count (default: cores, max one per symbol)")
+    parser.add_argument("--weight-per-minute", type=int, default=None, help="Account request weight limit per minute")
+    args = parser.parse_args()
+    Supervisor(args.workers, args.weight_per_minute).run()
+
+
+if __name__ == "__main__":
+    main()
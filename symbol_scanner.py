@@ -0,0 +1,249 @@
+import argparse
+import json
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from binance_futures import get_klines
+from indicator_cache import memoize_on_candle
+from resilience import request
+from strategy_sim import rolling_bollinger
+
+MARKET_DATA_URL = "https://fapi.binance.com"
+TICKER_24HR_WEIGHT = 40  # All symbols in one call
+BOOK_TICKER_WEIGHT = 5
+DEFAULT_MIN_QUOTE_VOLUME = 20_000_000  # USDT traded in the last 24 hours
+DEFAULT_MAX_SPREAD = 0.001  # Relative bid/ask spread
+DEFAULT_BB_PERIOD = 15
+SQUEEZE_LOOKBACK = 100  # Closed candles the current BBW is compared against
+FETCH_WORKERS = 16
+# Weights of the rank components in the score (lower score ranks first)
+SCORE_WEIGHTS = {"squeeze": 0.5, "liquidity": 0.3, "spread": 0.2}
+# Keys of the generated crypto_settings entries that are not derived from market data
+DEFAULT_SETTINGS = {
+    "grid_levels": 5,
+    "working_type": "CONTRACT_PRICE",
+    "leverage": 10,
+    "progressive_grid": "False",
+    "grid_progression": 1.1,
+    "bbw_threshold": 0.07,
+    "klines_interval": "4h",
+}
+NOTIONAL_MARGIN = 1.1  # Order notional headroom above the symbol's minimum
+
+
+def get_json(endpoint, params=None, weight=1):
+    response = request('GET', MARKET_DATA_URL + endpoint, params, weight=weight)
+    response.raise_for_status()
+    return response.json()
+
+
+def tradable_symbols(exchange_info, quote_asset="USDT"):
+    """
+    Returns {symbol: filters} for trading perpetual contracts in the quote asset.
+
+    filters holds 'min_notional', 'step_size', 'min_qty' and 'tick_size' as floats.
+    """
+    symbols = {}
+    for info in exchange_info.get('symbols', []):
+        if (info.get('status') != 'TRADING' or info.get('contractType') != 'PERPETUAL'
+                or info.get('quoteAsset') != quote_asset):
+            continue
+        filters = {f['filterType']: f for f in info.get('filters', [])}
+        symbols[info['symbol']] = {
+            'min_notional': float(filters.get('MIN_NOTIONAL', {}).get('notional', 5)),
+            'step_size': float(filters.get('LOT_SIZE', {}).get('stepSize', 1)),
+            'min_qty': float(filters.get('LOT_SIZE', {}).get('minQty', 0)),
+            'tick_size': float(filters.get('PRICE_FILTER', {}).get('tickSize', 0)),
+        }
+    return symbols
+
+
+def prefilter(tradable, tickers, book_tickers, min_quote_volume, max_spread):
+    """
+    Keeps tradable symbols with enough 24h volume and a tight enough spread.
+
+    Returns:
+        dict: {symbol: {'quote_volume', 'spread', 'price', **filters}}.
+    """
+    books = {book['symbol']: book for book in book_tickers}
+    survivors = {}
+    for ticker in tickers:
+        symbol = ticker['symbol']
+        if symbol not in tradable or symbol not in books:
+            continue
+        quote_volume = float(ticker['quoteVolume'])
+        bid, ask = float(books[symbol]['bidPrice']), float(books[symbol]['askPrice'])
+        if quote_volume < min_quote_volume or bid <= 0 or ask <= 0:
+            continue
+        spread = (ask - bid) / ((ask + bid) / 2)
+        if spread > max_spread:
+            continue
+        survivors[symbol] = {'quote_volume': quote_volume, 'spread': spread, 'price': float(ticker['lastPrice']),
+                             **tradable[symbol]}
+    return survivors
+
+
+def fetch_closed_closes(symbol, klines_interval, limit):
+    """
+    Returns the closes of the last `limit` closed candles.
+
+    Only closed candles are used, so the result is cached until the next candle closes.
+    """
+    def fetch():
+        candles = get_klines(symbol, klines_interval, limit + 1)
+        return np.array([float(candle[4]) for candle in candles[:-1]])
+
+    return memoize_on_candle(symbol, 'scanner_closes', klines_interval, limit, fetch)
+
+
+def squeeze_metrics(closes, bb_period):
+    """
+    Returns (current BBW, percentile of the current BBW within the lookback) for one symbol.
+
+    A low percentile means the bands are narrower than usual: a squeeze.
+    """
+    bbw = rolling_bollinger(closes, bb_period)["bbw"][0]
+    history = bbw[~np.isnan(bbw)]
+    if not len(history):
+        return math.nan, math.nan
+    return float(history[-1]), float((history <= history[-1]).mean())
+
+
+def rank(values, descending=False):
+    """Returns the 0..1 rank of every value (0 = best)."""
+    values = np.asarray(values, dtype=np.float64)
+    order = np.argsort(-values if descending else values, kind="stable")
+    ranks = np.empty(len(values))
+    ranks[order] = np.arange(len(values))
+    return ranks / max(len(values) - 1, 1)
+
+
+def order_quantity(candidate):
+    """Smallest order quantity that clears the symbol's minimum notional with headroom."""
+    step = candidate['step_size']
+    quantity = candidate['min_notional'] * NOTIONAL_MARGIN / candidate['price']
+    quantity = max(math.ceil(quantity / step) * step, candidate['min_qty'])
+    decimals = max(0, -int(math.floor(math.log10(step)))) if step < 1 else 0
+    return round(quantity, decimals) if decimals else int(round(quantity))
+
+
+def to_crypto_settings(symbol, candidate, base_settings):
+    """
+    Builds a ready-to-paste crypto_settings entry for a scanned symbol.
+
+    Args:
+        symbol (str): Trading pair.
+        candidate (dict): Scan result of the symbol.
+        base_settings (dict): Defaults for the keys not derived from market data.
+
+    Returns:
+        dict: {symbol: settings}.
+    """
+    settings = dict(base_settings)
+    settings["symbol"] = symbol
+    settings["order_quantity"] = order_quantity(candidate)
+    return {symbol: settings}
+
+
+def scan(klines_interval="4h", bb_period=DEFAULT_BB_PERIOD, min_quote_volume=DEFAULT_MIN_QUOTE_VOLUME,
+         max_spread=DEFAULT_MAX_SPREAD, top=10, base_settings=None, exclude=(), workers=FETCH_WORKERS):
+    """
+    Scans every USDT perpetual for grid candidates.
+
+    Three bulk requests (24hr ticker, exchangeInfo, bookTicker) prefilter the universe
+    by tradability, 24h quote volume and spread; closed candles are then fetched
+    concurrently for the survivors only. Symbols are ranked by a weighted average of
+    their squeeze (percentile of the current BBW within the lookback), liquidity and
+    spread ranks.
+
+    Args:
+        klines_interval (str): Candlestick interval the BBW is calculated on.
+        bb_period (int): Bollinger Bands period.
+        min_quote_volume (float): Minimum 24h quote volume.
+        max_spread (float): Maximum relative bid/ask spread.
+        top (int): Number of candidates returned.
+        base_settings (dict, optional): Defaults for the generated crypto_settings entries.
+        exclude (iterable): Symbols left out (e.g. the ones already configured).
+        workers (int): Concurrent kline requests.
+
+    Returns:
+        dict: {'ranked': [candidate, ...], 'crypto_settings': {...}, 'scanned', 'prefiltered', 'elapsed'}.
+    """
+    start = time.monotonic()
+    base_settings = {**DEFAULT_SETTINGS, "klines_interval": klines_interval, **(base_settings or {})}
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        tickers = pool.submit(get_json, "/fapi/v1/ticker/24hr", weight=TICKER_24HR_WEIGHT)
+        exchange_info = pool.submit(get_json, "/fapi/v1/exchangeInfo")
+        book_tickers = pool.submit(get_json, "/fapi/v1/ticker/bookTicker", weight=BOOK_TICKER_WEIGHT)
+        tradable = tradable_symbols(exchange_info.result())
+        survivors = prefilter(tradable, tickers.result(), book_tickers.result(), min_quote_volume, max_spread)
+    for symbol in exclude:
+        survivors.pop(symbol, None)
+
+    limit = SQUEEZE_LOOKBACK + bb_period - 1
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {symbol: pool.submit(fetch_closed_closes, symbol, klines_interval, limit) for symbol in survivors}
+        for symbol, future in futures.items():
+            try:
+                survivors[symbol]['bbw'], survivors[symbol]['squeeze'] = squeeze_metrics(future.result(), bb_period)
+            except Exception as e:
+                print(f"Skipping {symbol}: {e}")
+                survivors[symbol]['bbw'] = survivors[symbol]['squeeze'] = math.nan
+
+    candidates = {symbol: data for symbol, data in survivors.items() if not math.isnan(data['squeeze'])}
+    symbols = list(candidates)
+    if symbols:
+        score = (SCORE_WEIGHTS["squeeze"] * rank([candidates[s]['squeeze'] for s in symbols])
+                 + SCORE_WEIGHTS["liquidity"] * rank([candidates[s]['quote_volume'] for s in symbols], descending=True)
+                 + SCORE_WEIGHTS["spread"] * rank([candidates[s]['spread'] for s in symbols]))
+        for symbol, value in zip(symbols, score):
+            candidates[symbol]['score'] = float(value)
+    ranked = sorted(({'symbol': s, **data} for s, data in candidates.items()), key=lambda row: row['score'])[:top]
+
+    crypto_settings = {}
+    for row in ranked:
+        crypto_settings.update(to_crypto_settings(row['symbol'], row, base_settings))
+    return {
+        'ranked': ranked,
+        'crypto_settings': crypto_settings,
+        'scanned': len(tradable),
+        'prefiltered': len(survivors),
+        'elapsed': time.monotonic() - start,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scan all USDT perpetuals for grid candidates.")
+    parser.add_argument("--interval", default=DEFAULT_SETTINGS["klines_interval"], help="Klines interval for the BBW")
+    parser.add_argument("--bb-period", type=int, default=DEFAULT_BB_PERIOD)
+    parser.add_argument("--min-volume", type=float, default=DEFAULT_MIN_QUOTE_VOLUME, help="Minimum 24h quote volume")
+    parser.add_argument("--max-spread", type=float, default=DEFAULT_MAX_SPREAD, help="Maximum relative spread")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--include-configured", action="store_true", help="Also rank symbols already in config.json")
+    parser.add_argument("--output", help="Write the candidate crypto_settings to this JSON file")
+    args = parser.parse_args()
+
+    exclude = ()
+    if not args.include_configured:
+        from file_utils import load_json
+        exclude = load_json("config.json").get("crypto_settings", {}).keys()
+
+    report = scan(args.interval, args.bb_period, args.min_volume, args.max_spread, args.top, exclude=exclude)
+    print(f"Scanned {report['scanned']} symbols, {report['prefiltered']} passed the prefilter "
+          f"({report['elapsed']:.1f} s).")
+    for row in report["ranked"]:
+        print(f"{row['symbol']}: score={row['score']:.2f} bbw={row['bbw']:.4f} squeeze={row['squeeze']:.2f} "
+              f"volume={row['quote_volume'] / 1e6:.1f}M spread={row['spread'] * 100:.3f}%")
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"crypto_settings": report["crypto_settings"]}, file, indent=2)
+        print(f"Candidates written to {args.output}.")
+    else:
+        print(json.dumps(report["crypto_settings"], indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import sys
+import threading
+
+import pytest
+
+from action_scheduler import ActionScheduler, REPLACE, BUILD
+
+
+def test_system_exit_in_action_is_raised_by_drain():
+    scheduler = ActionScheduler(workers=2)
+    started = []
+    scheduler.submit("A", REPLACE, sys.exit, 1)
+    with pytest.raises(SystemExit):
+        scheduler.drain()
+    # Nothing is started after the exit
+    scheduler.submit("B", BUILD, started.append, "B")
+    with pytest.raises(SystemExit):
+        scheduler.drain()
+    scheduler.shutdown()
+    assert started == []
+    assert not any(thread.is_alive() for thread in scheduler._threads)
+
+
+def test_exception_in_action_is_logged_and_pool_keeps_running():
+    scheduler = ActionScheduler(workers=2)
+    done = []
+    scheduler.submit("A", REPLACE, lambda: 1 / 0)
+    scheduler.submit("A", REPLACE, done.append, "A")
+    scheduler.submit("B", BUILD, done.append, "B")
+    scheduler.drain()
+    scheduler.shutdown()
+    assert sorted(done) == ["A", "B"]
+
+
+def test_actions_of_one_symbol_run_in_order():
+    scheduler = ActionScheduler(workers=4)
+    order = []
+    lock = threading.Lock()
+
+    def record(value):
+        with lock:
+            order.append(value)
+
+    for i in range(20):
+        scheduler.submit("A", BUILD if i % 2 else REPLACE, record, i)
+    scheduler.drain()
+    scheduler.shutdown()
+    assert order == list(range(20))
@@ -0,0 +1,40 @@
+import pytest
+
+import emergency
+from file_utils import state_dir
+
+ERROR = {"error": "Service unavailable"}
+
+
+@pytest.fixture
+def degraded_api(tmp_path, monkeypatch):
+    """Fakes an exchange whose account-wide position endpoint fails and SXPUSDT's per-symbol one too."""
+    token = state_dir.set(str(tmp_path))
+    closed = []
+    positions = {"SXPUSDT": ERROR, "1000SHIBUSDT": [{'symbol': "1000SHIBUSDT", 'positionAmt': "-3"}]}
+    monkeypatch.setattr(emergency, "get_all_open_positions", lambda api_key, api_secret: ERROR)
+    monkeypatch.setattr(emergency, "get_open_positions", lambda symbol, api_key, api_secret: positions[symbol])
+    monkeypatch.setattr(emergency, "get_all_open_orders", lambda api_key, api_secret: [])
+    monkeypatch.setattr(emergency, "cancel_all_open_orders", lambda symbol, api_key, api_secret: True)
+    monkeypatch.setattr(emergency, "place_market_order",
+                        lambda symbol, side, quantity, api_key, api_secret, reduce_only: closed.append((symbol, side, quantity)) or {'orderId': 1})
+    yield closed
+    state_dir.reset(token)
+
+
+def test_flatten_survives_per_symbol_position_errors(degraded_api):
+    result = emergency.flatten_account("key", "secret", ["SXPUSDT", "1000SHIBUSDT"])
+    assert degraded_api == [("1000SHIBUSDT", "BUY", 3.0)]
+    assert result['closed'] == ["1000SHIBUSDT"]
+    assert result['unverified'] == ["SXPUSDT"]
+    assert result['remaining_positions'] is None
+    assert result['remaining_orders'] == []
+
+
+def test_verification_read_clears_unverified_symbols(degraded_api, monkeypatch):
+    reads = iter([ERROR, [{'symbol': "SXPUSDT", 'positionAmt': "2"}]])
+    monkeypatch.setattr(emergency, "get_all_open_positions", lambda api_key, api_secret: next(reads))
+    result = emergency.flatten_account("key", "secret", ["SXPUSDT", "1000SHIBUSDT"])
+    assert ("SXPUSDT", "SELL", 2.0) in degraded_api
+    assert result['unverified'] == []
+    assert result['remaining_positions'] == []
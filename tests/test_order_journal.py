@@ -0,0 +1,23 @@
+from order_journal import (MAX_CLIENT_ID_LENGTH, make_client_order_id, new_generation, next_client_order_id,
+                           parse_client_order_id)
+
+
+def test_generations_are_unique_within_one_second():
+    generations = [new_generation() for _ in range(1000)]
+    assert len(set(generations)) == len(generations)
+    ids = {make_client_order_id("1000SHIBUSDT", generation, "SELL", 1) for generation in generations}
+    assert len(ids) == len(generations)
+
+
+def test_client_order_ids_fit_the_exchange_limit():
+    generation = new_generation()
+    for symbol in ("1000SHIBUSDT", "1000000BOBUSDT", "BROCCOLI714USDT" * 2):
+        for level, seq in ((1, 0), (12, 9), (99, 12345)):
+            client_id = make_client_order_id(symbol, generation, "BUY", level, seq)
+            assert len(client_id) <= MAX_CLIENT_ID_LENGTH
+            parsed = parse_client_order_id(client_id)
+            assert (parsed['generation'], parsed['side'], parsed['level'], parsed['seq']) == (generation, "BUY", level, seq)
+    # Short symbols are kept whole
+    client_id = make_client_order_id("1000SHIBUSDT", generation, "SELL", 3, 2)
+    assert parse_client_order_id(client_id)['symbol'] == "1000SHIBUSDT"
+    assert parse_client_order_id(next_client_order_id(client_id, "BUY"))['seq'] == 3
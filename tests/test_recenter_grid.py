@@ -0,0 +1,73 @@
+import pytest
+
+import order_management
+from file_utils import state_dir
+from grid_state import GridOrder, GridState, load_grid_state
+from order_journal import make_client_order_id, next_client_order_id, parse_client_order_id
+from paper_trading import PaperExchange, execution_backend
+
+SYMBOL = "SXPUSDT"
+GENERATION = "old"
+
+
+@pytest.fixture
+def exchange(tmp_path, monkeypatch):
+    exchange = PaperExchange("test")
+    backend_token = execution_backend.set(exchange)
+    state_token = state_dir.set(str(tmp_path))
+    monkeypatch.setattr(order_management, "get_credentials", lambda: ("key", "secret"))
+    yield exchange
+    state_dir.reset(state_token)
+    execution_backend.reset(backend_token)
+
+
+def place(exchange, state, side, level, price, seq=0):
+    client_id = make_client_order_id(SYMBOL, GENERATION, side, level, seq)
+    order = exchange.place_limit_order(SYMBOL, side, 1.0, price, client_id)
+    state.add(GridOrder(order['orderId'], client_id, price, side, 1.0))
+    return order
+
+
+def test_recenter_keeps_counter_orders_and_unreplaced_fills(exchange):
+    exchange.on_price(SYMBOL, 100.0)
+    state = GridState(SYMBOL, generation=GENERATION)
+    for level, price in enumerate((101.0, 102.0, 103.0), start=1):
+        place(exchange, state, 'SELL', level, price)
+    buys = [place(exchange, state, 'BUY', level, price) for level, price in enumerate((99.0, 98.0, 97.0), start=1)]
+
+    # BUY 1 fills and is replaced by its counter-order; BUY 2 fills and is not replaced yet
+    exchange.on_price(SYMBOL, 99.0)
+    counter_id = next_client_order_id(buys[0]['clientOrderId'], 'SELL')
+    counter = exchange.place_limit_order(SYMBOL, 'SELL', 1.0, 100.0, counter_id)
+    state.replace(buys[0]['orderId'], GridOrder(counter['orderId'], counter_id, 100.0, 'SELL', 1.0))
+    exchange.on_price(SYMBOL, 98.0)
+    assert exchange.positions[SYMBOL][0] == 2.0
+
+    open_orders = exchange.get_open_orders(SYMBOL)
+    order_management.recenter_grid(SYMBOL, open_orders, state, 98.5, 110.0, 86.0, 4, 1.0, 0.1, 0.001, "CONTRACT_PRICE")
+
+    # The position is untouched and its counter-order rests where it was
+    assert exchange.positions[SYMBOL][0] == 2.0
+    resting = {order['orderId']: order for order in exchange.get_open_orders(SYMBOL)}
+    assert float(resting[counter['orderId']]['price']) == 100.0
+    assert resting[counter['orderId']]['clientOrderId'] == counter_id
+
+    saved = load_grid_state(SYMBOL)
+    assert saved.generation != GENERATION
+    assert saved.get(buys[1]['orderId']) is not None  # Filled, waiting for its replacement
+    assert saved.get(counter['orderId']).client_order_id == counter_id
+
+    # Two BUY levels are taken by the fills: only levels 3 and 4 rest below the market
+    grid_buys = sorted((order for order in resting.values() if order['side'] == 'BUY'), key=lambda o: -float(o['price']))
+    assert [parse_client_order_id(order['clientOrderId'])['level'] for order in grid_buys] == [3, 4]
+    # Same uniform levels a new grid would get: (110 - 86) / 8 = 3 apart from 98.5
+    assert [float(order['price']) for order in grid_buys] == [89.5, 86.5]
+    grid_sells = [order for order in resting.values() if order['side'] == 'SELL' and order['orderId'] != counter['orderId']]
+    assert len(grid_sells) == 4
+
+    # Orders placed by the re-center use the new generation, modified ones keep their IDs
+    for order in resting.values():
+        parsed = parse_client_order_id(order['clientOrderId'])
+        if parsed['level'] == 4:
+            assert parsed['generation'] == saved.generation
+    assert {order.order_id for order in saved} == set(resting) | {buys[1]['orderId']}